@@ -7,7 +7,6 @@ import tempfile
 import re
 import logging
 import time
-import matplotlib.pyplot as plt
 import io
 import os
 import datetime
@@ -18,8 +17,18 @@ import re
 import requests
 import base64
 import os
+import sys
+import traceback
 from dotenv import load_dotenv
 
+# Share the intent classifier, table parser, media-plan checks and plot rendering/repair with the API server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "react-app", "server"))
+from intent import classify_intent
+from media_plan import fix_media_plans
+from plot_render import execute_plot_code, warm_up
+from plot_repair import MAX_PLOT_ATTEMPTS, REPAIR_MODEL, build_repair_messages, validate_plot_code
+from table_parser import parse_tables
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -43,6 +52,9 @@ except KeyError:
     st.error("⚠️ API keys not found in Streamlit secrets. Please configure them.")
     st.stop()
 
+# ✅ Build the matplotlib font cache once per process, not on the first plot (no-op on reruns)
+warm_up()
+
 # ✅ Initialize session state
 if 'sessions' not in st.session_state:
     st.session_state.sessions = {'Default': []}
@@ -503,7 +515,12 @@ def extract_code(text):
     match = re.search(r"```(?:python)?\n(.*?)```", text, re.DOTALL)
     return match.group(1).strip() if match else text.strip()
 
-def generate_plot_code(knowledge, query, reply):
+def record_plot_usage(usage, response):
+    usage["attempts"] += 1
+    if response.usage:
+        usage["tokens"] += response.usage.total_tokens
+
+def generate_plot_code(knowledge, query, reply, usage):
     """Generate matplotlib code for visualization"""
     system_prompt = "You are a Python assistant. Output only valid matplotlib code using data given to you. You can generate multiple plots, so generate code in that way. If there is no sufficient Knowledge Base data, rely on the Answer"
     user_prompt = f"""Knowledge Base:\n{knowledge}\n\nUser Query:\n{query}\n\nAnswer:\n{reply}"""
@@ -516,11 +533,26 @@ def generate_plot_code(knowledge, query, reply):
             ],
             temperature=0.3
         )
+        record_plot_usage(usage, response)
         return extract_code(response.choices[0].message.content)
     except Exception as e:
         logger.error(f"Code generation failed: {e}")
         return None
 
+def repair_plot_code(plot_code, error, usage):
+    """Ask for a fix of failing plot code, sending only the code and its error"""
+    try:
+        response = openai_client.chat.completions.create(
+            model=REPAIR_MODEL,
+            messages=build_repair_messages(plot_code, error),
+            temperature=0
+        )
+        record_plot_usage(usage, response)
+        return extract_code(response.choices[0].message.content)
+    except Exception as e:
+        logger.error(f"Code repair failed: {e}")
+        return None
+
 def get_gemini_response(prompt, conversation_history=None):
     """Get response from Gemini with conversation context"""
     try:
@@ -636,6 +668,8 @@ if "plot_code" not in st.session_state:
     st.session_state.plot_code = ""
 if "tables" not in st.session_state:
     st.session_state.tables = {}
+if "table_csvs" not in st.session_state:
+    st.session_state.table_csvs = {}
 if "last_input" not in st.session_state:
     st.session_state.last_input = ""
 if "gemini_reply" not in st.session_state:
@@ -656,6 +690,7 @@ if new_input:
     st.session_state.plot_figure = None
     st.session_state.plot_code = None
     st.session_state.tables[st.session_state.current_session] = []
+    st.session_state.table_csvs[st.session_state.current_session] = []
 
     # base_chat_prompt = """<...your full base prompt here...>"""
     base_chat_prompt = (
@@ -686,7 +721,7 @@ if new_input:
 "  2. First table row = main metric headers: Medium, Clicks, CPC, Impressions, CPM, Views, CPV, CTR, Leads, CPL, Total Cost.\n"
 "  3. Second row = subheaders (e.g., Channel, Exp. Link Clicks, etc.).\n"
 "  4. List each platform (e.g., TikTok, YouTube) in a row with corresponding metrics.\n"
-"  5. At the bottom, include summary rows: Net Total, Total Clicks, Impressions, Views, etc.\n"
+"  5. Leave out totals and summary rows: the system recomputes the rates (CPC, CPM, CPV, CTR, CPL) from the budgets and volumes and adds the Net Total row.\n"
 "  6. Format the entire table in markdown using `|`, just like other tables.\n"
 "  7. Do not explain the table — output the TONIC table directly with any other requested info (like recommendations or insights).\n"
 "- Example:\n"
@@ -700,11 +735,7 @@ if new_input:
 "  | YouTube Ads | 5,630 | AED2.13 | 806,248 | AED14.88 | 544,218 | AED0.02 | 0.70 | 120 | 100 | 12000 |\n"
 "  | Search Ads | 5,246 | AED2.21 |  |  |  |  |  | 116 | 100 | 11600 |\n"
 "  | Google Display Ads | 7,850 | AED1.03 | 2,448,980 | AED3.31 | NA | NA | 0.32 | 81 | 100 | 8100 |\n"
-"  | | | | | | | | | | | |\n"
-"  | | | | | | | | Net Total | AED80,000 | | |\n"
-"  | | | | | | | | Total Clicks | 53,235 | | |\n"
-"  | | | | | | | | Total Impressions | 13,893,513 | | |\n"
-"  | | | | | | | | Total Views | 1,358,183 | | |\n\n"
+"\n"
 
 "- Use this format **only** if the user's query is about media planning, digital ad performance, or channel-level budget/performance comparison.\n"
 
@@ -727,6 +758,11 @@ if new_input:
     conversation_history = st.session_state.sessions.get(curr_id, [])
 
     gemini_reply, gemini_sources = get_perplexity_response(full_prompt, conversation_history)
+    try:
+        # Media-plan rates and totals are recomputed here rather than taken from the model
+        gemini_reply, _, _ = fix_media_plans(gemini_reply)
+    except Exception as e:
+        logger.error(f"Media plan check error: {e}")
 
     st.session_state.gemini_reply = gemini_reply
     st.session_state.gemini_sources = gemini_sources
@@ -744,43 +780,50 @@ if new_input:
     })
 
     # ========== PLOT GENERATION ========== #
-    if any(word in user_input.lower() for word in ["graph", "plot", "chart", "visual"]):
+    if classify_intent(user_input).label == "visualization":
         if user_input != st.session_state.get('last_plot_input'):
             st.session_state.last_plot_input = user_input
             st.session_state.plot_buffer = None
             st.session_state.plot_figure = None
             st.session_state.plot_generated = False
 
-            for attempt in range(3):
-                with st.spinner(f"Generating visual... Attempt {attempt+1}"):
-                    plot_code = generate_plot_code(
-                        st.session_state.knowledge_base,
-                        user_input,
-                        gemini_reply
-                    )
-
-                    if plot_code:
-                        try:
-                            plt.clf()
-                            exec_globals = {"plt": plt, "__name__": "__main__", "pd": pd}
-                            plot_code = re.sub(r"plt\\.show\\(\\)", "", plot_code)
-                            exec(plot_code, exec_globals)
-
-                            fig = plt.gcf()
-                            # st.pyplot(fig)
-
-                            buf = io.BytesIO()
-                            fig.savefig(buf, format="png", dpi=300, bbox_inches='tight')
-                            buf.seek(0)
-
-                            st.session_state.plot_buffer = buf
-                            st.session_state.plot_figure = fig
-                            st.session_state.plot_code = plot_code
-                            st.session_state.plot_generated = True
-                            break
-
-                        except Exception as e:
-                            st.error(f"⚠️ Plot failed: {e}")
+            usage = {"attempts": 0, "tokens": 0}
+            with st.spinner("Generating visual..."):
+                plot_code = generate_plot_code(
+                    st.session_state.knowledge_base,
+                    user_input,
+                    gemini_reply,
+                    usage
+                )
+
+            while plot_code:
+                plot_code = re.sub(r"plt\\.show\\(\\)", "", plot_code)
+                error = validate_plot_code(plot_code)
+                if error is None:
+                    try:
+                        # Each run gets its own Figure, so concurrent sessions never share pyplot state
+                        fig = execute_plot_code(plot_code, extra_globals={"pd": pd})
+                        # st.pyplot(fig)
+
+                        buf = io.BytesIO()
+                        fig.savefig(buf, format="png", dpi=300, bbox_inches='tight')
+                        buf.seek(0)
+
+                        st.session_state.plot_buffer = buf
+                        st.session_state.plot_figure = fig
+                        st.session_state.plot_code = plot_code
+                        st.session_state.plot_generated = True
+                        logger.info(f"Plot rendered after {usage['attempts']} LLM calls, {usage['tokens']} tokens")
+                        break
+
+                    except Exception:
+                        error = traceback.format_exc()
+
+                if usage["attempts"] >= MAX_PLOT_ATTEMPTS:
+                    st.error(f"⚠️ Plot failed: {error.strip().splitlines()[-1]}")
+                    break
+                with st.spinner(f"Fixing visual... Attempt {usage['attempts'] + 1}"):
+                    plot_code = repair_plot_code(plot_code, error, usage)
         else:
             if st.session_state.get("plot_figure"):
                 st.pyplot(st.session_state.plot_figure)
@@ -789,36 +832,8 @@ if new_input:
     tables = []
     if "|" in gemini_reply:
         try:
-            lines = gemini_reply.split('\n')
-            table_blocks = []
-            current_block = []
-
-            for line in lines:
-                if '|' in line and line.strip():
-                    current_block.append(line.strip())
-                elif current_block:
-                    table_blocks.append(current_block)
-                    current_block = []
-
-            if current_block:
-                table_blocks.append(current_block)
-
-            for block in table_blocks:
-                if len(block) >= 2:
-                    if re.match(r'\s*\|?\s*-+\s*\|', block[1]):
-                        block.pop(1)
-
-                    headers = [col.strip() for col in block[0].split('|') if col.strip()]
-                    data_rows = []
-                    for row in block[1:]:
-                        cols = [col.strip() for col in row.split('|') if col.strip()]
-                        if len(cols) == len(headers):
-                            data_rows.append(cols)
-
-                    if data_rows:
-                        df = pd.DataFrame(data_rows, columns=headers)
-                        tables.append(df)
-
+            # Shown and downloaded as written (units, subheader row); to_dataframe() is for computation
+            tables = [pd.DataFrame(table.records()) for table in parse_tables(gemini_reply)]
             logger.info(f"✅ Found {len(tables)} markdown tables")
 
         except Exception as e:
@@ -826,6 +841,10 @@ if new_input:
 
         if tables:
             st.session_state.tables[st.session_state.current_session] = tables
+            # Serialized once here rather than on every rerun that shows the download buttons
+            st.session_state.table_csvs[st.session_state.current_session] = [
+                df.to_csv(index=False).encode('utf-8') for df in tables
+            ]
             st.success(f"✅ Found {len(tables)} table(s) in the response")
 
 # === ALWAYS SHOW LATEST GEMINI REPLY === #
@@ -845,10 +864,11 @@ if st.session_state.get("plot_generated") and st.session_state.get("plot_buffer"
 
 # === ALWAYS SHOW TABLES IF AVAILABLE === #
 tables = st.session_state.tables.get(st.session_state.current_session, [])
+table_csvs = st.session_state.table_csvs.get(st.session_state.current_session, [])
 for idx, df in enumerate(tables):
     with st.expander(f"📊 Table {idx + 1}"):
         st.dataframe(df, use_container_width=True)
-        csv = df.to_csv(index=False).encode('utf-8')
+        csv = table_csvs[idx] if idx < len(table_csvs) else df.to_csv(index=False).encode('utf-8')
         st.download_button(
             label=f"⬇️ Download Table {idx + 1} as CSV",
             data=csv,
@@ -1,25 +1,42 @@
-from flask import Flask, request, jsonify, send_file, make_response
+from flask import Flask, request, jsonify, send_file, make_response, Response, stream_with_context
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from flask_sqlalchemy import SQLAlchemy
 import fitz  # PyMuPDF
 import pandas as pd
-import openai
-import google.generativeai as genai
+import asyncio
+import concurrent.futures
 import tempfile
 import re
 import logging
 import time
-import matplotlib.pyplot as plt
 import io
 import os
 import datetime
-import requests
 import base64
 import numpy as np
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
 import json
+import providers
+from providers import ProviderError
+from provider_router import AllProvidersFailed, Route, latency_snapshot, route_call
+from resilience import breaker_snapshot, stream_with_resilience
+from metrics import PLOT_ATTEMPTS, PLOT_CACHE_LOOKUPS, PLOT_GENERATIONS, PLOT_LLM_TOKENS, render_metrics
+from chart_builder import build_chart_code, build_chart_spec
+from chat_search import SEARCH_MAX_PAGE_SIZE, SEARCH_PAGE_SIZE, get_search_backend, search_messages, setup_search_index
+from plot_jobs import get_plot_job, run_render, start_plot_job
+from intent import classify_intent, wants_plot
+from plot_repair import MAX_PLOT_ATTEMPTS, REPAIR_MODEL, build_repair_messages, validate_plot_code
+from plot_cache import DEFAULT_VARIANT, PLOT_IMAGE_FORMATS, PLOT_VARIANTS, custom_variant, get_plot_store
+from plot_sandbox import PlotRenderError, get_renderer_pool
+from rate_limiter import estimate_message_tokens, estimate_tokens, limiter_snapshot
+from table_codec import encode_table, encode_tables, negotiate_table_format
+from table_export import TABLE_EXPORT_FORMATS, content_hash, get_table_export_cache, table_parquet
+from media_plan import fix_media_plan, fix_media_plans
+from table_parser import TableStreamParser, columnar_tables, parse_tables
+from user_cache import get_user_id_cache
+from chat_writer import ASYNC as CHAT_ASYNC, SYNC as CHAT_SYNC, ChatTurn, ChatWriter, IdBlocks
 
 # Load environment variables
 load_dotenv()
@@ -44,9 +61,11 @@ db = SQLAlchemy(app)
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your-secret-key')
 jwt = JWTManager(app)
 
+CORS_ORIGINS = ['http://localhost:3000', 'http://localhost:8501', 'http://127.0.0.1:3000', 'http://127.0.0.1:8501']
+
 # Configure CORS properly
 CORS(app, 
-     origins=['http://localhost:3000', 'http://localhost:8501', 'http://127.0.0.1:3000', 'http://127.0.0.1:8501'],
+     origins=CORS_ORIGINS,
      supports_credentials=True, 
      methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
      allow_headers=['Content-Type', 'Authorization', 'X-Requested-With', 'Accept', 'Origin'],
@@ -59,15 +78,8 @@ def after_request(response):
     origin = request.headers.get('Origin')
     if origin:
         # Handle both localhost and 127.0.0.1 variations
-        allowed_origins = [
-            'http://localhost:3000', 
-            'http://localhost:8501', 
-            'http://127.0.0.1:3000', 
-            'http://127.0.0.1:8501'
-        ]
-        
         # Check if origin is in allowed list
-        if origin in allowed_origins:
+        if origin in CORS_ORIGINS:
             response.headers.add('Access-Control-Allow-Origin', origin)
         # Also handle case where browser sends localhost but we expect 127.0.0.1 or vice versa
         elif origin == 'http://localhost:3000':
@@ -86,32 +98,15 @@ def after_request(response):
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("TONIC AI")
 
-# API Keys
-PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
-PERPLEXITY_API_URL = "https://api.perplexity.ai/chat/completions"
+# API Keys (provider clients live in providers.py)
+PERPLEXITY_API_KEY = providers.PERPLEXITY_API_KEY
 
 # Configure AI models
-try:
-    gemini_key = os.getenv("GEMINI_API_KEY")
-    openai_key = os.getenv("OPENAI_API_KEY")
-    
-    if gemini_key:
-        genai.configure(api_key=gemini_key)
-        logger.info("✅ Gemini API configured successfully")
+for provider_name, env_var in (("gemini", "GEMINI_API_KEY"), ("openai", "OPENAI_API_KEY"), ("perplexity", "PERPLEXITY_API_KEY")):
+    if providers.is_configured(provider_name):
+        logger.info(f"✅ {provider_name.capitalize()} API configured successfully")
     else:
-        logger.warning("⚠️ GEMINI_API_KEY not found in environment variables")
-    
-    if openai_key:
-        openai_client = openai.OpenAI(api_key=openai_key)
-        logger.info("✅ OpenAI API configured successfully")
-    else:
-        logger.warning("⚠️ OPENAI_API_KEY not found in environment variables")
-        openai_client = None
-        
-except Exception as e:
-    logger.error(f"Failed to configure AI models: {e}")
-    # Initialize with None if configuration fails
-    openai_client = None
+        logger.warning(f"⚠️ {env_var} not found in environment variables")
 
 # User credentials (in production, use a database)
 USERS = {
@@ -135,6 +130,8 @@ class User(db.Model):
 
 class ChatSession(db.Model):
     __tablename__ = 'chat_sessions'
+    # Keyset pagination of a user's sessions, newest first (see get_chat_history)
+    __table_args__ = (db.Index('idx_chat_sessions_user_created', 'user_id', 'created_at', 'id'),)
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -142,23 +139,48 @@ class ChatSession(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     
     # Relationship
-    messages = db.relationship('ChatMessage', backref='session', lazy=True, cascade='all, delete-orphan')
+    messages = db.relationship('ChatMessage', backref='session', lazy=True, cascade='all, delete-orphan',
+                               order_by='ChatMessage.timestamp')
     
     def __repr__(self):
         return f'<ChatSession {self.session_name}>'
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
+    # Keyset pagination of a session's messages (see get_chat_session_history)
+    __table_args__ = (db.Index('idx_chat_messages_session_timestamp', 'session_id', 'timestamp', 'id'),)
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('chat_sessions.id'), nullable=False)
     question = db.Column(db.Text, nullable=False)
     answer = db.Column(db.Text, nullable=False)
+    # Code of the chart shown with this answer, so it can be re-rendered without the LLM
+    plot_code = db.Column(db.Text, nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     
+    tables = db.relationship('ChatTable', backref='message', lazy=True, cascade='all, delete-orphan',
+                             order_by='ChatTable.position')
+    
     def __repr__(self):
         return f'<ChatMessage {self.id}>'
 
+class ChatTable(db.Model):
+    __tablename__ = 'chat_tables'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('chat_messages.id', ondelete='CASCADE'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+    column_count = db.Column(db.Integer, nullable=False)
+    # SHA-256 of data; the ETag and export cache key
+    content_hash = db.Column(db.String(64), nullable=False)
+    # Typed table as Parquet (see table_export); deferred so ownership checks never load it
+    data = db.deferred(db.Column(db.LargeBinary, nullable=False))
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ChatTable {self.id}>'
+
 class KnowledgeBase(db.Model):
     __tablename__ = 'knowledge_bases'
     
@@ -176,34 +198,99 @@ sessions = {}
 knowledge_bases = {}
 user_sessions = {}
 
-def ensure_user_exists_for_history(username):
+def upsert_history_user(username):
     """
-    Ensure a user exists in the database for chat history purposes.
-    This function creates a user record if it doesn't exist, without affecting login authentication.
+    Id of the chat-history user row for a username, inserting it if missing.
+    The insert is INSERT ... ON CONFLICT (username) DO NOTHING on Postgres and
+    SQLite, so concurrent first requests for a new user cannot fail on the
+    unique constraint. The row only backs chat history; authentication still
+    uses the USERS dictionary.
     """
-    try:
-        # Check if user already exists in database
-        user = User.query.filter_by(username=username).first()
-        if user:
-            return user
-        
-        # User doesn't exist in database, create them for chat history
-        # Note: We don't set a password_hash since this is only for chat history
-        # The actual authentication still uses the USERS dictionary
-        new_user = User(
-            username=username,
-            password_hash='chat_history_only'  # Placeholder, not used for auth
-        )
-        db.session.add(new_user)
+    from sqlalchemy import select
+    from sqlalchemy.exc import IntegrityError
+
+    users = User.__table__
+    lookup = select(users.c.id).where(users.c.username == username)
+    user_id = db.session.execute(lookup).scalar()
+    if user_id is not None:
+        return user_id
+
+    values = {
+        "username": username,
+        "password_hash": "chat_history_only",  # Placeholder, not used for auth
+        "created_at": datetime.datetime.utcnow(),
+    }
+    dialect = db.engine.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(users).values(**values).on_conflict_do_nothing(index_elements=["username"])
+        user_id = db.session.execute(statement.returning(users.c.id)).scalar()
         db.session.commit()
-        
-        logger.info(f"Created user '{username}' in database for chat history")
-        return new_user
-        
+    else:
+        try:
+            user_id = db.session.execute(users.insert().values(**values)).inserted_primary_key[0]
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            user_id = None
+
+    if user_id is None:
+        # Another request created the row first
+        return db.session.execute(lookup).scalar_one()
+    logger.info(f"Created user '{username}' in database for chat history")
+    return user_id
+
+def get_history_user_id(username):
+    """
+    Database id of the chat-history user for a username, creating the row on
+    first use. Served from the in-process user id cache after the first
+    lookup; None on database errors.
+    """
+    cache = get_user_id_cache()
+    user_id = cache.get(username)
+    if user_id is not None:
+        return user_id
+    try:
+        user_id = upsert_history_user(username)
     except Exception as e:
-        logger.error(f"Error ensuring user exists for history: {e}")
+        logger.error(f"Error resolving chat history user '{username}': {e}")
         db.session.rollback()
         return None
+    cache.put(username, user_id)
+    return user_id
+
+# Sessions per /api/chat-history page; clients follow next_cursor for the rest
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+# Messages per /api/chat-history/<session_id> page
+SESSION_MESSAGES_PAGE_SIZE = int(os.getenv("SESSION_MESSAGES_PAGE_SIZE", "50"))
+SESSION_MESSAGES_MAX_PAGE_SIZE = 500
+
+def encode_cursor(timestamp, row_id):
+    """Opaque keyset cursor pointing after the row (timestamp, id)"""
+    raw = json.dumps([timestamp.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """(timestamp, id) of an encode_cursor() value; raises ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+        return datetime.datetime.fromisoformat(timestamp), int(row_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+def parse_page_size(value, default, maximum):
+    """A ?limit= value, capped at maximum; raises ValueError unless it is a positive integer"""
+    if value in (None, ""):
+        return default
+    size = int(value)
+    if size < 1:
+        raise ValueError(f"Invalid limit: {value!r}")
+    return min(size, maximum)
 
 def process_pdf(file):
     """Extract text from PDF file"""
@@ -238,9 +325,7 @@ def process_csv(file):
         logger.error(f"CSV processing error: {e}")
         return ""
 
-def extract_structured_info(text, filename):
-    """Extract structured information using Gemini with table formatting instructions"""
-    base_prompt = """Extract structured information from this document for building a knowledge base.
+EXTRACTION_PROMPT = """Extract structured information from this document for building a knowledge base.
     
     IMPORTANT: When presenting tabular data, please format it as a proper HTML table using <table>, <tr>, <td>, <th> tags.
     For example:
@@ -255,13 +340,17 @@ def extract_structured_info(text, filename):
     | Data 1   | Data 2   |
     
     Document content: """
-    
+
+async def aextract_structured_info(text, filename):
+    """Extract structured information using Gemini with table formatting instructions"""
     try:
-        model = genai.GenerativeModel("gemini-2.0-flash")
         # Limit text to prevent token limit issues
         text_chunk = text[:30000]
-        gemini_response = model.generate_content(base_prompt + text_chunk)
-        structured_output = gemini_response.text
+        prompt = EXTRACTION_PROMPT + text_chunk
+        _, structured_output = await route_call("extraction", [
+            Route("gemini", "gemini-2.0-flash", lambda: providers.gemini_generate(prompt),
+                  prompt_tokens=estimate_tokens(prompt))
+        ])
         logger.info(f"Extracted structured data from {filename}")
         return structured_output
     except Exception as e:
@@ -269,67 +358,125 @@ def extract_structured_info(text, filename):
         # Return a simple text extraction if Gemini fails
         return text[:1000] + "..." if len(text) > 1000 else text
 
-def get_perplexity_response(prompt, conversation_history=None, model="sonar"):
-    """Get response from Perplexity API with optional conversation history."""
-    if not PERPLEXITY_API_KEY:
+def extract_structured_info(text, filename):
+    """Synchronous wrapper around aextract_structured_info"""
+    return providers.run_sync(aextract_structured_info(text, filename))
+
+def extract_file_text(file, content_type):
+    """Extract raw text from an uploaded file based on its content type"""
+    if content_type == "application/pdf":
+        return process_pdf(file)
+    elif content_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
+        return process_excel(file)
+    elif content_type == "text/csv":
+        return process_csv(file)
+    return None
+
+async def aget_chat_response(prompt, conversation_history=None, prompt_tokens=None):
+    """Get a chat answer, hedging from Perplexity to OpenAI when Perplexity is slow."""
+    messages = providers.build_messages(prompt, conversation_history)
+    if prompt_tokens is None:
+        prompt_tokens = estimate_message_tokens(messages)
+    routes = []
+    if providers.is_configured("perplexity"):
+        routes.append(Route("perplexity", "sonar",
+                            lambda: providers.perplexity_chat(prompt, conversation_history, model="sonar"),
+                            prompt_tokens))
+    if providers.is_configured("openai"):
+        routes.append(Route("openai", "gpt-4o",
+                            lambda: _add_empty_citations(providers.openai_chat(messages, temperature=0.7)),
+                            prompt_tokens))
+
+    if not routes:
         logger.error("Perplexity API key not configured")
         return "❌ Perplexity API key not configured. Please set PERPLEXITY_API_KEY in your environment variables.", ""
-        
-    try:
-        headers = {
-            "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-            "Content-Type": "application/json"
-        }
-
-        # Build OpenAI-style messages
-        messages = []
-
-        if conversation_history:
-            for turn in conversation_history[-5:]:
-                messages.append({"role": "user", "content": turn["q"]})
-                messages.append({"role": "assistant", "content": turn["a"]})
-
-        messages.append({"role": "user", "content": prompt})
 
-        payload = {
-            "model": model,
-            "messages": messages,
-            "temperature": 0.7,
-            "stream": False
-        }
+    try:
+        route, (assistant_response, citations) = await route_call("chat", routes)
+        logger.info(f"🤖 Chat answered by {route.provider}/{route.model}")
+        return assistant_response, citations
+    except AllProvidersFailed as e:
+        logger.error(f"Chat providers failed: {e}")
+        return f"❌ Perplexity error: {e}", ""
 
-        response = requests.post(PERPLEXITY_API_URL, headers=headers, json=payload)
+async def _add_empty_citations(coro):
+    return await coro, ""
 
-        if response.ok:
-            citations = ""
-            for j in response.json()["search_results"]:
-                tmp_c = j.get('title') + " - " + j.get('url')
-                citations = citations + tmp_c + " \n "
-            
-            assistant_response = response.json()["choices"][0]["message"]["content"]
-            
-            # Console logging for Perplexity Assistant Response
-            logger.info("🤖 Perplexity Assistant Response:")
-            logger.info(f"Response: {assistant_response}")
-            print(f"🤖 Perplexity Assistant Response: {assistant_response}")
-            
-            return assistant_response, citations
-        else:
-            logger.error(f"Perplexity API error: {response.status_code} - {response.text}")
-            return f"❌ Perplexity error: {response.status_code}: {response.text}", ""
+def get_chat_response(prompt, conversation_history=None):
+    """Synchronous wrapper around aget_chat_response"""
+    return providers.run_sync(aget_chat_response(prompt, conversation_history))
 
-    except Exception as e:
-        logger.error(f"Perplexity API error: {e}")
-        return f"❌ Perplexity error: {e}", ""
+async def _achat_chunks(prompt, conversation_history=None):
+    """Yield ("delta", text) chunks of a chat answer, then ("citations", text)"""
+    streamed = False
+    if providers.is_configured("perplexity"):
+        messages = providers.build_messages(prompt, conversation_history)
+        try:
+            async for kind, text in stream_with_resilience(
+                "chat", "perplexity",
+                lambda: providers.perplexity_chat_stream(prompt, conversation_history, model="sonar"),
+                estimate_message_tokens(messages)
+            ):
+                streamed = streamed or kind == "delta"
+                yield kind, text
+            return
+        except ProviderError as e:
+            if streamed:
+                # Part of the answer is already on the client; finish it with the error
+                logger.error(f"Perplexity stream failed mid-answer: {e}")
+                yield "delta", f"\n\n❌ Perplexity error: {e}"
+                yield "citations", ""
+                return
+            logger.warning(f"Perplexity stream unavailable, answering without streaming: {e}")
+    # Not streamable: the hedged answer arrives as a single chunk
+    assistant_response, citations = await aget_chat_response(prompt, conversation_history)
+    yield "delta", assistant_response
+    yield "citations", citations
+
+async def astream_chat_response(prompt, conversation_history=None, table_format="records"):
+    """
+    Stream a chat answer as events: "delta" for each text chunk and "table" for
+    each markdown table as soon as the line after it arrives, so tables can be
+    shown while the rest of the answer streams. Ends with one "answer" event
+    holding the full response, sources and tables (the same tables
+    finalize_response_tables returns for the full response, media-plan
+    arithmetic included). Table events and "encoded_tables" use `table_format`
+    (see table_codec).
+    """
+    parser = TableStreamParser()
+    parts, parsed, tables, encoded = [], [], [], []
+    sources = ""
+    async for kind, text in _achat_chunks(prompt, conversation_history):
+        if kind == "citations":
+            sources = text
+            continue
+        parts.append(text)
+        yield {"type": "delta", "text": text}
+        for table in parser.feed(text):
+            table = checked_table(table)
+            parsed.append(table)
+            tables.append(table.records())
+            encoded.append(encode_table(table, table_format))
+            yield {"type": "table", "index": len(tables) - 1, "table": encoded[-1]}
+    for table in parser.close():
+        table = checked_table(table)
+        parsed.append(table)
+        tables.append(table.records())
+        encoded.append(encode_table(table, table_format))
+        yield {"type": "table", "index": len(tables) - 1, "table": encoded[-1]}
+    # The streamed text still has the model's arithmetic; the final response has the checked tables
+    response, _ = finalize_response_tables("".join(parts))
+    yield {
+        "type": "answer", "response": response, "sources": sources,
+        "tables": tables, "encoded_tables": encoded, "parsed_tables": parsed
+    }
 
 def extract_code(text):
     """Extract Python code from markdown code blocks"""
     match = re.search(r"```(?:python)?\n(.*?)```", text, re.DOTALL)
     return match.group(1).strip() if match else text.strip()
 
-def generate_plot_code(knowledge, query, reply):
-    """Generate matplotlib code for visualization"""
-    system_prompt = """You are a Python assistant. Output only valid matplotlib code using data given to you. You can generate multiple plots, so generate code in that way. If there is no sufficient Knowledge Base data, rely on the Answer.
+PLOT_SYSTEM_PROMPT = """You are a Python assistant. Output only valid matplotlib code using data given to you. You can generate multiple plots, so generate code in that way. If there is no sufficient Knowledge Base data, rely on the Answer.
 
 IMPORTANT INSTRUCTIONS FOR BUSINESS DATA:
 1. For media plans and marketing data, create meaningful visualizations like:
@@ -341,52 +488,84 @@ IMPORTANT INSTRUCTIONS FOR BUSINESS DATA:
 3. Include proper titles, labels, and legends
 4. Make charts readable and presentation-ready
 5. Extract data from tables in the response if available"""
-    
+
+def record_plot_tokens(usage, stage, prompt_tokens, completion):
+    """Add one plot-code LLM call to a usage dict and the token metrics"""
+    completion_tokens = estimate_tokens(completion or "")
+    PLOT_LLM_TOKENS.labels(stage, "prompt").inc(prompt_tokens)
+    PLOT_LLM_TOKENS.labels(stage, "completion").inc(completion_tokens)
+    if usage is not None:
+        usage["attempts"] = usage.get("attempts", 0) + 1
+        usage["tokens"] = usage.get("tokens", 0) + prompt_tokens + completion_tokens
+
+async def agenerate_plot_code(knowledge, query, reply, usage=None):
+    """Generate matplotlib code for visualization"""
     user_prompt = f"""Knowledge Base:\n{knowledge}\n\nUser Query:\n{query}\n\nAnswer:\n{reply}"""
+    prompt_tokens = estimate_tokens(PLOT_SYSTEM_PROMPT) + estimate_tokens(user_prompt)
+    
+    # OpenAI first, Perplexity as hedge/fallback; the router reorders by observed latency
+    routes = []
+    if providers.is_configured("openai"):
+        routes.append(Route("openai", "gpt-4o", lambda: providers.openai_chat([
+            {"role": "system", "content": PLOT_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]), prompt_tokens))
+    if PERPLEXITY_API_KEY:
+        routes.append(Route("perplexity", "sonar", lambda: _without_citations(providers.perplexity_chat(
+            f"{PLOT_SYSTEM_PROMPT}\n\n{user_prompt}",
+            model="sonar"
+        )), prompt_tokens))
+
+    if not routes:
+        logger.error("No AI service available for plot generation")
+        return None
+
+    try:
+        route, content = await route_call("plot_code", routes)
+    except AllProvidersFailed as e:
+        logger.error(f"Plot code generation failed: {e}")
+        return None
+
+    record_plot_tokens(usage, "generate", prompt_tokens, content)
+    plot_code = extract_code(content)
     
-    # Try OpenAI first
-    if openai_client is not None:
-        try:
-            response = openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.3
-            )
-            plot_code = extract_code(response.choices[0].message.content)
-            
-            # Console logging for Plot Generation
-            logger.info("🎨 Plot Code Generated (OpenAI):")
-            logger.info(f"Plot Code: {plot_code}")
-            print(f"🎨 Plot Code Generated (OpenAI): {plot_code}")
-            
-            return plot_code
-        except Exception as e:
-            logger.error(f"OpenAI code generation failed: {e}")
+    # Console logging for Plot Generation
+    logger.info(f"🎨 Plot Code Generated ({route.provider}):")
+    logger.info(f"Plot Code: {plot_code}")
+    print(f"🎨 Plot Code Generated ({route.provider}): {plot_code}")
     
-    # Fallback to Perplexity if OpenAI is not available or fails
+    return plot_code
+
+async def arepair_plot_code(plot_code, error, usage=None):
+    """Ask for a fix of failing plot code, sending only the code and its error"""
+    messages = build_repair_messages(plot_code, error)
+    prompt_tokens = estimate_message_tokens(messages)
+
+    routes = []
+    if providers.is_configured("openai"):
+        routes.append(Route("openai", REPAIR_MODEL, lambda: providers.openai_chat(messages, model=REPAIR_MODEL, temperature=0), prompt_tokens))
     if PERPLEXITY_API_KEY:
-        try:
-            logger.info("🔄 Falling back to Perplexity for plot generation")
-            response = get_perplexity_response(
-                f"{system_prompt}\n\n{user_prompt}",
-                model="sonar"
-            )
-            plot_code = extract_code(response[0])  # response is (content, sources)
-            
-            # Console logging for Plot Generation
-            logger.info("🎨 Plot Code Generated (Perplexity):")
-            logger.info(f"Plot Code: {plot_code}")
-            print(f"🎨 Plot Code Generated (Perplexity): {plot_code}")
-            
-            return plot_code
-        except Exception as e:
-            logger.error(f"Perplexity code generation failed: {e}")
-    
-    logger.error("No AI service available for plot generation")
-    return None
+        prompt = "\n\n".join(message["content"] for message in messages)
+        routes.append(Route("perplexity", "sonar", lambda: _without_citations(providers.perplexity_chat(
+            prompt, model="sonar", temperature=0
+        )), prompt_tokens))
+
+    if not routes:
+        return None
+
+    try:
+        route, content = await route_call("plot_repair", routes)
+    except AllProvidersFailed as e:
+        logger.error(f"Plot code repair failed: {e}")
+        return None
+
+    record_plot_tokens(usage, "repair", prompt_tokens, content)
+    logger.info(f"🔧 Plot code repaired ({route.provider}, {prompt_tokens} prompt tokens)")
+    return extract_code(content)
+
+async def _without_citations(coro):
+    content, _ = await coro
+    return content
 
 def extract_data_from_response(response):
     """Extract structured data from AI response for plotting"""
@@ -480,45 +659,511 @@ def generate_sample_data_for_query(query):
             'ylabel': 'Values'
         }
 
-def extract_tables_from_response(response_text):
-    """Extract tables from markdown response"""
-    tables = []
+def parse_response_tables(response_text):
+    """Parse the markdown tables in a response into ParsedTables"""
     try:
-        lines = response_text.split('\n')
-        table_blocks = []
-        current_block = []
-
-        for line in lines:
-            if '|' in line and line.strip():
-                current_block.append(line.strip())
-            elif current_block:
-                table_blocks.append(current_block)
-                current_block = []
-
-        if current_block:
-            table_blocks.append(current_block)
-
-        for block in table_blocks:
-            if len(block) >= 2:
-                if re.match(r'\s*\|?\s*-+\s*\|', block[1]):
-                    block.pop(1)
-
-                headers = [col.strip() for col in block[0].split('|') if col.strip()]
-                data_rows = []
-                for row in block[1:]:
-                    cols = [col.strip() for col in row.split('|') if col.strip()]
-                    if len(cols) == len(headers):
-                        data_rows.append(cols)
-
-                if data_rows:
-                    df = pd.DataFrame(data_rows, columns=headers)
-                    tables.append(df.to_dict('records'))
-
-        return tables
+        return parse_tables(response_text)
     except Exception as e:
         logger.error(f"Table extraction error: {e}")
         return []
 
+def checked_table(table):
+    """A streamed table with its media-plan rates and totals recomputed (see media_plan)"""
+    try:
+        fix = fix_media_plan(table)
+    except Exception as e:
+        logger.error(f"Media plan check error: {e}")
+        return table
+    return fix.table if fix else table
+
+def finalize_response_tables(response_text):
+    """
+    Recompute the rates and totals of media-plan tables locally (see media_plan)
+    and parse the response's tables; returns (response_text, ParsedTables)
+    """
+    try:
+        response_text, tables, _ = fix_media_plans(response_text)
+        return response_text, tables
+    except Exception as e:
+        logger.error(f"Media plan check error: {e}")
+        return response_text, parse_response_tables(response_text)
+
+def extract_tables_from_response(response_text):
+    """Extract markdown tables from a response as lists of {header: cell} records"""
+    return [table.records() for table in parse_response_tables(response_text)]
+
+# Base chat prompt - Enhanced to match Streamlit app quality
+BASE_CHAT_PROMPT = (
+"You are an intelligent assistant. Use the extracted knowledge base if it's available to answer user queries. "
+"In addition, rely on your own knowledge whenever needed, based on the user's input. "
+"If the answer cannot be found in the knowledge base, use your general understanding to respond.\n\n"
+
+"IMPORTANT FORMATTING:\n"
+"- When presenting tabular data, format it as markdown tables using `|` symbols.\n"
+"- Example:\n"
+"  | Column 1 | Column 2 |\n"
+"  |----------|----------|\n"
+"  | Data 1   | Data 2   |\n\n"
+
+"**POINTS TO KEEP IN MIND:**\n"
+"- If the user requests Excel-like output, assume tabular format and provide markdown directly.\n"
+"  Mention that this product allows instant download of the generated table.\n"
+"- If the user requests graphs, plots, or charts, do not generate them. "
+"A separate module in the system handles visualizations.\n"
+"- If relevant information isn't found in the knowledge base, use your own understanding to answer accurately.\n"
+"- Always consider the user input carefully. Combine it with the knowledge base and your knowledge to generate accurate and context-aware responses.\n"
+"- Maintain conversational context by referring to previous user queries where appropriate. If the query is entirely new, don't use previous knowledge.\n\n"
+
+"**SPECIAL FORMAT — MEDIA PLAN REQUESTS:**\n"
+"- If the user asks for a *media plan* or requests *marketing metrics across platforms*, present the data in TONIC-style format.\n"
+"- TONIC-style table format:\n"
+"  1. Start with a title (e.g., 'Plan KSA') on top.\n"
+"  2. First table row = main metric headers: Medium, Clicks, CPC, Impressions, CPM, Views, CPV, CTR, Leads, CPL, Total Cost.\n"
+"  3. Second row = subheaders (e.g., Channel, Exp. Link Clicks, etc.).\n"
+"  4. List each platform (e.g., TikTok, YouTube) in a row with corresponding metrics.\n"
+"  5. Leave out totals and summary rows: the system recomputes the rates (CPC, CPM, CPV, CTR, CPL) from the budgets and volumes and adds the Net Total row.\n"
+"  6. Format the entire table in markdown using `|`, just like other tables.\n"
+"  7. Do not explain the table — output the TONIC table directly with any other requested info (like recommendations or insights).\n"
+"- Example:\n"
+"\n"
+"  Plan KSA  \n"
+"  | Medium | Clcks | CPC | Impressions | CPM | Views | CPV | CTR | Leads | CPL | Total Cost |\n"
+"  | Channel | Exp. Link Clicks | Exp. Tonic CPC | Exp. Impressions | Exp. Tonic CPM | Video Views | Exp. Tonic CPV | Exp.CTR | | Budget |\n"
+"  | Tiktok Ad | 11,630 | AED1.29 | 2,907,540 | AED5.16 | 67,843 | AED0.22 | 0.40 | 150 | 100 | 15000 |\n"
+"  | Facebook/Instagram | 18,367 | AED1.47 | 6,679,035 | AED4.04 | 734,694 | AED0.04 | 0.28 | 270 | 100 | 27000 |\n"
+"  | Twitter X | 4,511 | AED1.40 | 1,051,709 | AED5.99 | 11,429 | AED0.55 | 0.43 | 63 | 100 | 6300 |\n"
+"  | YouTube Ads | 5,630 | AED2.13 | 806,248 | AED14.88 | 544,218 | AED0.02 | 0.70 | 120 | 100 | 12000 |\n"
+"  | Search Ads | 5,246 | AED2.21 |  |  |  |  |  | 116 | 100 | 11600 |\n"
+"  | Google Display Ads | 7,850 | AED1.03 | 2,448,980 | AED3.31 | NA | NA | 0.32 | 81 | 100 | 8100 |\n"
+"\n"
+
+"- Use this format **only** if the user's query is about media planning, digital ad performance, or channel-level budget/performance comparison.\n"
+
+"**ENHANCED MEDIA PLAN FORMAT FOR CLIENT PITCHING:**\n"
+"- When users request media plans for client pitching, provide a comprehensive structured response including:\n"
+"  1. **Audience Size Details** - TAM, SAM, SOM breakdown\n"
+"  2. **Target Audience** - Demographics, psychographics, behavioral patterns\n"
+"  3. **Approach** - Strategy, objectives, and methodology\n"
+"  4. **Media Plan with Platform Split** - Detailed metrics table with all KPIs\n"
+"  5. **Notes for PPT Presentation** - Guidelines for creating presentation slides\n"
+"- Format the response with clear sections using markdown headers (###)\n"
+"- Include detailed explanations and insights for each section\n"
+"- Provide realistic and comprehensive data for all metrics\n"
+"- Add presentation tips and visual guidance for client pitches\n"
+
+"- Also provide list of sources/URLs as Sources:\n"
+"  from where you have gathered all the data (list no more than 5)\n"
+"  - ALSO NEVER LIST ANY SOURCES RELATED TO FORMATTING, ETC. LIST ONLY DATA SOURCES"
+    )
+
+def build_chat_prompt_prefix(knowledge_base):
+    """Build the question-independent part of the chat prompt"""
+    return (
+        f"{BASE_CHAT_PROMPT}\n\n"
+        f"Knowledge Base:\n{knowledge_base}\n\n"
+    )
+
+def build_chat_prompt(knowledge_base, question, prefix=None):
+    """Build the full chat prompt from the base prompt, knowledge base and question"""
+    if prefix is None:
+        prefix = build_chat_prompt_prefix(knowledge_base)
+    return f"{prefix}Current Question:\n{question}"
+
+def render_plot_variant(plot_id, variant=DEFAULT_VARIANT, format="png", dpi=None, size=None):
+    """
+    Return the path of a rendered plot variant, rendering it from the stored
+    source if needed. Named variants take their dpi from PLOT_VARIANTS.
+    """
+    store = get_plot_store()
+    path = store.image(plot_id, variant, format)
+    if path:
+        PLOT_CACHE_LOOKUPS.labels("hit").inc()
+        return path
+    source = store.source(plot_id)
+    if source is None:
+        return None
+    PLOT_CACHE_LOOKUPS.labels("miss").inc()
+    image = get_renderer_pool().render(source, dpi=dpi or PLOT_VARIANTS[variant], format=format, size=size)
+    return store.save_image(plot_id, variant, image, format)
+
+PLOT_FORMATS = ("image", "spec")
+# "image" renders PNGs in a background job; "spec" returns a Vega-Lite spec for the browser
+DEFAULT_PLOT_FORMAT = os.getenv("PLOT_FORMAT", "image")
+
+def build_plot_spec(tables):
+    """
+    Build a Vega-Lite spec from extracted tables. Nothing is rasterized: the
+    matching plot code is only stored so a PNG can be rendered on download.
+    Returns (plot_spec, plot_id), or (None, None) if no table can be charted.
+    """
+    plot_spec = build_chart_spec(tables)
+    if plot_spec is None:
+        return None, None
+    plot_id = get_plot_store().save_source(build_chart_code(tables))
+    PLOT_GENERATIONS.labels("spec", "success").inc()
+    return plot_spec, plot_id
+
+def render_plot_code(plot_code):
+    """Store plot code, render its screen-size variant and return the plot id"""
+    plot_id = get_plot_store().save_source(plot_code)
+    render_plot_variant(plot_id)
+    return plot_id
+
+async def agenerate_plot(knowledge_base, question, ai_response, tables=None):
+    """
+    Generate and render a plot. Returns (plot_id, plot_code).
+
+    Tables already extracted from the answer are charted directly; LLM-written
+    code is only the fallback. It is generated once, then validated and
+    rendered, and each failure is sent back with its error for a small repair
+    call, for up to MAX_PLOT_ATTEMPTS LLM calls in total.
+    """
+    logger.info(f"🎨 Generating plot for question: {question}")
+    plot_id = None
+    plot_code_data = None
+
+    plot_code = build_chart_code(tables)
+    if plot_code:
+        try:
+            plot_id = await run_render(render_plot_code, plot_code)
+            PLOT_GENERATIONS.labels("rules", "success").inc()
+            return plot_id, plot_code
+        except Exception as e:
+            PLOT_GENERATIONS.labels("rules", "error").inc()
+            logger.error(f"⚠️ Rule-based chart failed, falling back to LLM: {e}")
+
+    usage = {"attempts": 0, "tokens": 0}
+    plot_code = await agenerate_plot_code(knowledge_base, question, ai_response, usage)
+    while plot_code:
+        plot_code = re.sub(r"plt\.show\(\)", "", plot_code)
+        plot_code_data = plot_code
+        error = validate_plot_code(plot_code)
+        if error is None:
+            try:
+                # Rendering is CPU-bound, keep it off the event loop
+                plot_id = await run_render(render_plot_code, plot_code)
+            except Exception as e:
+                error = str(e)
+        if error is None:
+            PLOT_GENERATIONS.labels("llm", "success").inc()
+            PLOT_ATTEMPTS.observe(usage["attempts"])
+            logger.info(f"✅ Plot rendered after {usage['attempts']} LLM calls, ~{usage['tokens']} tokens")
+            break
+
+        PLOT_GENERATIONS.labels("llm", "error").inc()
+        logger.error(f"⚠️ Plot failed on attempt {usage['attempts']}: {(error.strip().splitlines() or [error])[-1]}")
+        if usage["attempts"] >= MAX_PLOT_ATTEMPTS:
+            break
+        plot_code = await arepair_plot_code(plot_code, error, usage)
+
+    if plot_id is None:
+        logger.warning(f"No plot rendered after {usage['attempts']} LLM calls, ~{usage['tokens']} tokens")
+
+    return plot_id, plot_code_data
+
+def chat_table_rows(parsed_tables):
+    """ChatTable column values holding an answer's tables as typed Parquet; none if they cannot be serialized"""
+    if not parsed_tables:
+        return []
+    try:
+        rows = []
+        for position, columnar in enumerate(columnar_tables(parsed_tables)):
+            data = table_parquet(columnar)
+            if data is None:
+                return []
+            rows.append({
+                "position": position,
+                "row_count": columnar["rows"],
+                "column_count": len(columnar["columns"]),
+                "content_hash": content_hash(data),
+                "data": data
+            })
+        return rows
+    except Exception as e:
+        logger.error(f"Failed to serialize tables for storage: {e}")
+        return []
+
+def persist_chat_turns(turns):
+    """
+    Write ChatTurns in one transaction: the sessions missing for any (user,
+    session name) first, then every message and every table with one bulk
+    INSERT each, under their reserved ids where they have them. Returns
+    (message_id, table_ids) per turn, (None, []) for turns whose user could
+    not be resolved.
+    """
+    from sqlalchemy import insert, select
+
+    user_ids = {turn.username: get_history_user_id(turn.username) for turn in turns}
+    keys = {(user_ids[turn.username], turn.session_name) for turn in turns if user_ids[turn.username] is not None}
+    if not keys:
+        return [(None, [])] * len(turns)
+
+    # Get or create the sessions
+    session_ids = {}
+    existing = db.session.execute(
+        select(ChatSession.id, ChatSession.user_id, ChatSession.session_name)
+        .where(ChatSession.user_id.in_({user_id for user_id, _ in keys}),
+               ChatSession.session_name.in_({name for _, name in keys}))
+        .order_by(ChatSession.id)
+    )
+    for session_id, user_id, session_name in existing:
+        session_ids.setdefault((user_id, session_name), session_id)
+    missing = sorted(keys - session_ids.keys())
+    if missing:
+        created = db.session.execute(
+            insert(ChatSession).returning(ChatSession.id, sort_by_parameter_order=True),
+            [{"user_id": user_id, "session_name": session_name} for user_id, session_name in missing]
+        ).scalars()
+        session_ids.update(zip(missing, created))
+
+    stored = [turn for turn in turns if user_ids[turn.username] is not None]
+    message_ids = db.session.execute(
+        insert(ChatMessage).returning(ChatMessage.id, sort_by_parameter_order=True),
+        [
+            {
+                "session_id": session_ids[(user_ids[turn.username], turn.session_name)],
+                "question": turn.question,
+                "answer": turn.answer,
+                "plot_code": turn.plot_code,
+                "timestamp": turn.timestamp,
+                **({"id": turn.message_id} if turn.message_id is not None else {})
+            } for turn in stored
+        ]
+    ).scalars().all()
+
+    flat = [
+        {**row, "message_id": message_ids[turn_index], **({"id": turn.table_ids[position]} if turn.table_ids else {})}
+        for turn_index, turn in enumerate(stored) for position, row in enumerate(turn.table_rows)
+    ]
+    table_ids = iter(db.session.execute(
+        insert(ChatTable).returning(ChatTable.id, sort_by_parameter_order=True), flat
+    ).scalars().all() if flat else [])
+    db.session.commit()
+
+    saved = {
+        id(turn): (message_ids[turn_index], [next(table_ids) for _ in turn.table_rows])
+        for turn_index, turn in enumerate(stored)
+    }
+    logger.info(f"{len(stored)} message(s) saved to database in {len(keys)} session(s)")
+    return [saved.get(id(turn), (None, [])) for turn in turns]
+
+def write_chat_turns(turns):
+    """Chat writer callback: persist turns in the app context, one by one if the batch fails"""
+    with app.app_context():
+        try:
+            return persist_chat_turns(turns)
+        except Exception as e:
+            db.session.rollback()
+            if len(turns) == 1:
+                logger.error(f"Failed to save message to database: {e}")
+                # The cached user id may point at a row that no longer exists
+                get_user_id_cache().invalidate(turns[0].username)
+                return [(None, [])]
+            logger.error(f"Failed to save {len(turns)} messages to database, retrying one by one: {e}")
+    return [write_chat_turns([turn])[0] for turn in turns]
+
+# Chat turns are persisted through the write-behind writer (CHAT_PERSISTENCE=sync|async)
+chat_writer = ChatWriter(write_chat_turns)
+
+def sequence_ids(table_name):
+    """IdBlocks fetch function reserving ids from a Postgres table's id sequence in one query"""
+    from sqlalchemy import text
+    
+    def fetch(count):
+        with app.app_context(), db.engine.connect() as connection:
+            return connection.execute(
+                text("SELECT nextval(pg_get_serial_sequence(:table_name, 'id')) FROM generate_series(1, :count)"),
+                {"table_name": table_name, "count": count}
+            ).scalars().all()
+    return fetch
+
+message_id_blocks = IdBlocks(sequence_ids('chat_messages'))
+table_id_blocks = IdBlocks(sequence_ids('chat_tables'))
+
+def reserve_chat_ids(turns):
+    """Give queued turns their message and table ids before they are written"""
+    message_ids = message_id_blocks.take(len(turns))
+    table_ids = iter(table_id_blocks.take(sum(len(turn.table_rows) for turn in turns)))
+    for turn, message_id in zip(turns, message_ids):
+        turn.message_id = message_id
+        turn.table_ids = [next(table_ids) for _ in turn.table_rows]
+
+def save_chat_turn(username, session_name, question, answer, plot_code=None, tables=None):
+    """
+    Persist a chat turn and its ParsedTables, creating the user and session if needed.
+    Returns the ChatTurn; its ids() are known at once (reserved in async mode).
+    """
+    return save_chat_turns(username, session_name, [(question, answer, tables)], plot_code)[0]
+
+def save_chat_turns(username, session_name, turns, plot_code=None):
+    """
+    Persist (question, answer, parsed_tables) turns as ChatMessages and ChatTables in a
+    single transaction; returns their ChatTurns
+    """
+    turns = [
+        ChatTurn(username, session_name, question, answer, plot_code, chat_table_rows(tables))
+        for question, answer, tables in turns
+    ]
+    if chat_writer.mode == CHAT_ASYNC:
+        try:
+            reserve_chat_ids(turns)
+        except Exception as e:
+            # Without reserved ids the response could not name its message: write it now
+            logger.error(f"Failed to reserve chat ids, writing synchronously: {e}")
+            return chat_writer.write_now(turns)
+    return chat_writer.submit(turns)
+
+def save_plot_code(message_id, plot_code):
+    """Attach the code of a finished background plot to its ChatMessage"""
+    with app.app_context():
+        try:
+            ChatMessage.query.filter_by(id=message_id).update({"plot_code": plot_code})
+            db.session.commit()
+        except Exception as e:
+            logger.error(f"Failed to save plot code for message {message_id}: {e}")
+            db.session.rollback()
+
+async def agenerate_plot_for_message(turn, knowledge_base, question, ai_response, tables):
+    """Run agenerate_plot and persist the resulting code with the turn's chat message once it is written"""
+    plot_id, plot_code = await agenerate_plot(knowledge_base, question, ai_response, tables)
+    if plot_id:
+        message_id, _ = await asyncio.wrap_future(turn.saved)
+        if message_id:
+            await asyncio.to_thread(save_plot_code, message_id, plot_code)
+    return plot_id, plot_code
+
+def record_session_turn(username, session_name, question, answer):
+    """Store a chat turn in the in-memory session and return its timestamp"""
+    if username not in user_sessions:
+        user_sessions[username] = {}
+    if session_name not in user_sessions[username]:
+        user_sessions[username][session_name] = []
+
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    user_sessions[username][session_name].append({
+        "q": question,
+        "a": answer,
+        "timestamp": timestamp
+    })
+    return timestamp
+
+def log_chat_response(ai_response, tables, plot_data, plot_code_data, sources):
+    """Log a summary of the chat response being sent to the client"""
+    logger.info(f"📤 Sending response to client:")
+    logger.info(f"   📄 Response length: {len(ai_response)} characters")
+    logger.info(f"   📊 Tables found: {len(tables)}")
+    logger.info(f"   🎨 Plot data: {'Present' if plot_data else 'None'}")
+    logger.info(f"   📝 Plot code: {'Present' if plot_code_data else 'None'}")
+    if plot_data:
+        logger.info(f"   🎨 Plot data size: {len(plot_data)} characters")
+    if plot_code_data:
+        logger.info(f"   📝 Plot code size: {len(plot_code_data)} characters")
+    logger.info(f"   🔗 Sources: {len(sources) if sources else 0}")
+
+MAX_BATCH_QUESTIONS = 20
+
+def parse_batch_request(data):
+    """Validate a batch chat body; returns (questions, error_message)"""
+    questions = data.get('questions')
+    if not isinstance(questions, list) or not questions:
+        return None, "A non-empty list of questions is required"
+    questions = [q.strip() for q in questions if isinstance(q, str) and q.strip()]
+    if not questions:
+        return None, "A non-empty list of questions is required"
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        return None, f"At most {MAX_BATCH_QUESTIONS} questions per batch"
+    return questions, None
+
+async def aanswer_batch_question(index, question, prefix, shared_tokens, conversation_history, table_format="records"):
+    """Answer one batch question using the shared prompt prefix"""
+    prompt = build_chat_prompt(None, question, prefix=prefix)
+    ai_response, sources = await aget_chat_response(
+        prompt, conversation_history,
+        prompt_tokens=shared_tokens + estimate_tokens(question)
+    )
+    ai_response, parsed_tables = finalize_response_tables(ai_response)
+    return {
+        "type": "answer",
+        "index": index,
+        "question": question,
+        "response": ai_response,
+        "tables": encode_tables(parsed_tables, table_format),
+        "sources": sources
+    }
+
+def batch_answer_coroutines(questions, knowledge_base, conversation_history, table_format="records"):
+    """Build the shared prompt prefix once and return one coroutine per question"""
+    prefix = build_chat_prompt_prefix(knowledge_base)
+    # Prefix and history are identical for every question, so estimate them once
+    shared_tokens = estimate_tokens(prefix) + estimate_message_tokens(providers.build_messages("", conversation_history))
+    return [
+        aanswer_batch_question(i, q, prefix, shared_tokens, conversation_history, table_format)
+        for i, q in enumerate(questions)
+    ]
+
+def batch_error_event(index, question, error):
+    """The NDJSON line for a batch question that could not be answered"""
+    logger.error(f"❌ Batch question {index} failed: {error}")
+    return {"type": "error", "index": index, "question": question, "message": str(error) or type(error).__name__}
+
+def finish_batch(username, session_name, answers, total=None, failed=()):
+    """
+    Record the answered batch questions in memory and in one DB transaction;
+    returns the done event. Questions that failed are listed by index.
+    """
+    answers = sorted(answers, key=lambda a: a["index"])
+    for answer in answers:
+        record_session_turn(username, session_name, answer["question"], answer["response"])
+    if answers:
+        save_chat_turns(username, session_name, [
+            (a["question"], a["response"], parse_response_tables(a["response"])) for a in answers
+        ])
+    total = len(answers) + len(failed) if total is None else total
+    return {"type": "done", "total": total, "answered": len(answers), "failed": sorted(failed)}
+
+def finish_chat_stream(username, session_name, question, knowledge_base, plot_format, answer):
+    """Store a streamed answer and queue its plot; returns the "done" event (the /api/chat response body)"""
+    ai_response, tables, sources = answer["response"], answer["tables"], answer["sources"]
+    
+    plot_spec, plot_id, plot_job_id = None, None, None
+    intent = classify_intent(question)
+    logger.info(f"🧭 Intent: {intent.label} ({intent.confidence:.2f})")
+    plot_requested = wants_plot(intent, tables)
+    if plot_requested and plot_format == 'spec':
+        plot_spec, plot_id = build_plot_spec(tables)
+    
+    timestamp = record_session_turn(username, session_name, question, ai_response)
+    turn = save_chat_turn(
+        username, session_name, question, ai_response,
+        get_plot_store().source(plot_id) if plot_id else None,
+        answer["parsed_tables"]
+    )
+    message_id, table_ids = turn.ids()
+    
+    if plot_requested and plot_spec is None:
+        plot_job_id = start_plot_job(username, agenerate_plot_for_message(
+            turn, knowledge_base, question, ai_response, tables
+        ))
+        logger.info(f"🎨 Plot job {plot_job_id} queued")
+    
+    log_chat_response(ai_response, tables, None, None, sources)
+    return {
+        "type": "done",
+        "success": True,
+        "response": ai_response,
+        "timestamp": timestamp,
+        "tables": answer["encoded_tables"],
+        "table_ids": table_ids,
+        "plot": None,
+        "plot_code": None,
+        "plot_job_id": plot_job_id,
+        "plot_spec": plot_spec,
+        "plot_id": plot_id,
+        "intent": intent.to_dict(),
+        "message_id": message_id,
+        "sources": sources
+    }
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     try:
@@ -532,9 +1177,22 @@ def health_check():
     return jsonify({
         "status": "healthy", 
         "message": "TONIC AI Backend is running",
-        "database": db_status
+        "database": db_status,
+        "provider_latency": latency_snapshot(),
+        "provider_circuits": breaker_snapshot(),
+        "provider_limits": limiter_snapshot(),
+        "plot_cache": get_plot_store().stats(),
+        "table_exports": get_table_export_cache().stats(),
+        "user_id_cache": get_user_id_cache().stats(),
+        "chat_writer": chat_writer.stats()
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: provider outcomes, retries, error rates and circuit states"""
+    body, content_type = render_metrics()
+    return make_response(body, 200, {'Content-Type': content_type})
+
 
 
 @app.route('/api/login', methods=['OPTIONS'])
@@ -556,6 +1214,8 @@ def login():
     
     if username in USERS and USERS[username] == password:
         access_token = create_access_token(identity=username)
+        # Resolve the chat history user now so history and chat requests hit the cache
+        get_history_user_id(username)
         logger.info(f"Login successful for user: {username}")
         return jsonify({
             "success": True,
@@ -581,6 +1241,8 @@ def logout():
     
     if username in user_sessions:
         del user_sessions[username]
+
+    get_user_id_cache().invalidate(username)
     
     logger.info(f"User {username} logged out successfully")
     return jsonify({"success": True, "message": "Logged out successfully"})
@@ -603,14 +1265,7 @@ def upload_files():
         if file.filename == '':
             continue
             
-        if file.content_type == "application/pdf":
-            text = process_pdf(file)
-        elif file.content_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
-            text = process_excel(file)
-        elif file.content_type == "text/csv":
-            text = process_csv(file)
-        else:
-            continue
+        text = extract_file_text(file, file.content_type)
 
         if text:
             structured_output = extract_structured_info(text, file.filename)
@@ -647,92 +1302,18 @@ def chat():
     if not question:
         return jsonify({"success": False, "message": "Question is required"}), 400
     
-    # Initialize user sessions if not exists
-    if username not in user_sessions:
-        user_sessions[username] = {}
-    if session_name not in user_sessions[username]:
-        user_sessions[username][session_name] = []
+    plot_format = data.get('plot_format', DEFAULT_PLOT_FORMAT)
+    if plot_format not in PLOT_FORMATS:
+        return jsonify({"success": False, "message": f"plot_format must be one of {', '.join(PLOT_FORMATS)}"}), 400
     
     # Use stored knowledge base if not provided
     if not knowledge_base and username in knowledge_bases:
         knowledge_base = knowledge_bases[username]
     
-    # Base chat prompt - Enhanced to match Streamlit app quality
-    base_chat_prompt = (
-"You are an intelligent assistant. Use the extracted knowledge base if it's available to answer user queries. "
-"In addition, rely on your own knowledge whenever needed, based on the user's input. "
-"If the answer cannot be found in the knowledge base, use your general understanding to respond.\n\n"
-
-"IMPORTANT FORMATTING:\n"
-"- When presenting tabular data, format it as markdown tables using `|` symbols.\n"
-"- Example:\n"
-"  | Column 1 | Column 2 |\n"
-"  |----------|----------|\n"
-"  | Data 1   | Data 2   |\n\n"
-
-"**POINTS TO KEEP IN MIND:**\n"
-"- If the user requests Excel-like output, assume tabular format and provide markdown directly.\n"
-"  Mention that this product allows instant download of the generated table.\n"
-"- If the user requests graphs, plots, or charts, do not generate them. "
-"A separate module in the system handles visualizations.\n"
-"- If relevant information isn't found in the knowledge base, use your own understanding to answer accurately.\n"
-"- Always consider the user input carefully. Combine it with the knowledge base and your knowledge to generate accurate and context-aware responses.\n"
-"- Maintain conversational context by referring to previous user queries where appropriate. If the query is entirely new, don't use previous knowledge.\n\n"
-
-"**SPECIAL FORMAT — MEDIA PLAN REQUESTS:**\n"
-"- If the user asks for a *media plan* or requests *marketing metrics across platforms*, present the data in TONIC-style format.\n"
-"- TONIC-style table format:\n"
-"  1. Start with a title (e.g., 'Plan KSA') on top.\n"
-"  2. First table row = main metric headers: Medium, Clicks, CPC, Impressions, CPM, Views, CPV, CTR, Leads, CPL, Total Cost.\n"
-"  3. Second row = subheaders (e.g., Channel, Exp. Link Clicks, etc.).\n"
-"  4. List each platform (e.g., TikTok, YouTube) in a row with corresponding metrics.\n"
-"  5. At the bottom, include summary rows: Net Total, Total Clicks, Impressions, Views, etc.\n"
-"  6. Format the entire table in markdown using `|`, just like other tables.\n"
-"  7. Do not explain the table — output the TONIC table directly with any other requested info (like recommendations or insights).\n"
-"- Example:\n"
-"\n"
-"  Plan KSA  \n"
-"  | Medium | Clcks | CPC | Impressions | CPM | Views | CPV | CTR | Leads | CPL | Total Cost |\n"
-"  | Channel | Exp. Link Clicks | Exp. Tonic CPC | Exp. Impressions | Exp. Tonic CPM | Video Views | Exp. Tonic CPV | Exp.CTR | | Budget |\n"
-"  | Tiktok Ad | 11,630 | AED1.29 | 2,907,540 | AED5.16 | 67,843 | AED0.22 | 0.40 | 150 | 100 | 15000 |\n"
-"  | Facebook/Instagram | 18,367 | AED1.47 | 6,679,035 | AED4.04 | 734,694 | AED0.04 | 0.28 | 270 | 100 | 27000 |\n"
-"  | Twitter X | 4,511 | AED1.40 | 1,051,709 | AED5.99 | 11,429 | AED0.55 | 0.43 | 63 | 100 | 6300 |\n"
-"  | YouTube Ads | 5,630 | AED2.13 | 806,248 | AED14.88 | 544,218 | AED0.02 | 0.70 | 120 | 100 | 12000 |\n"
-"  | Search Ads | 5,246 | AED2.21 |  |  |  |  |  | 116 | 100 | 11600 |\n"
-"  | Google Display Ads | 7,850 | AED1.03 | 2,448,980 | AED3.31 | NA | NA | 0.32 | 81 | 100 | 8100 |\n"
-"  | | | | | | | | | | | |\n"
-"  | | | | | | | | Net Total | AED80,000 | | |\n"
-"  | | | | | | | | Total Clicks | 53,235 | | |\n"
-"  | | | | | | | | Total Impressions | 13,893,513 | | |\n"
-"  | | | | | | | | Total Views | 1,358,183 | | |\n\n"
-
-"- Use this format **only** if the user's query is about media planning, digital ad performance, or channel-level budget/performance comparison.\n"
-
-"**ENHANCED MEDIA PLAN FORMAT FOR CLIENT PITCHING:**\n"
-"- When users request media plans for client pitching, provide a comprehensive structured response including:\n"
-"  1. **Audience Size Details** - TAM, SAM, SOM breakdown\n"
-"  2. **Target Audience** - Demographics, psychographics, behavioral patterns\n"
-"  3. **Approach** - Strategy, objectives, and methodology\n"
-"  4. **Media Plan with Platform Split** - Detailed metrics table with all KPIs\n"
-"  5. **Notes for PPT Presentation** - Guidelines for creating presentation slides\n"
-"- Format the response with clear sections using markdown headers (###)\n"
-"- Include detailed explanations and insights for each section\n"
-"- Provide realistic and comprehensive data for all metrics\n"
-"- Add presentation tips and visual guidance for client pitches\n"
-
-"- Also provide list of sources/URLs as Sources:\n"
-"  from where you have gathered all the data (list no more than 5)\n"
-"  - ALSO NEVER LIST ANY SOURCES RELATED TO FORMATTING, ETC. LIST ONLY DATA SOURCES"
-    )
-    
-    full_prompt = (
-        f"{base_chat_prompt}\n\n"
-        f"Knowledge Base:\n{knowledge_base}\n\n"
-        f"Current Question:\n{question}"
-    )
+    full_prompt = build_chat_prompt(knowledge_base, question)
     
     # Get AI response
-    ai_response, sources = get_perplexity_response(full_prompt, conversation_history)
+    ai_response, sources = get_chat_response(full_prompt, conversation_history)
     
     # Console logging for Assistant Response
     logger.info("🤖 Assistant Response:")
@@ -741,127 +1322,303 @@ def chat():
         logger.info(f"Sources: {sources}")
     print(f"🤖 Assistant Response: {ai_response}")
     
-    # Debug: Log the AI response for plot-related queries
-    if any(word in question.lower() for word in ["graph", "plot", "chart", "visual", "visualization", "diagram"]):
-        logger.info(f"🤖 AI Response for plot query: {ai_response[:500]}...")
-        logger.info(f"🤖 AI Response length: {len(ai_response)}")
-        logger.info(f"🤖 AI Response contains plot keywords: {any(word in ai_response.lower() for word in ['chart', 'graph', 'plot', 'visual'])}")
+    # Extract tables from response, with media-plan arithmetic recomputed; the client
+    # picks their wire encoding with the Accept header
+    ai_response, parsed_tables = finalize_response_tables(ai_response)
+    tables = [table.records() for table in parsed_tables]
+    table_format = negotiate_table_format(request.headers.get('Accept'))
     
-    # Extract tables from response
-    tables = extract_tables_from_response(ai_response)
+    # ========== PLOT GENERATION ========== #
+    # Spec mode charts tables in the browser; otherwise the plot is rendered in the
+    # background and the client polls /api/plots/<plot_job_id>
+    plot_spec, plot_id, plot_job_id = None, None, None
+    intent = classify_intent(question)
+    logger.info(f"🧭 Intent: {intent.label} ({intent.confidence:.2f})")
+    plot_requested = wants_plot(intent, tables)
+    if plot_requested and plot_format == 'spec':
+        plot_spec, plot_id = build_plot_spec(tables)
     
-    # Generate plot if requested
-    plot_data = None
-    plot_code_data = None
+    # Store in session (in-memory)
+    timestamp = record_session_turn(username, session_name, question, ai_response)
     
-    # ========== PLOT GENERATION ========== #
-    # Check if plot generation is requested OR if there's tabular data that could be visualized
-    should_generate_plot = (
-        any(word in question.lower() for word in ["graph", "plot", "chart", "visual"]) or
-        (tables and len(tables) > 0) or  # Generate plot if tables are found
-        any(word in question.lower() for word in ["media plan", "marketing", "campaign", "metrics", "data"])  # Generate for business data
+    # Store in database with the tables; background plots attach their code when they finish
+    turn = save_chat_turn(
+        username, session_name, question, ai_response,
+        get_plot_store().source(plot_id) if plot_id else None,
+        parsed_tables
     )
+    message_id, table_ids = turn.ids()
+    
+    if plot_requested and plot_spec is None:
+        plot_job_id = start_plot_job(username, agenerate_plot_for_message(
+            turn, knowledge_base, question, ai_response, tables
+        ))
+        logger.info(f"🎨 Plot job {plot_job_id} queued")
+    elif not plot_requested:
+        logger.info(f"🎨 Plot generation skipped - {intent.label} question")
     
-    if should_generate_plot:
-        logger.info(f"🎨 Generating plot for question: {question}")
-        logger.info(f"🎨 Plot trigger: Tables found={len(tables) if tables else 0}, Keywords found={[word for word in ['graph', 'plot', 'chart', 'visual', 'media plan', 'marketing', 'campaign', 'metrics', 'data'] if word in question.lower()]}")
+    log_chat_response(ai_response, tables, None, None, sources)
         
-        for attempt in range(3):
-            logger.info(f"🎨 Plot generation attempt {attempt + 1}")
-            plot_code = generate_plot_code(
-                knowledge_base,
-                question,
-                ai_response
-            )
+    response = jsonify({
+        "success": True,
+        "response": ai_response,
+        "timestamp": timestamp,
+        "tables": encode_tables(parsed_tables, table_format),
+        "table_ids": table_ids,
+        "plot": None,
+        "plot_code": None,
+        "plot_job_id": plot_job_id,
+        "plot_spec": plot_spec,
+        "plot_id": plot_id,
+        "intent": intent.to_dict(),
+        "message_id": message_id,
+        "sources": sources
+    })
+    response.vary.add('Accept')
+    return response
 
-            if plot_code:
-                try:
-                    plt.clf()
-                    exec_globals = {"plt": plt, "__name__": "__main__", "pd": pd}
-                    plot_code = re.sub(r"plt\.show\(\)", "", plot_code)
-                    exec(plot_code, exec_globals)
+PLOT_IMAGE_MAX_AGE = 365 * 24 * 3600
 
-                    fig = plt.gcf()
+@app.route('/api/plots/<plot_id>.png', methods=['GET'])
+def get_plot_image(plot_id):
+    """Serve a plot size variant (?size=thumb|screen|print); the content hash is the capability"""
+    variant = request.args.get('size', DEFAULT_VARIANT)
+    if variant not in PLOT_VARIANTS:
+        return jsonify({"success": False, "message": f"size must be one of {', '.join(PLOT_VARIANTS)}"}), 400
+    
+    # Content-addressed, so a matching ETag never needs the file or a render
+    etag = f"{plot_id}-{variant}"
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+    else:
+        try:
+            path = render_plot_variant(plot_id, variant)
+        except PlotRenderError as e:
+            logger.error(f"❌ Could not render {variant} variant of plot {plot_id}: {e}")
+            return jsonify({"success": False, "message": "Plot could not be rendered"}), 500
+        if path is None:
+            return jsonify({"success": False, "message": "Plot not found"}), 404
+        response = send_file(
+            path,
+            mimetype='image/png',
+            etag=etag,
+            conditional=True,
+            max_age=PLOT_IMAGE_MAX_AGE,
+            as_attachment=request.args.get('download') == '1',
+            download_name=f"plot_{variant}.png"
+        )
+    response.cache_control.public = True
+    response.cache_control.max_age = PLOT_IMAGE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+RENDER_DPI_RANGE = (20, 600)
+RENDER_INCHES_RANGE = (1, 30)
 
-                    buf = io.BytesIO()
-                    fig.savefig(buf, format="png", dpi=300, bbox_inches='tight')
-                    buf.seek(0)
+def parse_render_options(args):
+    """Validate ?format=&dpi=&width=&height= for a re-render; returns (options, error)"""
+    format = args.get('format', 'png')
+    if format not in PLOT_IMAGE_FORMATS:
+        return None, f"format must be one of {', '.join(PLOT_IMAGE_FORMATS)}"
+    try:
+        dpi = int(args.get('dpi', PLOT_VARIANTS[DEFAULT_VARIANT]))
+        width = float(args['width']) if 'width' in args else None
+        height = float(args['height']) if 'height' in args else None
+    except ValueError:
+        return None, "dpi, width and height must be numbers"
+    if not RENDER_DPI_RANGE[0] <= dpi <= RENDER_DPI_RANGE[1]:
+        return None, f"dpi must be between {RENDER_DPI_RANGE[0]} and {RENDER_DPI_RANGE[1]}"
+    if (width is None) != (height is None):
+        return None, "width and height must be given together"
+    if width is not None and not all(RENDER_INCHES_RANGE[0] <= v <= RENDER_INCHES_RANGE[1] for v in (width, height)):
+        return None, f"width and height must be between {RENDER_INCHES_RANGE[0]} and {RENDER_INCHES_RANGE[1]} inches"
+    size = (width, height) if width is not None else None
+    return {"format": format, "dpi": dpi, "size": size}, None
+
+@app.route('/api/chat-history/<int:session_id>/messages/<int:message_id>/plot', methods=['GET'])
+@jwt_required()
+def rerender_message_plot(session_id, message_id):
+    """Re-render a message's stored plot code with new format, dpi or size, without calling the LLM"""
+    options, error = parse_render_options(request.args)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+    
+    user_id = get_history_user_id(get_jwt_identity())
+    chat_session = ChatSession.query.filter_by(id=session_id, user_id=user_id).first() if user_id is not None else None
+    if not chat_session:
+        return jsonify({"success": False, "message": "Session not found"}), 404
+    chat_message = ChatMessage.query.filter_by(id=message_id, session_id=session_id).first()
+    if not chat_message:
+        return jsonify({"success": False, "message": "Message not found"}), 404
+    if not chat_message.plot_code:
+        return jsonify({"success": False, "message": "This message has no plot"}), 404
+    
+    plot_id = get_plot_store().save_source(chat_message.plot_code)
+    variant = custom_variant(options["dpi"], options["size"])
+    format = options["format"]
+    try:
+        path = render_plot_variant(plot_id, variant, format, options["dpi"], options["size"])
+    except PlotRenderError as e:
+        logger.error(f"❌ Could not re-render plot of message {message_id}: {e}")
+        return jsonify({"success": False, "message": "Plot could not be rendered"}), 500
+    
+    response = send_file(
+        path,
+        mimetype=PLOT_IMAGE_FORMATS[format],
+        etag=f"{plot_id}-{variant}.{format}",
+        conditional=True,
+        max_age=PLOT_IMAGE_MAX_AGE,
+        as_attachment=request.args.get('download') == '1',
+        download_name=f"plot_{message_id}_{variant}.{format}"
+    )
+    response.cache_control.private = True
+    response.cache_control.public = False
+    return response
 
-                    plot_data = base64.b64encode(buf.getvalue()).decode("utf-8")
-                    plot_code_data = plot_code
-                    plt.close(fig)
-                    logger.info(f"✅ Plot generated successfully on attempt {attempt + 1}")
-                    break
+TABLE_EXPORT_MAX_AGE = 365 * 24 * 3600
 
-                except Exception as e:
-                    logger.error(f"⚠️ Plot failed on attempt {attempt + 1}: {e}")
-                    if attempt == 2:  # Last attempt
-                        plot_code_data = plot_code
-            else:
-                logger.warning(f"No plot code generated on attempt {attempt + 1}")
-                if attempt == 2:  # Last attempt
-                    break
+@app.route('/api/tables/<int:table_id>.<format>', methods=['GET'])
+@jwt_required()
+def download_table(table_id, format):
+    """Download a stored answer table as CSV, XLSX or Parquet, serialized once per format"""
+    if format not in TABLE_EXPORT_FORMATS:
+        return jsonify({"success": False, "message": f"format must be one of {', '.join(TABLE_EXPORT_FORMATS)}"}), 400
+    
+    user_id = get_history_user_id(get_jwt_identity())
+    chat_table = (
+        ChatTable.query.join(ChatMessage).join(ChatSession)
+        .filter(ChatTable.id == table_id, ChatSession.user_id == user_id)
+        .first()
+    ) if user_id is not None else None
+    if not chat_table:
+        return jsonify({"success": False, "message": "Table not found"}), 404
+    
+    # A stored table never changes, so its content hash is a strong ETag
+    etag = f"{chat_table.content_hash}.{format}"
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
     else:
-        logger.info(f"🎨 Plot generation skipped - no trigger conditions met")
+        path = get_table_export_cache().path(chat_table.content_hash, format, lambda: chat_table.data)
+        response = send_file(
+            path,
+            mimetype=TABLE_EXPORT_FORMATS[format],
+            etag=etag,
+            conditional=True,
+            max_age=TABLE_EXPORT_MAX_AGE,
+            as_attachment=True,
+            download_name=f"table_{chat_table.message_id}_{chat_table.position + 1}.{format}"
+        )
+    response.cache_control.private = True
+    response.cache_control.public = False
+    response.cache_control.max_age = TABLE_EXPORT_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/api/plots/<job_id>', methods=['GET'])
+@jwt_required()
+def get_plot(job_id):
+    """Return the status of a background plot job, with the plot once rendered"""
+    job = get_plot_job(job_id, get_jwt_identity())
+    if job is None:
+        return jsonify({"success": False, "message": "Plot job not found"}), 404
+    return jsonify({"success": True, **job.to_dict()})
+
+@app.route('/api/chat/batch', methods=['OPTIONS'])
+def chat_batch_options():
+    """Handle preflight OPTIONS request for batch chat endpoint"""
+    return make_response(), 200
+
+@app.route('/api/chat/batch', methods=['POST'])
+@jwt_required()
+def chat_batch():
+    """Answer many questions concurrently, streaming NDJSON results as they complete"""
+    username = get_jwt_identity()
+    data = request.get_json()
     
-    # Store in session (in-memory)
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    user_sessions[username][session_name].append({
-        "q": question,
-        "a": ai_response,
-        "timestamp": timestamp
-    })
+    questions, error = parse_batch_request(data)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
     
-    # Store in database
-    try:
-        # Ensure user exists in database for chat history
-        user = ensure_user_exists_for_history(username)
-        if user:
-            # Get or create session in database
-            db_session = ChatSession.query.filter_by(user_id=user.id, session_name=session_name).first()
-            if not db_session:
-                db_session = ChatSession(
-                    user_id=user.id,
-                    session_name=session_name
-                )
-                db.session.add(db_session)
-                db.session.flush()  # Get the ID
-            
-            # Save message to database
-            chat_message = ChatMessage(
-                session_id=db_session.id,
-                question=question,
-                answer=ai_response
-            )
-            db.session.add(chat_message)
-            db.session.commit()
-            logger.info(f"Message saved to database for user {username}, session {session_name}")
-    except Exception as e:
-        logger.error(f"Failed to save message to database: {e}")
-        db.session.rollback()
-        # Continue with the response even if database save fails
+    knowledge_base = data.get('knowledge_base', '')
+    conversation_history = data.get('conversation_history', [])
+    session_name = data.get('session_name', 'Default')
     
-    # Log response data
-    logger.info(f"📤 Sending response to client:")
-    logger.info(f"   📄 Response length: {len(ai_response)} characters")
-    logger.info(f"   📊 Tables found: {len(tables)}")
-    logger.info(f"   🎨 Plot data: {'Present' if plot_data else 'None'}")
-    logger.info(f"   📝 Plot code: {'Present' if plot_code_data else 'None'}")
-    if plot_data:
-        logger.info(f"   🎨 Plot data size: {len(plot_data)} characters")
-    if plot_code_data:
-        logger.info(f"   📝 Plot code size: {len(plot_code_data)} characters")
-    logger.info(f"   🔗 Sources: {len(sources) if sources else 0}")
-        
-    return jsonify({
-        "success": True,
-        "response": ai_response,
-        "timestamp": timestamp,
-        "tables": tables,
-        "plot": plot_data,
-        "plot_code": plot_code_data,
-        "sources": sources
-    })
+    # Use stored knowledge base if not provided
+    if not knowledge_base and username in knowledge_bases:
+        knowledge_base = knowledge_bases[username]
+    
+    logger.info(f"📦 Batch chat for {username}: {len(questions)} questions")
+    futures = [
+        providers.submit(coro)
+        for coro in batch_answer_coroutines(
+            questions, knowledge_base, conversation_history, negotiate_table_format(request.headers.get('Accept'))
+        )
+    ]
+    
+    indexes = {future: index for index, future in enumerate(futures)}
+    
+    def generate():
+        answers, failed = [], []
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                index = indexes[future]
+                try:
+                    answer = future.result()
+                except Exception as e:
+                    failed.append(index)
+                    yield json.dumps(batch_error_event(index, questions[index], e)) + "\n"
+                    continue
+                answers.append(answer)
+                yield json.dumps(answer) + "\n"
+        finally:
+            # Client went away: stop spending provider quota on the rest, but keep what was answered
+            for future in futures:
+                future.cancel()
+            done = finish_batch(username, session_name, answers, len(questions), failed)
+        yield json.dumps(done) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/chat/stream', methods=['OPTIONS'])
+def chat_stream_options():
+    """Handle preflight OPTIONS request for streaming chat endpoint"""
+    return make_response(), 200
+
+@app.route('/api/chat/stream', methods=['POST'])
+@jwt_required()
+def chat_stream():
+    """Answer one question, streaming NDJSON text deltas and each table as soon as it is complete"""
+    username = get_jwt_identity()
+    data = request.get_json()
+    
+    question = data.get('question')
+    knowledge_base = data.get('knowledge_base', '')
+    conversation_history = data.get('conversation_history', [])
+    session_name = data.get('session_name', 'Default')
+    
+    if not question:
+        return jsonify({"success": False, "message": "Question is required"}), 400
+    
+    plot_format = data.get('plot_format', DEFAULT_PLOT_FORMAT)
+    if plot_format not in PLOT_FORMATS:
+        return jsonify({"success": False, "message": f"plot_format must be one of {', '.join(PLOT_FORMATS)}"}), 400
+    
+    # Use stored knowledge base if not provided
+    if not knowledge_base and username in knowledge_bases:
+        knowledge_base = knowledge_bases[username]
+    
+    full_prompt = build_chat_prompt(knowledge_base, question)
+    table_format = negotiate_table_format(request.headers.get('Accept'))
+    
+    def generate():
+        for event in providers.iterate_sync(astream_chat_response(full_prompt, conversation_history, table_format)):
+            if event["type"] == "answer":
+                event = finish_chat_stream(username, session_name, question, knowledge_base, plot_format, event)
+            yield json.dumps(event) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/api/sessions', methods=['GET'])
 @jwt_required()
@@ -942,43 +1699,102 @@ def get_session_messages(session_name):
 @app.route('/api/chat-history', methods=['GET'])
 @jwt_required()
 def get_chat_history():
-    """Get all chat history for the authenticated user"""
+    """
+    Get the authenticated user's chat sessions, newest first, a page at a time.
+    ?limit= sets the page size and ?cursor= continues from a previous page's
+    next_cursor. ?summary=1 returns session metadata with message counts only,
+    without message bodies.
+    """
+    from sqlalchemy import and_, func, or_, select
+    from sqlalchemy.orm import load_only, selectinload
+    
     username = get_jwt_identity()
+    summary = request.args.get('summary', '').lower() in ('1', 'true', 'yes')
+    try:
+        limit = parse_page_size(request.args.get('limit'), CHAT_HISTORY_PAGE_SIZE, CHAT_HISTORY_MAX_PAGE_SIZE)
+        cursor = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({
+            "success": False, "message": "limit must be a positive integer and cursor a next_cursor value"
+        }), 400
     
     try:
         # Ensure user exists in database for chat history
-        user = ensure_user_exists_for_history(username)
-        if not user:
+        user_id = get_history_user_id(username)
+        if user_id is None:
             return jsonify({"success": False, "message": "Failed to create user for chat history"}), 500
         
-        # Get all chat sessions for the user
-        chat_sessions = ChatSession.query.filter_by(user_id=user.id).order_by(ChatSession.created_at.desc()).all()
-        
+        conditions = [ChatSession.user_id == user_id]
+        if cursor:
+            created_at, session_id = cursor
+            conditions.append(or_(
+                ChatSession.created_at < created_at,
+                and_(ChatSession.created_at == created_at, ChatSession.id < session_id)
+            ))
+        order = (ChatSession.created_at.desc(), ChatSession.id.desc())
+        
+        # One query per page either way (plus one IN query for the messages in full mode);
+        # a page is fetched one row long to tell whether there is a next one, and every
+        # row carries the user's total session count
+        count_sessions = select(func.count(ChatSession.id)).where(ChatSession.user_id == user_id)
+        total_sessions = count_sessions.scalar_subquery()
         history = []
-        for session in chat_sessions:
-            # Get messages for this session
-            messages = ChatMessage.query.filter_by(session_id=session.id).order_by(ChatMessage.timestamp).all()
-            
-            session_data = {
-                "session_id": session.id,
-                "session_name": session.session_name,
-                "created_at": session.created_at.isoformat(),
-                "message_count": len(messages),
-                "messages": [
-                    {
-                        "id": msg.id,
-                        "question": msg.question,
-                        "answer": msg.answer,
-                        "timestamp": msg.timestamp.isoformat()
-                    } for msg in messages
-                ]
-            }
-            history.append(session_data)
-        
+        if summary:
+            rows = (
+                db.session.query(ChatSession, func.count(ChatMessage.id), func.max(ChatMessage.timestamp), total_sessions)
+                .outerjoin(ChatMessage, ChatMessage.session_id == ChatSession.id)
+                .filter(*conditions)
+                .group_by(ChatSession.id)
+                .order_by(*order)
+                .limit(limit + 1)
+                .all()
+            )
+            sessions = [row[0] for row in rows[:limit]]
+            for session, message_count, last_message_at, _ in rows[:limit]:
+                history.append({
+                    "session_id": session.id,
+                    "session_name": session.session_name,
+                    "created_at": session.created_at.isoformat(),
+                    "message_count": message_count,
+                    "last_message_at": last_message_at.isoformat() if last_message_at else None
+                })
+        else:
+            rows = (
+                db.session.query(ChatSession, total_sessions)
+                .options(selectinload(ChatSession.messages).options(load_only(
+                    ChatMessage.id, ChatMessage.question, ChatMessage.answer, ChatMessage.timestamp
+                )))
+                .filter(*conditions)
+                .order_by(*order)
+                .limit(limit + 1)
+                .all()
+            )
+            sessions = [row[0] for row in rows[:limit]]
+            for session in sessions:
+                history.append({
+                    "session_id": session.id,
+                    "session_name": session.session_name,
+                    "created_at": session.created_at.isoformat(),
+                    "message_count": len(session.messages),
+                    "messages": [
+                        {
+                            "id": msg.id,
+                            "question": msg.question,
+                            "answer": msg.answer,
+                            "timestamp": msg.timestamp.isoformat()
+                        } for msg in session.messages
+                    ]
+                })
+        
+        next_cursor = encode_cursor(sessions[-1].created_at, sessions[-1].id) if len(rows) > limit else None
+        # An empty page past the last session still reports the total
+        total = rows[0][-1] if rows else (db.session.scalar(count_sessions) if cursor else 0)
         return jsonify({
             "success": True,
             "chat_history": history,
-            "total_sessions": len(history)
+            "total_sessions": total,
+            "page_count": len(history),
+            "next_cursor": next_cursor
         })
         
     except Exception as e:
@@ -988,36 +1804,106 @@ def get_chat_history():
 @app.route('/api/chat-history/<int:session_id>', methods=['GET'])
 @jwt_required()
 def get_chat_session_history(session_id):
-    """Get chat history for a specific session"""
+    """
+    Get a page of a session's messages, oldest first. Without a cursor this is
+    the latest ?limit= messages; ?before= and ?after= take a page's
+    before_cursor or after_cursor to page back or forward.
+    """
+    from sqlalchemy import and_, func, or_, select
+    from sqlalchemy.orm import load_only
+    
     username = get_jwt_identity()
+    before, after = request.args.get('before'), request.args.get('after')
+    try:
+        if before and after:
+            raise ValueError("before and after are exclusive")
+        limit = parse_page_size(request.args.get('limit'), SESSION_MESSAGES_PAGE_SIZE, SESSION_MESSAGES_MAX_PAGE_SIZE)
+        cursor = decode_cursor(before or after) if before or after else None
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "message": "limit must be a positive integer, and before or after (not both) a cursor from a previous page"
+        }), 400
     
     try:
         # Ensure user exists in database for chat history
-        user = ensure_user_exists_for_history(username)
-        if not user:
+        user_id = get_history_user_id(username)
+        if user_id is None:
             return jsonify({"success": False, "message": "Failed to create user for chat history"}), 500
         
-        # Get the specific chat session
-        chat_session = ChatSession.query.filter_by(id=session_id, user_id=user.id).first()
-        if not chat_session:
+        # Get the specific chat session with its total message count in the same query
+        message_count = (
+            select(func.count(ChatMessage.id)).where(ChatMessage.session_id == ChatSession.id).scalar_subquery()
+        )
+        found = (
+            db.session.query(ChatSession, message_count)
+            .filter(ChatSession.id == session_id, ChatSession.user_id == user_id)
+            .first()
+        )
+        if not found:
             return jsonify({"success": False, "message": "Session not found"}), 404
-        
-        # Get messages for this session
-        messages = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.timestamp).all()
+        chat_session, message_count = found
+        
+        # One range scan of the (session_id, timestamp, id) index, a row past the page
+        # to tell whether there is more; plot code is only checked for, not loaded
+        query = (
+            db.session.query(ChatMessage, ChatMessage.plot_code.isnot(None))
+            .options(load_only(ChatMessage.id, ChatMessage.question, ChatMessage.answer, ChatMessage.timestamp))
+            .filter(ChatMessage.session_id == session_id)
+        )
+        if after:
+            timestamp, message_id = cursor
+            query = query.filter(or_(
+                ChatMessage.timestamp > timestamp,
+                and_(ChatMessage.timestamp == timestamp, ChatMessage.id > message_id)
+            )).order_by(ChatMessage.timestamp, ChatMessage.id)
+        else:
+            if before:
+                timestamp, message_id = cursor
+                query = query.filter(or_(
+                    ChatMessage.timestamp < timestamp,
+                    and_(ChatMessage.timestamp == timestamp, ChatMessage.id < message_id)
+                ))
+            query = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+        rows = query.limit(limit + 1).all()
+        more = len(rows) > limit
+        rows = rows[:limit] if after else rows[:limit][::-1]
+        messages = [msg for msg, _ in rows]
+        
+        # Older messages exist past a backward page with more, or before any forward page;
+        # newer ones past a forward page with more, or after any backward page
+        has_older = bool(messages) and (more or bool(after))
+        has_newer = bool(messages) and (more if after else bool(before))
+        
+        # Table ids for every message in one query
+        table_ids = {}
+        if messages:
+            table_rows = (
+                db.session.query(ChatTable.message_id, ChatTable.id)
+                .filter(ChatTable.message_id.in_([msg.id for msg in messages]))
+                .order_by(ChatTable.message_id, ChatTable.position)
+            )
+            for message_id, table_id in table_rows:
+                table_ids.setdefault(message_id, []).append(table_id)
         
         session_data = {
             "session_id": chat_session.id,
             "session_name": chat_session.session_name,
             "created_at": chat_session.created_at.isoformat(),
-            "message_count": len(messages),
+            "message_count": message_count,
+            "page_count": len(messages),
             "messages": [
                 {
                     "id": msg.id,
                     "question": msg.question,
                     "answer": msg.answer,
+                    "has_plot": has_plot,
+                    "table_ids": table_ids.get(msg.id, []),
                     "timestamp": msg.timestamp.isoformat()
-                } for msg in messages
-            ]
+                } for msg, has_plot in rows
+            ],
+            "before_cursor": encode_cursor(messages[0].timestamp, messages[0].id) if has_older else None,
+            "after_cursor": encode_cursor(messages[-1].timestamp, messages[-1].id) if has_newer else None
         }
         
         return jsonify({
@@ -1044,20 +1930,20 @@ def create_chat_session():
     
     try:
         # Ensure user exists in database for chat history
-        user = ensure_user_exists_for_history(username)
-        if not user:
+        user_id = get_history_user_id(username)
+        if user_id is None:
             return jsonify({"success": False, "message": "Failed to create user for chat history"}), 500
         
         # Check if session name already exists for this user
         # For "Default" sessions, we allow multiple sessions with the same name
         if session_name != "Default":
-            existing_session = ChatSession.query.filter_by(user_id=user.id, session_name=session_name).first()
+            existing_session = ChatSession.query.filter_by(user_id=user_id, session_name=session_name).first()
             if existing_session:
                 return jsonify({"success": False, "message": "Session name already exists"}), 400
         
         # Create new session
         new_session = ChatSession(
-            user_id=user.id,
+            user_id=user_id,
             session_name=session_name
         )
         
@@ -1092,18 +1978,18 @@ def update_chat_session(session_id):
     
     try:
         # Ensure user exists in database for chat history
-        user = ensure_user_exists_for_history(username)
-        if not user:
+        user_id = get_history_user_id(username)
+        if user_id is None:
             return jsonify({"success": False, "message": "Failed to create user for chat history"}), 500
         
         # Get the session
-        chat_session = ChatSession.query.filter_by(id=session_id, user_id=user.id).first()
+        chat_session = ChatSession.query.filter_by(id=session_id, user_id=user_id).first()
         if not chat_session:
             return jsonify({"success": False, "message": "Session not found"}), 404
         
         # Check if new name already exists
         existing_session = ChatSession.query.filter_by(
-            user_id=user.id, 
+            user_id=user_id, 
             session_name=new_session_name
         ).filter(ChatSession.id != session_id).first()
         
@@ -1137,16 +2023,19 @@ def delete_chat_session(session_id):
     
     try:
         # Ensure user exists in database for chat history
-        user = ensure_user_exists_for_history(username)
-        if not user:
+        user_id = get_history_user_id(username)
+        if user_id is None:
             return jsonify({"success": False, "message": "Failed to create user for chat history"}), 500
         
         # Get the session
-        chat_session = ChatSession.query.filter_by(id=session_id, user_id=user.id).first()
+        chat_session = ChatSession.query.filter_by(id=session_id, user_id=user_id).first()
         if not chat_session:
             return jsonify({"success": False, "message": "Session not found"}), 404
         
-        # Delete all messages in the session first (cascade should handle this, but explicit for safety)
+        # Delete all messages in the session first (cascade should handle this, but explicit for safety);
+        # bulk deletes skip the ORM cascade, so their tables go first
+        message_ids = db.session.query(ChatMessage.id).filter_by(session_id=session_id)
+        ChatTable.query.filter(ChatTable.message_id.in_(message_ids.scalar_subquery())).delete(synchronize_session=False)
         ChatMessage.query.filter_by(session_id=session_id).delete()
         
         # Delete the session
@@ -1178,12 +2067,12 @@ def add_chat_message(session_id):
     
     try:
         # Ensure user exists in database for chat history
-        user = ensure_user_exists_for_history(username)
-        if not user:
+        user_id = get_history_user_id(username)
+        if user_id is None:
             return jsonify({"success": False, "message": "Failed to create user for chat history"}), 500
         
         # Get the session
-        chat_session = ChatSession.query.filter_by(id=session_id, user_id=user.id).first()
+        chat_session = ChatSession.query.filter_by(id=session_id, user_id=user_id).first()
         if not chat_session:
             return jsonify({"success": False, "message": "Session not found"}), 404
         
@@ -1221,12 +2110,12 @@ def delete_chat_message(session_id, message_id):
     
     try:
         # Ensure user exists in database for chat history
-        user = ensure_user_exists_for_history(username)
-        if not user:
+        user_id = get_history_user_id(username)
+        if user_id is None:
             return jsonify({"success": False, "message": "Failed to create user for chat history"}), 500
         
         # Get the session
-        chat_session = ChatSession.query.filter_by(id=session_id, user_id=user.id).first()
+        chat_session = ChatSession.query.filter_by(id=session_id, user_id=user_id).first()
         if not chat_session:
             return jsonify({"success": False, "message": "Session not found"}), 404
         
@@ -1252,51 +2141,57 @@ def delete_chat_message(session_id, message_id):
 @app.route('/api/chat-history/search', methods=['GET'])
 @jwt_required()
 def search_chat_history():
-    """Search chat history by question or answer content"""
+    """
+    Full-text search of the user's questions and answers, best match first
+    (see chat_search). ?limit= and ?offset= page through the results.
+    """
     username = get_jwt_identity()
     query = request.args.get('q', '').strip()
     
     if not query:
         return jsonify({"success": False, "message": "Search query is required"}), 400
+    try:
+        limit = parse_page_size(request.args.get('limit'), SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE)
+        offset = int(request.args.get('offset') or 0)
+        if offset < 0:
+            raise ValueError(f"Invalid offset: {offset}")
+    except ValueError:
+        return jsonify({"success": False, "message": "limit must be a positive integer and offset non-negative"}), 400
     
     try:
         # Ensure user exists in database for chat history
-        user = ensure_user_exists_for_history(username)
-        if not user:
+        user_id = get_history_user_id(username)
+        if user_id is None:
             return jsonify({"success": False, "message": "Failed to create user for chat history"}), 500
         
-        # Search in messages
-        from sqlalchemy import or_
-        
-        messages = db.session.query(ChatMessage).join(ChatSession).filter(
-            ChatSession.user_id == user.id,
-            or_(
-                ChatMessage.question.ilike(f'%{query}%'),
-                ChatMessage.answer.ilike(f'%{query}%')
-            )
-        ).order_by(ChatMessage.timestamp.desc()).all()
-        
-        results = []
-        for msg in messages:
-            session = ChatSession.query.get(msg.session_id)
-            results.append({
-                "message_id": msg.id,
-                "session_id": msg.session_id,
-                "session_name": session.session_name if session else "Unknown Session",
-                "question": msg.question,
-                "answer": msg.answer,
-                "timestamp": msg.timestamp.isoformat()
-            })
+        # One ranked, indexed query with the session names joined in, a row past the page to detect more
+        start = time.perf_counter()
+        rows = search_messages(db.session, user_id, query, limit + 1, offset)
+        logger.info(f"🔎 Search ({get_search_backend()}): {len(rows)} hits in {(time.perf_counter() - start) * 1000:.1f}ms")
+        
+        results = [
+            {
+                "message_id": row["message_id"],
+                "session_id": row["session_id"],
+                "session_name": row["session_name"],
+                "question": row["question"],
+                "snippet": row["snippet"],
+                "score": row["score"],
+                "timestamp": row["timestamp"].isoformat()
+            } for row in rows[:limit]
+        ]
         
         return jsonify({
             "success": True,
             "search_results": results,
             "total_results": len(results),
+            "next_offset": offset + limit if len(rows) > limit else None,
             "query": query
         })
         
     except Exception as e:
         logger.error(f"Error searching chat history: {e}")
+        db.session.rollback()
         return jsonify({"success": False, "message": "Failed to search chat history"}), 500
 
 @app.route('/api/chat-history/export/<int:session_id>', methods=['GET'])
@@ -1307,12 +2202,12 @@ def export_chat_session(session_id):
     
     try:
         # Ensure user exists in database for chat history
-        user = ensure_user_exists_for_history(username)
-        if not user:
+        user_id = get_history_user_id(username)
+        if user_id is None:
             return jsonify({"success": False, "message": "Failed to create user for chat history"}), 500
         
         # Get the session
-        chat_session = ChatSession.query.filter_by(id=session_id, user_id=user.id).first()
+        chat_session = ChatSession.query.filter_by(id=session_id, user_id=user_id).first()
         if not chat_session:
             return jsonify({"success": False, "message": "Session not found"}), 404
         
@@ -1346,14 +2241,34 @@ def export_chat_session(session_id):
         logger.error(f"Error exporting chat session: {e}")
         return jsonify({"success": False, "message": "Failed to export session"}), 500
 
+def migrate_database():
+    """Add columns and indexes introduced after the tables were first created (create_all never alters tables)"""
+    from sqlalchemy import inspect, text
+    columns = {column["name"] for column in inspect(db.engine).get_columns("chat_messages")}
+    if "plot_code" not in columns:
+        with db.engine.begin() as connection:
+            connection.execute(text("ALTER TABLE chat_messages ADD COLUMN plot_code TEXT"))
+        logger.info("Added chat_messages.plot_code column")
+    # Likewise for indexes added to existing tables
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    setup_search_index(db.engine)
+
 def init_database():
     """Initialize database tables and add default users"""
     with app.app_context():
         try:
             # Create all tables
             db.create_all()
+            migrate_database()
             logger.info("Database tables created successfully")
             
+            # Async chat persistence reserves ids from sequences, which only Postgres has
+            if chat_writer.mode == CHAT_ASYNC and db.engine.dialect.name != "postgresql":
+                logger.warning(f"⚠️ CHAT_PERSISTENCE=async needs Postgres, writing chat turns synchronously on {db.engine.dialect.name}")
+                chat_writer.mode = CHAT_SYNC
+            
             # Add default users if they don't exist
             default_users = [
                 {"username": "admin@123", "password": "admin123"},
@@ -1381,4 +2296,5 @@ def init_database():
 if __name__ == '__main__':
     # Initialize database before running the app
     init_database()
+    get_renderer_pool().start()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,303 @@
+"""
+ASGI entry point for the TONIC AI backend.
+
+Serves /api/chat, /api/chat/batch, /api/chat/stream and /api/upload natively on asyncio so a request waiting on
+an LLM provider holds a coroutine rather than an OS thread. Every other route
+is delegated to the Flask app, so this is a drop-in replacement for app.py:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import json
+
+from flask_jwt_extended import decode_token
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import (
+    CORS_ORIGINS,
+    DEFAULT_PLOT_FORMAT,
+    PLOT_FORMATS,
+    aextract_structured_info,
+    agenerate_plot_for_message,
+    aget_chat_response,
+    astream_chat_response,
+    app as flask_app,
+    batch_answer_coroutines,
+    batch_error_event,
+    build_chat_prompt,
+    build_plot_spec,
+    chat_writer,
+    extract_file_text,
+    finalize_response_tables,
+    finish_batch,
+    finish_chat_stream,
+    init_database,
+    knowledge_bases,
+    log_chat_response,
+    logger,
+    parse_batch_request,
+    record_session_turn,
+    save_chat_turn,
+)
+from intent import classify_intent, wants_plot
+from plot_cache import get_plot_store
+from plot_jobs import start_plot_job
+from plot_sandbox import get_renderer_pool
+from table_codec import encode_tables, negotiate_table_format
+
+
+class AuthError(Exception):
+    pass
+
+
+def get_identity(request):
+    """Validate the Bearer token with the Flask JWT settings and return its identity"""
+    auth_header = request.headers.get("Authorization", "")
+    if not auth_header.startswith("Bearer "):
+        raise AuthError("Missing Authorization Header")
+    try:
+        with flask_app.app_context():
+            claims = decode_token(auth_header[len("Bearer "):])
+    except Exception as e:
+        raise AuthError(str(e)) from e
+    return claims[flask_app.config["JWT_IDENTITY_CLAIM"]]
+
+
+def run_in_app_context(func, *args):
+    """Run a blocking database helper in a worker thread inside a Flask app context"""
+    def wrapper():
+        with flask_app.app_context():
+            return func(*args)
+    return asyncio.to_thread(wrapper)
+
+
+async def upload_files(request):
+    try:
+        username = get_identity(request)
+    except AuthError as e:
+        return JSONResponse({"msg": str(e)}, status_code=401)
+
+    form = await request.form()
+    files = [f for f in form.getlist("files") if getattr(f, "filename", "")]
+    if not form.getlist("files"):
+        return JSONResponse({"success": False, "message": "No files provided"}, status_code=400)
+    if not files:
+        return JSONResponse({"success": False, "message": "No files selected"}, status_code=400)
+
+    # Parse files in worker threads, then run all Gemini extractions concurrently
+    texts = await asyncio.gather(*(
+        asyncio.to_thread(extract_file_text, f.file, f.content_type) for f in files
+    ))
+    extractions = [
+        (f.filename, aextract_structured_info(text, f.filename))
+        for f, text in zip(files, texts) if text
+    ]
+    outputs = await asyncio.gather(*(coro for _, coro in extractions))
+
+    full_text = ""
+    for (filename, _), structured_output in zip(extractions, outputs):
+        if structured_output:
+            full_text += f"\n\n--- Extracted from {filename} ---\n\n{structured_output}"
+
+    # Store knowledge base for user
+    knowledge_bases[username] = full_text
+
+    return JSONResponse({
+        "success": True,
+        "message": f"Successfully processed {len(files)} file(s)",
+        "knowledge_base": full_text
+    })
+
+
+async def chat(request):
+    try:
+        username = get_identity(request)
+    except AuthError as e:
+        return JSONResponse({"msg": str(e)}, status_code=401)
+
+    data = await request.json()
+
+    question = data.get('question')
+    knowledge_base = data.get('knowledge_base', '')
+    conversation_history = data.get('conversation_history', [])
+    session_name = data.get('session_name', 'Default')
+
+    if not question:
+        return JSONResponse({"success": False, "message": "Question is required"}, status_code=400)
+
+    plot_format = data.get('plot_format', DEFAULT_PLOT_FORMAT)
+    if plot_format not in PLOT_FORMATS:
+        return JSONResponse({"success": False, "message": f"plot_format must be one of {', '.join(PLOT_FORMATS)}"}, status_code=400)
+
+    # Use stored knowledge base if not provided
+    if not knowledge_base and username in knowledge_bases:
+        knowledge_base = knowledge_bases[username]
+
+    full_prompt = build_chat_prompt(knowledge_base, question)
+    ai_response, sources = await aget_chat_response(full_prompt, conversation_history)
+
+    ai_response, parsed_tables = finalize_response_tables(ai_response)
+    tables = [table.records() for table in parsed_tables]
+
+    plot_spec, plot_id, plot_job_id = None, None, None
+    intent = classify_intent(question)
+    plot_requested = wants_plot(intent, tables)
+    if plot_requested and plot_format == 'spec':
+        plot_spec, plot_id = await asyncio.to_thread(build_plot_spec, tables)
+
+    timestamp = record_session_turn(username, session_name, question, ai_response)
+    plot_code = get_plot_store().source(plot_id) if plot_id else None
+    turn = await run_in_app_context(
+        save_chat_turn, username, session_name, question, ai_response, plot_code, parsed_tables
+    )
+    message_id, table_ids = turn.ids()
+
+    if plot_requested and plot_spec is None:
+        plot_job_id = start_plot_job(username, agenerate_plot_for_message(
+            turn, knowledge_base, question, ai_response, tables
+        ))
+
+    log_chat_response(ai_response, tables, None, None, sources)
+
+    return JSONResponse({
+        "success": True,
+        "response": ai_response,
+        "timestamp": timestamp,
+        "tables": encode_tables(parsed_tables, negotiate_table_format(request.headers.get('accept'))),
+        "table_ids": table_ids,
+        "plot": None,
+        "plot_code": None,
+        "plot_job_id": plot_job_id,
+        "plot_spec": plot_spec,
+        "plot_id": plot_id,
+        "intent": intent.to_dict(),
+        "message_id": message_id,
+        "sources": sources
+    }, headers={"Vary": "Accept"})
+
+
+async def chat_batch(request):
+    try:
+        username = get_identity(request)
+    except AuthError as e:
+        return JSONResponse({"msg": str(e)}, status_code=401)
+
+    data = await request.json()
+    questions, error = parse_batch_request(data)
+    if error:
+        return JSONResponse({"success": False, "message": error}, status_code=400)
+
+    knowledge_base = data.get('knowledge_base', '')
+    conversation_history = data.get('conversation_history', [])
+    session_name = data.get('session_name', 'Default')
+
+    # Use stored knowledge base if not provided
+    if not knowledge_base and username in knowledge_bases:
+        knowledge_base = knowledge_bases[username]
+
+    async def generate():
+        tasks = [asyncio.ensure_future(c) for c in batch_answer_coroutines(
+            questions, knowledge_base, conversation_history, negotiate_table_format(request.headers.get('accept'))
+        )]
+        answers, failed = [], []
+        try:
+            pending = set(tasks)
+            while pending:
+                # Wait on the tasks themselves so a failure can be reported with its question's index
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(finished, key=tasks.index):
+                    index = tasks.index(task)
+                    try:
+                        answer = task.result()
+                    except Exception as e:
+                        failed.append(index)
+                        yield json.dumps(batch_error_event(index, questions[index], e)) + "\n"
+                        continue
+                    answers.append(answer)
+                    yield json.dumps(answer) + "\n"
+        finally:
+            # Client went away: stop spending provider quota on the rest, but keep what was answered
+            for task in tasks:
+                task.cancel()
+            done = await run_in_app_context(finish_batch, username, session_name, answers, len(questions), failed)
+        yield json.dumps(done) + "\n"
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+
+async def chat_stream(request):
+    try:
+        username = get_identity(request)
+    except AuthError as e:
+        return JSONResponse({"msg": str(e)}, status_code=401)
+
+    data = await request.json()
+
+    question = data.get('question')
+    knowledge_base = data.get('knowledge_base', '')
+    conversation_history = data.get('conversation_history', [])
+    session_name = data.get('session_name', 'Default')
+
+    if not question:
+        return JSONResponse({"success": False, "message": "Question is required"}, status_code=400)
+
+    plot_format = data.get('plot_format', DEFAULT_PLOT_FORMAT)
+    if plot_format not in PLOT_FORMATS:
+        return JSONResponse({"success": False, "message": f"plot_format must be one of {', '.join(PLOT_FORMATS)}"}, status_code=400)
+
+    # Use stored knowledge base if not provided
+    if not knowledge_base and username in knowledge_bases:
+        knowledge_base = knowledge_bases[username]
+
+    full_prompt = build_chat_prompt(knowledge_base, question)
+    table_format = negotiate_table_format(request.headers.get('accept'))
+
+    async def generate():
+        async for event in astream_chat_response(full_prompt, conversation_history, table_format):
+            if event["type"] == "answer":
+                event = await run_in_app_context(
+                    finish_chat_stream, username, session_name, question, knowledge_base, plot_format, event
+                )
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+
+def on_startup():
+    init_database()
+    get_renderer_pool().start()
+    logger.info("ASGI server ready")
+
+
+def on_shutdown():
+    # Write the turns still queued by async chat persistence
+    chat_writer.close()
+
+
+application = Starlette(
+    routes=[
+        Route('/api/chat', chat, methods=['POST']),
+        Route('/api/chat/batch', chat_batch, methods=['POST']),
+        Route('/api/chat/stream', chat_stream, methods=['POST']),
+        Route('/api/upload', upload_files, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=CORS_ORIGINS,
+            allow_credentials=True,
+            allow_methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
+            allow_headers=['Content-Type', 'Authorization', 'X-Requested-With', 'Accept', 'Origin'],
+            expose_headers=['Content-Type', 'Authorization'],
+        ),
+    ],
+    on_startup=[on_startup],
+    on_shutdown=[on_shutdown],
+)
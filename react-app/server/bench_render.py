@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark plot rendering: global pyplot versus the per-request Figure engine.
+
+Each mode runs in a fresh interpreter so the first plot pays for the
+matplotlib import and font loading exactly like the first plot after a
+server boot. Reports the first-plot time, the warm-up time (for the engine,
+paid at startup instead), the median steady-state render time, and how many
+renders came out wrong when 8 threads render different charts at once.
+
+    python bench_render.py
+    python bench_render.py --renders 50 --cold-font-cache
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CHART_CODE = """
+import matplotlib.pyplot as plt
+x = ['Meta', 'TikTok', 'Snapchat', 'Google Search', 'YouTube']
+y = [{scale} * v for v in [11630, 8420, 5120, 3900, 6100]]
+plt.figure(figsize=(14, 5))
+plt.subplot(1, 2, 1)
+plt.pie(y, labels=x, autopct='%1.1f%%', startangle=90)
+plt.title('Budget share')
+plt.axis('equal')
+plt.subplot(1, 2, 2)
+plt.bar(x, y)
+plt.ylabel('Exp. Link Clicks')
+plt.title('Clicks by platform')
+plt.xticks(rotation=30, ha='right')
+plt.tight_layout()
+"""
+
+
+def _chart(index):
+    return CHART_CODE.format(scale=index % 4 + 1)
+
+
+def _run_pyplot(renders):
+    start = time.perf_counter()
+    import io
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    def render(code):
+        plt.close("all")
+        exec(code, {"plt": plt, "__name__": "__main__"})
+        buf = io.BytesIO()
+        plt.gcf().savefig(buf, format="png", dpi=100, bbox_inches="tight")
+        plt.close("all")
+        return buf.getvalue()
+
+    render(_chart(0))
+    first = time.perf_counter() - start
+    return {"warm_up": 0.0, "first": first, **_steady_and_threads(render, renders)}
+
+
+def _run_engine(renders):
+    start = time.perf_counter()
+    from plot_render import render_plot, warm_up
+    warm_up()
+    warm = time.perf_counter() - start
+
+    start = time.perf_counter()
+    render_plot(_chart(0))
+    first = time.perf_counter() - start
+    return {"warm_up": warm, "first": first, **_steady_and_threads(render_plot, renders)}
+
+
+def _steady_and_threads(render, renders):
+    from concurrent.futures import ThreadPoolExecutor
+
+    times = []
+    expected = {}
+    for index in range(renders):
+        start = time.perf_counter()
+        expected.setdefault(index % 4, render(_chart(index)))
+        times.append(time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda i: (i, _safe(render, _chart(i))), range(renders)))
+    wrong = sum(image != expected[i % 4] for i, image in results)
+    return {"steady": statistics.median(times), "threaded_wrong": wrong, "renders": renders}
+
+
+def _safe(render, code):
+    try:
+        return render(code)
+    except Exception:
+        return None
+
+
+def _spawn(mode, renders, cold_font_cache):
+    env = dict(os.environ)
+    with tempfile.TemporaryDirectory() as config_dir:
+        if cold_font_cache:
+            env["MPLCONFIGDIR"] = config_dir
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "_run", mode, str(renders)],
+            env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "_run":
+        runner = _run_pyplot if sys.argv[2] == "pyplot" else _run_engine
+        print(json.dumps(runner(int(sys.argv[3]))))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", type=int, default=24)
+    parser.add_argument("--cold-font-cache", action="store_true", help="start with an empty matplotlib cache dir")
+    args = parser.parse_args()
+
+    print(f"{'mode':<22}{'warm-up':>10}{'first plot':>12}{'steady':>10}{'threaded wrong':>16}")
+    for mode, label in (("pyplot", "before: global pyplot"), ("engine", "after: Figure engine")):
+        result = _spawn(mode, args.renders, args.cold_font_cache)
+        print(
+            f"{label:<22}{result['warm_up'] * 1000:>8.0f}ms{result['first'] * 1000:>10.0f}ms"
+            f"{result['steady'] * 1000:>8.0f}ms{result['threaded_wrong']:>9}/{result['renders']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
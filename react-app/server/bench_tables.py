@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark markdown table extraction on long multi-table answers.
+
+Compares the previous newline-split extractor (which dropped rows whose cell
+count differed from the header, including any row with an empty cell) with
+table_parser, fed the whole answer at once and as a stream of small
+LLM-sized chunks, with and without typed DataFrame conversion. Then compares the size and
+JSON parse time of the chat response's tables in each wire encoding.
+
+    python bench_tables.py
+    python bench_tables.py --tables 40 --rows 200 --chunk 4
+"""
+
+import argparse
+import json
+import random
+import re
+import statistics
+import time
+
+import pandas as pd
+
+from table_codec import TABLE_FORMATS, encode_tables
+from table_parser import TableStreamParser, parse_tables
+
+PLATFORMS = ["Tiktok Ad", "Facebook/Instagram", "Twitter X", "Google Display Ads", "Snapchat", "YouTube", "LinkedIn"]
+
+
+def legacy_extract_tables(response_text):
+    """The extractor table_parser replaced"""
+    tables = []
+    lines = response_text.split('\n')
+    table_blocks = []
+    current_block = []
+    for line in lines:
+        if '|' in line and line.strip():
+            current_block.append(line.strip())
+        elif current_block:
+            table_blocks.append(current_block)
+            current_block = []
+    if current_block:
+        table_blocks.append(current_block)
+    for block in table_blocks:
+        if len(block) >= 2:
+            if re.match(r'\s*\|?\s*-+\s*\|', block[1]):
+                block.pop(1)
+            headers = [col.strip() for col in block[0].split('|') if col.strip()]
+            data_rows = []
+            for row in block[1:]:
+                cols = [col.strip() for col in row.split('|') if col.strip()]
+                if len(cols) == len(headers):
+                    data_rows.append(cols)
+            if data_rows:
+                tables.append(pd.DataFrame(data_rows, columns=headers).to_dict('records'))
+    return tables
+
+
+def make_answer(tables, rows, seed=7):
+    """A long answer of TONIC media-plan tables with prose, empty cells and summary rows"""
+    rng = random.Random(seed)
+    parts = []
+    for index in range(tables):
+        parts.append(f"### Option {index + 1}\nHere is the proposed split for this option.\n")
+        parts.append("| Medium | Clicks | CPC | Impressions | CTR | Share | Budget |")
+        parts.append("|---|---|---|---|---|---|---|")
+        parts.append("| Channel | Exp. Link Clicks | Exp. Tonic CPC | Exp. Impressions | Exp.CTR | Budget % | Budget |")
+        for _ in range(rows):
+            views = "" if rng.random() < 0.15 else f"{rng.randint(100_000, 9_000_000):,}"
+            parts.append(
+                f"| {rng.choice(PLATFORMS)} | {rng.randint(1000, 30000):,} | AED{rng.uniform(0.5, 3):.2f} | "
+                f"{views} | {rng.uniform(0.1, 2):.2f} | {rng.randint(5, 40)}% | {rng.randint(1000, 50000)} |"
+            )
+        parts.append("| **Net Total** | | | | | 100% | 250000 |")
+        parts.append("\nThese figures are estimates based on current benchmarks.\n")
+    return "\n".join(parts)
+
+
+def timed(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def streamed(text, chunk):
+    parser = TableStreamParser()
+    tables = []
+    for index in range(0, len(text), chunk):
+        tables += parser.feed(text[index:index + chunk])
+    return tables + parser.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tables", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=50)
+    parser.add_argument("--chunk", type=int, default=4, help="characters per streamed token")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    text = make_answer(args.tables, args.rows)
+    expected_rows = args.tables * (args.rows + 1)
+    print(f"{args.tables} tables x {args.rows} rows, {len(text) / 1024:.0f} KB, {expected_rows} data rows\n")
+    print(f"{'extractor':<34}{'time':>10}{'tables':>8}{'rows kept':>11}")
+
+    cases = [
+        ("legacy newline split", lambda: legacy_extract_tables(text), lambda r: sum(len(t) for t in r)),
+        ("table_parser records", lambda: [t.records() for t in parse_tables(text)],
+         lambda r: sum(len(t) - 1 for t in r)),  # minus the subheader row
+        (f"table_parser streamed ({args.chunk}-char)", lambda: [t.records() for t in streamed(text, args.chunk)],
+         lambda r: sum(len(t) - 1 for t in r)),
+        ("table_parser typed DataFrames", lambda: [t.to_dataframe() for t in parse_tables(text)],
+         lambda r: sum(len(t) for t in r)),
+    ]
+    for name, func, count_rows in cases:
+        elapsed, result = timed(func, args.repeat)
+        print(f"{name:<34}{elapsed * 1000:>8.1f}ms{len(result):>8}{count_rows(result):>11}")
+
+    tables = parse_tables(text)
+    print(f"\n{'encoding':<34}{'encode':>10}{'bytes':>10}{'JSON parse':>12}")
+    for table_format in TABLE_FORMATS:
+        encode_time, encoded = timed(lambda: json.dumps(encode_tables(tables, table_format)), args.repeat)
+        parse_time, _ = timed(lambda: json.loads(encoded), args.repeat)
+        print(f"{table_format:<34}{encode_time * 1000:>8.1f}ms{len(encoded):>10,}{parse_time * 1000:>10.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Rule-based chart generation for tables extracted from chat answers.
+
+When an answer already contains a table, the chart can be derived from it
+directly instead of asking an LLM to write matplotlib code: numeric columns
+are inferred by parsing cells such as "AED1.29", "11,630", "0.40" or "12%",
+a category column supplies the labels, and the chart type is chosen from the
+column's meaning (budget share -> pie, volumes -> bar, rate KPIs -> line).
+
+The output is plain matplotlib code, so it renders in the plot sandbox like
+LLM-written code and the React ChartRenderer can still parse it, or a
+Vega-Lite spec that the browser renders without any server-side rasterizing.
+"""
+
+import logging
+import re
+
+from table_parser import MISSING_VALUES, NUMERIC_SHARE, parse_number
+
+logger = logging.getLogger("TONIC AI")
+
+MAX_PANELS = 4
+MAX_PIE_SLICES = 8
+COLORS = ["#FF6B35", "#004E89", "#1A936F", "#F7B801", "#6A4C93", "#C5283D", "#3BCEAC", "#8D99AE"]
+
+COST_KEYWORDS = ["cost", "budget", "spend", "investment", "net total"]
+RATE_KEYWORDS = ["cpc", "cpm", "cpv", "ctr", "cpl", "cpa", "roas", "rate", "%", "ratio", "frequency"]
+TIME_PATTERN = re.compile(
+    r"^(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?(\s+\d{2,4})?$|"
+    r"^(q[1-4](\s+\d{2,4})?|week\s*\d+|w\d+|month\s*\d+|(19|20)\d{2}(-\d{2})?)$",
+    re.IGNORECASE,
+)
+TIME_HEADER_PATTERN = re.compile(r"\b(date|day|week|month|quarter|year|period)\b", re.IGNORECASE)
+SUMMARY_PATTERN = re.compile(r"\btotal\b|\bsum\b|\baverage\b|\bavg\b", re.IGNORECASE)
+
+
+def _matches(text, keywords):
+    text = text.lower()
+    return any(keyword in text for keyword in keywords)
+
+
+def _is_time_column(header, cells):
+    """
+    Month, quarter, week or year labels ("Jan 2024", "Q1", "2025-03"). Checked
+    before numeric parsing, since "2024" parses as a number; bare years only
+    count under a time-like header, as they could also be a metric.
+    """
+    if not all(TIME_PATTERN.match(cell) for cell in cells):
+        return False
+    return bool(TIME_HEADER_PATTERN.search(header)) or any(parse_number(cell) is None for cell in cells)
+
+
+def analyze_table(records):
+    """
+    Split a table (list of row dicts) into a category column and numeric columns.
+
+    Returns a dict with "category", "labels", "columns" ({header: [values]}),
+    "descriptions" ({header: subheader text}) and "percent" (headers of "12%"
+    columns, whose values are fractions), or None if the table is not chartable.
+    """
+    if not records or not isinstance(records[0], dict):
+        return None
+    headers = list(records[0].keys())
+    rows = [[str(row.get(h, "") or "").strip() for h in headers] for row in records]
+
+    # TONIC tables carry a subheader row ("Channel | Exp. Link Clicks | ...") with no numbers
+    descriptions = {}
+    if rows and not any(parse_number(cell) is not None for cell in rows[0][1:]):
+        descriptions = dict(zip(headers, rows[0]))
+        rows = rows[1:]
+
+    # Drop spacer and summary rows (Net Total, Total Clicks, ...)
+    rows = [
+        row for row in rows
+        if any(row) and not any(SUMMARY_PATTERN.search(cell) for cell in row)
+    ]
+    if len(rows) < 2:
+        return None
+
+    numeric = {}
+    percent = set()
+    category = None
+    for index, header in enumerate(headers):
+        cells = [row[index] for row in rows if row[index].lower() not in MISSING_VALUES]
+        if not cells:
+            continue
+        if category is None and _is_time_column(header, cells):
+            category = header
+            continue
+        values = [parse_number(cell) for cell in cells]
+        parsed = sum(v is not None for v in values)
+        if parsed / len(cells) >= NUMERIC_SHARE:
+            numeric[header] = [parse_number(row[index]) for row in rows]
+            if sum(cell.endswith("%") for cell in cells) > len(cells) / 2:
+                percent.add(header)
+        elif category is None and parsed == 0:
+            category = header
+
+    if category is None or not numeric:
+        return None
+
+    category_index = headers.index(category)
+    labels = [row[category_index] for row in rows]
+    keep = [i for i, label in enumerate(labels) if label]
+    return {
+        "category": category,
+        "labels": [labels[i] for i in keep],
+        "columns": {h: [values[i] for i in keep] for h, values in numeric.items()},
+        "descriptions": descriptions,
+        "percent": percent,
+    }
+
+
+def _describe(header, descriptions):
+    return f"{header} {descriptions.get(header, '')}".strip()
+
+
+def choose_charts(analysis):
+    """Return a list of (kind, metric) panels for an analyzed table"""
+    labels = analysis["labels"]
+    columns = analysis["columns"]
+    descriptions = analysis["descriptions"]
+    is_time_series = sum(bool(TIME_PATTERN.match(label)) for label in labels) >= len(labels) / 2
+
+    costs, rates, volumes = [], [], []
+    for header, values in columns.items():
+        if sum(v is not None for v in values) < 2:
+            continue
+        text = _describe(header, descriptions)
+        if _matches(text, COST_KEYWORDS):
+            costs.append(header)
+        elif _matches(text, RATE_KEYWORDS):
+            rates.append(header)
+        else:
+            volumes.append(header)
+
+    panels = []
+    if is_time_series:
+        # Trends over time: everything is a line
+        for header in (costs + volumes)[:2] + rates[:1]:
+            panels.append(("line", header))
+        return panels[:MAX_PANELS]
+
+    for header in costs[:1]:
+        values = [v for v in columns[header] if v is not None]
+        can_pie = 2 <= len(values) <= MAX_PIE_SLICES and all(v > 0 for v in values)
+        panels.append(("pie" if can_pie else "bar", header))
+    for header in volumes[:2]:
+        panels.append(("bar", header))
+    for header in rates[:1]:
+        panels.append(("line", header))
+    if not panels and costs:
+        panels.append(("bar", costs[0]))
+    return panels[:MAX_PANELS]
+
+
+def _series(labels, values):
+    pairs = [(label, round(value, 6)) for label, value in zip(labels, values) if value is not None]
+    return [p[0] for p in pairs], [p[1] for p in pairs]
+
+
+def plan_charts(tables):
+    """Return (analysis, panels) for the first chartable table, or (None, None)"""
+    for records in tables or []:
+        analysis = analyze_table(records)
+        if not analysis:
+            continue
+        panels = choose_charts(analysis)
+        if panels:
+            return analysis, panels
+    return None, None
+
+
+def _is_long(labels):
+    return len(labels) > 6 or max(len(label) for label in labels) > 14
+
+
+def build_chart_code(tables):
+    """
+    Build matplotlib code for the first chartable table, or return None so the
+    caller can fall back to LLM-generated code.
+    """
+    analysis, panels = plan_charts(tables)
+    if not analysis:
+        return None
+
+    category = analysis["category"]
+    cols = 1 if len(panels) == 1 else 2
+    rows = (len(panels) + cols - 1) // cols
+    lines = ["import matplotlib.pyplot as plt"]
+    if any(kind != "pie" and metric in analysis["percent"] for kind, metric in panels):
+        lines.append("from matplotlib.ticker import PercentFormatter")
+    lines += [
+        "",
+        f"colors = {COLORS!r}",
+        f"plt.figure(figsize=({7 * cols}, {5 * rows}))",
+    ]
+    for position, (kind, metric) in enumerate(panels, start=1):
+        x, y = _series(analysis["labels"], analysis["columns"][metric])
+        long_labels = kind == "bar" and _is_long(x)
+        lines += [
+            "",
+            f"x = {x!r}",
+            f"y = {y!r}",
+            f"plt.subplot({rows}, {cols}, {position})",
+        ]
+        if kind == "pie":
+            lines += [
+                "plt.pie(y, labels=x, autopct='%1.1f%%', startangle=90, colors=colors[:len(x)])",
+                f"plt.title({f'{metric} share by {category}'!r})",
+                "plt.axis('equal')",
+            ]
+        elif kind == "bar" and long_labels:
+            lines += [
+                "plt.barh(x, y, color=colors[:len(x)])",
+                "plt.gca().invert_yaxis()",
+                f"plt.xlabel({metric!r})",
+                f"plt.title({f'{metric} by {category}'!r})",
+            ]
+            if metric in analysis["percent"]:
+                lines.append("plt.gca().xaxis.set_major_formatter(PercentFormatter(1.0))")
+        elif kind == "bar":
+            lines += [
+                "plt.bar(x, y, color=colors[:len(x)])",
+                f"plt.ylabel({metric!r})",
+                f"plt.title({f'{metric} by {category}'!r})",
+                "plt.xticks(rotation=30, ha='right')",
+            ]
+        else:
+            lines += [
+                "plt.plot(x, y, marker='o', linewidth=2, color=colors[1])",
+                f"plt.ylabel({metric!r})",
+                f"plt.title({f'{metric} by {category}'!r})",
+                "plt.xticks(rotation=30, ha='right')",
+                "plt.grid(alpha=0.3)",
+            ]
+        if kind != "pie" and not long_labels and metric in analysis["percent"]:
+            lines.append("plt.gca().yaxis.set_major_formatter(PercentFormatter(1.0))")
+    lines += ["", "plt.tight_layout()"]
+    logger.info(f"📊 Built {', '.join(kind for kind, _ in panels)} chart from table without LLM")
+    return "\n".join(lines) + "\n"
+
+
+def build_chart_spec(tables):
+    """
+    Build a compact Vega-Lite spec for the first chartable table, for rendering
+    in the browser. Returns None if no table can be charted.
+    """
+    analysis, panels = plan_charts(tables)
+    if not analysis:
+        return None
+
+    import altair as alt
+
+    category = analysis["category"]
+    charts = []
+    for position, (kind, metric) in enumerate(panels):
+        x, y = _series(analysis["labels"], analysis["columns"][metric])
+        # Generic field names: headers like "Exp.CTR" would be read as nested fields
+        data = alt.Data(values=[{"label": label, "value": value} for label, value in zip(x, y)])
+        label = alt.X("label:N", sort=None, title=category)
+        axis = alt.Axis(format="%") if metric in analysis["percent"] else alt.Axis()
+        value = alt.Y("value:Q", title=metric, axis=axis)
+        number_format = ".2%" if metric in analysis["percent"] else ","
+        tooltip = [alt.Tooltip("label:N", title=category), alt.Tooltip("value:Q", title=metric, format=number_format)]
+        if kind == "pie":
+            chart = alt.Chart(data).mark_arc().encode(
+                theta=alt.Theta("value:Q"),
+                color=alt.Color("label:N", sort=None, title=category, scale=alt.Scale(range=COLORS)),
+                tooltip=tooltip,
+            )
+            title = f"{metric} share by {category}"
+        elif kind == "bar" and _is_long(x):
+            chart = alt.Chart(data).mark_bar(color=COLORS[position % len(COLORS)]).encode(
+                y=alt.Y("label:N", sort=None, title=category),
+                x=alt.X("value:Q", title=metric, axis=axis),
+                tooltip=tooltip,
+            )
+            title = f"{metric} by {category}"
+        elif kind == "bar":
+            chart = alt.Chart(data).mark_bar(color=COLORS[position % len(COLORS)]).encode(
+                x=label, y=value, tooltip=tooltip
+            )
+            title = f"{metric} by {category}"
+        else:
+            chart = alt.Chart(data).mark_line(point=True, color=COLORS[1]).encode(
+                x=label, y=value, tooltip=tooltip
+            )
+            title = f"{metric} by {category}"
+        charts.append(chart.properties(title=title, width=320, height=220))
+
+    combined = charts[0] if len(charts) == 1 else alt.concat(*charts, columns=2)
+    spec = combined.to_dict()
+    logger.info(f"📊 Built {', '.join(kind for kind, _ in panels)} chart spec from table")
+    return spec
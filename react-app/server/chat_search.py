@@ -0,0 +1,195 @@
+"""
+Full-text search over chat messages.
+
+Postgres gets a stored tsvector column generated from question (weight A) and
+answer (weight B) with a GIN index; SQLite gets an FTS5 table over
+chat_messages, with each message's user as a token, kept in sync by triggers. Either way a search is one query that
+matches through the index, joins the session for its name, ranks (ts_rank_cd
+or bm25) and cuts a highlighted snippet out of the answer for the returned
+page only. Databases with neither (or an FTS-less SQLite build) fall back to
+LIKE, which scans the user's messages.
+"""
+
+import logging
+import re
+
+from sqlalchemy import DateTime, Float, text
+
+logger = logging.getLogger("TONIC AI")
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+# Words of answer text around the matches in a snippet
+SNIPPET_WORDS = 24
+HIGHLIGHT_START, HIGHLIGHT_STOP = "<mark>", "</mark>"
+
+_POSTGRES_SETUP = [
+    """
+    ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(question, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(answer, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_chat_messages_search ON chat_messages USING GIN (search_vector)",
+]
+
+# External-content FTS5 table: the text lives once, in chat_messages. The owning
+# user is indexed as a token ("u42") so a search intersects the user's posting
+# list with the query's instead of ranking every user's matches
+_SQLITE_SETUP = [
+    """
+    CREATE VIEW IF NOT EXISTS chat_messages_search AS
+    SELECT m.id, m.question, m.answer, 'u' || s.user_id AS owner
+    FROM chat_messages m JOIN chat_sessions s ON s.id = m.session_id
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(
+        question, answer, owner, content='chat_messages_search', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(rowid, question, answer, owner)
+        VALUES (new.id, new.question, new.answer, (SELECT 'u' || user_id FROM chat_sessions WHERE id = new.session_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(chat_messages_fts, rowid, question, answer, owner)
+        VALUES ('delete', old.id, old.question, old.answer,
+                (SELECT 'u' || user_id FROM chat_sessions WHERE id = old.session_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update AFTER UPDATE OF question, answer ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(chat_messages_fts, rowid, question, answer, owner)
+        VALUES ('delete', old.id, old.question, old.answer,
+                (SELECT 'u' || user_id FROM chat_sessions WHERE id = old.session_id));
+        INSERT INTO chat_messages_fts(rowid, question, answer, owner)
+        VALUES (new.id, new.question, new.answer, (SELECT 'u' || user_id FROM chat_sessions WHERE id = new.session_id));
+    END
+    """,
+]
+
+_HEADLINE_OPTIONS = (
+    f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxWords={SNIPPET_WORDS}, "
+    f'MinWords={SNIPPET_WORDS // 3}, MaxFragments=2, FragmentDelimiter=" … "'
+)
+
+_POSTGRES_QUERY = f"""
+    SELECT m.id AS message_id, m.session_id, s.session_name, m.question, m.timestamp,
+           ts_headline('english', m.answer, q, '{_HEADLINE_OPTIONS}') AS snippet,
+           ts_rank_cd(m.search_vector, q) AS score
+    FROM chat_messages m
+    JOIN chat_sessions s ON s.id = m.session_id
+    CROSS JOIN plainto_tsquery('english', :query) AS q
+    WHERE s.user_id = :user_id AND m.search_vector @@ q
+    ORDER BY score DESC, m.id DESC
+    LIMIT :limit OFFSET :offset
+"""
+
+_SQLITE_QUERY = f"""
+    SELECT m.id AS message_id, m.session_id, s.session_name, m.question, m.timestamp,
+           snippet(chat_messages_fts, 1, '{HIGHLIGHT_START}', '{HIGHLIGHT_STOP}', ' … ', {SNIPPET_WORDS}) AS snippet,
+           -bm25(chat_messages_fts, 2.0, 1.0, 0.0) AS score
+    FROM chat_messages_fts
+    JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+    JOIN chat_sessions s ON s.id = m.session_id
+    WHERE chat_messages_fts MATCH :query AND s.user_id = :user_id
+    ORDER BY bm25(chat_messages_fts, 2.0, 1.0, 0.0), m.id DESC
+    LIMIT :limit OFFSET :offset
+"""
+
+_LIKE_QUERY = """
+    SELECT m.id AS message_id, m.session_id, s.session_name, m.question, m.timestamp,
+           m.answer AS snippet, 0.0 AS score
+    FROM chat_messages m
+    JOIN chat_sessions s ON s.id = m.session_id
+    WHERE s.user_id = :user_id AND (lower(m.question) LIKE :query ESCAPE '\\' OR lower(m.answer) LIKE :query ESCAPE '\\')
+    ORDER BY m.timestamp DESC, m.id DESC
+    LIMIT :limit OFFSET :offset
+"""
+
+_QUERIES = {"postgres": _POSTGRES_QUERY, "fts5": _SQLITE_QUERY, "like": _LIKE_QUERY}
+_WORD_RE = re.compile(r"\w+")
+
+_backend = "like"
+
+
+def setup_search_index(engine):
+    """Create the full-text index if it is missing; returns the backend searches will use"""
+    global _backend
+    _backend = "like"
+    try:
+        if engine.dialect.name == "postgresql":
+            with engine.begin() as connection:
+                for statement in _POSTGRES_SETUP:
+                    connection.execute(text(statement))
+            _backend = "postgres"
+        elif engine.dialect.name == "sqlite":
+            with engine.begin() as connection:
+                exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'chat_messages_fts'")).first()
+                for statement in _SQLITE_SETUP:
+                    connection.execute(text(statement))
+                if not exists:
+                    # Index the messages stored before the table existed
+                    connection.execute(text("INSERT INTO chat_messages_fts(chat_messages_fts) VALUES ('rebuild')"))
+            _backend = "fts5"
+    except Exception as e:
+        logger.warning(f"Full-text index unavailable, searching chat history with LIKE: {e}")
+    logger.info(f"🔎 Chat search backend: {_backend}")
+    return _backend
+
+
+def get_search_backend():
+    return _backend
+
+
+def _fts5_query(query, user_id):
+    """
+    The user's messages containing every word of the query; each word is quoted
+    so FTS5 syntax in user input is taken literally. None for a query without words.
+    """
+    words = _WORD_RE.findall(query)
+    if not words:
+        return None
+    return f'owner:"u{int(user_id)}" AND {{question answer}}:(' + " ".join(f'"{word}"' for word in words) + ")"
+
+
+def _like_snippet(answer, query, words=SNIPPET_WORDS):
+    """Window of the answer around the first case-insensitive match, highlighted"""
+    index = answer.lower().find(query.lower())
+    if index < 0:
+        return " ".join(answer.split()[:words])
+    end = index + len(query)
+    before = re.search(rf"(\S+\s+){{0,{words // 2}}}\S*$", answer[:index]).group()
+    after = re.match(rf"\S*(\s+\S+){{0,{words // 2}}}", answer[end:]).group()
+    return f"{before}{HIGHLIGHT_START}{answer[index:end]}{HIGHLIGHT_STOP}{after}".strip()
+
+
+def search_messages(connection, user_id, query, limit=SEARCH_PAGE_SIZE, offset=0, backend=None):
+    """
+    Rank a user's messages against a search query. `connection` is a SQLAlchemy
+    Session or Connection. Returns dicts with message_id, session_id,
+    session_name, question, timestamp, snippet (answer text with matches in
+    <mark>) and score (higher is better), best first.
+    """
+    backend = backend or _backend
+    query = query.strip()
+    if backend == "fts5":
+        params = {"query": _fts5_query(query, user_id)}
+        if params["query"] is None:
+            return []
+    elif backend == "postgres":
+        params = {"query": query}
+    else:
+        escaped = query.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params = {"query": f"%{escaped}%"}
+    statement = text(_QUERIES[backend]).columns(timestamp=DateTime, score=Float)
+    rows = connection.execute(statement, {**params, "user_id": user_id, "limit": limit, "offset": offset})
+    results = [dict(row) for row in rows.mappings()]
+    if backend == "like":
+        for row in results:
+            row["snippet"] = _like_snippet(row["snippet"], query)
+    return results
@@ -0,0 +1,207 @@
+"""
+Write-behind persistence of chat turns.
+
+Chat endpoints hand their finished turns to the ChatWriter instead of
+committing them inline. CHAT_PERSISTENCE picks the durability mode:
+
+    sync   (default) the turn is written before the response is sent, as before
+    async  the turn is queued in memory and a background thread writes queued
+           turns in one transaction with bulk INSERTs once CHAT_WRITE_BATCH_SIZE
+           turns are waiting or the oldest has waited CHAT_WRITE_INTERVAL seconds
+
+In async mode a crash loses at most the turns still queued: about
+CHAT_WRITE_INTERVAL seconds of chat, never more than CHAT_WRITE_MAX_PENDING
+turns (submitting to a full queue blocks until the writer catches up). The
+queue is flushed on shutdown. Every turn carries a Future that resolves to
+(message_id, table_ids) once written, or (None, []) if the write failed.
+
+Async turns get their message and table ids reserved up front from the
+database sequences (IdBlocks, CHAT_ID_BLOCK_SIZE ids per round trip), so a
+response can always name its message and tables; the rows appear when the
+batch is written.
+"""
+
+import atexit
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+logger = logging.getLogger("TONIC AI")
+
+SYNC, ASYNC = "sync", "async"
+CHAT_PERSISTENCE = os.getenv("CHAT_PERSISTENCE", SYNC).lower()
+CHAT_WRITE_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BATCH_SIZE", "100"))
+CHAT_WRITE_INTERVAL = float(os.getenv("CHAT_WRITE_INTERVAL", "0.5"))
+CHAT_WRITE_MAX_PENDING = int(os.getenv("CHAT_WRITE_MAX_PENDING", "5000"))
+CHAT_ID_BLOCK_SIZE = int(os.getenv("CHAT_ID_BLOCK_SIZE", "50"))
+
+
+@dataclass
+class ChatTurn:
+    username: str
+    session_name: str
+    question: str
+    answer: str
+    plot_code: str = None
+    table_rows: list = field(default_factory=list, repr=False)  # ChatTable column values
+    # Taken when the turn is answered, so history order does not depend on when it is written
+    timestamp: datetime.datetime = field(default_factory=datetime.datetime.utcnow)
+    # Reserved before the write in async mode; None to let the database assign them
+    message_id: int = None
+    table_ids: list = None
+    saved: Future = field(default_factory=Future, repr=False)
+
+    def ids(self):
+        """(message_id, table_ids): the written ids, else the reserved ones, else (None, [])"""
+        if self.saved.done():
+            return self.saved.result()
+        if self.message_id is not None:
+            return self.message_id, list(self.table_ids or [])
+        return None, []
+
+
+class IdBlocks:
+    """
+    Ids handed out from blocks reserved with fetch(count) -> [ids] (a database
+    sequence), so most reservations need no round trip. Ids of a block left
+    unused when the process exits are skipped, never reused.
+    """
+
+    def __init__(self, fetch, block_size=CHAT_ID_BLOCK_SIZE):
+        self.fetch = fetch
+        self.block_size = block_size
+        self._ids = deque()
+        self._lock = threading.Lock()
+
+    def take(self, count):
+        with self._lock:
+            if len(self._ids) < count:
+                self._ids.extend(self.fetch(max(self.block_size, count - len(self._ids))))
+            return [self._ids.popleft() for _ in range(count)]
+
+
+class ChatWriter:
+    def __init__(self, write_batch, mode=CHAT_PERSISTENCE, batch_size=CHAT_WRITE_BATCH_SIZE,
+                 interval=CHAT_WRITE_INTERVAL, max_pending=CHAT_WRITE_MAX_PENDING):
+        if mode not in (SYNC, ASYNC):
+            raise ValueError(f"CHAT_PERSISTENCE must be {SYNC} or {ASYNC}, not {mode!r}")
+        # write_batch(turns) -> [(message_id, table_ids)] per turn, (None, []) for failed ones
+        self.write_batch = write_batch
+        self.mode = mode
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._flushing = False
+        self._thread = None
+        self._last = None
+        self.batches = 0
+        self.turns = 0
+        self.failed = 0
+
+    def submit(self, turns):
+        """Persist turns (written together, in order); returns them with their `saved` futures"""
+        with self._condition:
+            inline = self.mode == SYNC or self._closed
+        if inline:
+            return self.write_now(turns)
+        with self._condition:
+            while len(self._pending) + len(turns) > self.max_pending and self._pending:
+                self._condition.wait()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+            self._pending.extend((time.monotonic(), turn) for turn in turns)
+            self._last = turns[-1] if turns else self._last
+            self._condition.notify_all()
+        return turns
+
+    def write_now(self, turns):
+        """Write turns in the calling thread, whatever the mode"""
+        self._write(turns)
+        return turns
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._ready():
+                    timeout = None
+                    if self._pending:
+                        timeout = self._pending[0][0] + self.interval - time.monotonic()
+                    self._condition.wait(timeout)
+                if not self._pending:
+                    self._flushing = False
+                    if self._closed:
+                        return
+                    continue
+                batch = [self._pending.popleft()[1] for _ in range(min(self.batch_size, len(self._pending)))]
+                self._condition.notify_all()
+            self._write(batch)
+
+    def _ready(self):
+        if self._closed or self._flushing or len(self._pending) >= self.batch_size:
+            return True
+        return bool(self._pending) and time.monotonic() - self._pending[0][0] >= self.interval
+
+    def _write(self, turns):
+        try:
+            results = self.write_batch(turns)
+        except Exception as e:
+            logger.error(f"❌ Failed to write {len(turns)} chat turn(s): {e}")
+            results = [(None, [])] * len(turns)
+        failed = sum(1 for message_id, _ in results if message_id is None)
+        for turn, result in zip(turns, results):
+            turn.saved.set_result(result)
+        with self._condition:
+            self.batches += 1
+            self.turns += len(turns)
+            self.failed += failed
+
+    def flush(self, timeout=None):
+        """Block until every turn submitted so far is written; False on timeout"""
+        with self._condition:
+            last = self._last
+            if last is None:
+                return True
+            self._flushing = True
+            self._condition.notify_all()
+        try:
+            last.saved.result(timeout)
+            return True
+        except TimeoutError:
+            return False
+
+    def close(self, timeout=30):
+        """Write everything still queued and stop the writer thread"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            pending = len(self._pending)
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                logger.error(f"❌ Chat writer still busy after {timeout}s; queued turns may be lost")
+            elif pending:
+                logger.info(f"💾 Flushed {pending} queued chat turn(s) on shutdown")
+
+    def stats(self):
+        with self._condition:
+            return {
+                "mode": self.mode,
+                "pending": len(self._pending),
+                "batches": self.batches,
+                "turns": self.turns,
+                "failed": self.failed,
+            }
+
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Offline evaluation of the chat intent classifier.
+
+Scores the classifier on the held-out labelled set (intent_eval.jsonl) and
+compares its plot decision with the old substring heuristic, which fired on
+"graph/plot/chart/visual", on "data/metrics/marketing/campaign/media plan" or
+whenever the answer contained a table.
+
+    python eval_intent.py
+    python eval_intent.py --eval-set my_questions.jsonl
+
+Each line of the evaluation set is {"question", "intent", "has_table"}; a
+plot is wanted for visualization questions and for media plans answered
+with a table.
+"""
+
+import argparse
+import json
+import os
+import time
+
+from intent import INTENTS, classify_intent, wants_plot
+
+EVAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_eval.jsonl")
+
+LEGACY_QUESTION_KEYWORDS = ["graph", "plot", "chart", "visual"]
+LEGACY_BUSINESS_KEYWORDS = ["media plan", "marketing", "campaign", "metrics", "data"]
+
+
+def legacy_should_generate_plot(question, tables):
+    """The substring heuristic the classifier replaced"""
+    question_lower = question.lower()
+    return (
+        any(word in question_lower for word in LEGACY_QUESTION_KEYWORDS) or
+        bool(tables) or
+        any(word in question_lower for word in LEGACY_BUSINESS_KEYWORDS)
+    )
+
+
+def precision_recall(predicted, actual):
+    true_positives = sum(p and a for p, a in zip(predicted, actual))
+    precision = true_positives / max(sum(predicted), 1)
+    recall = true_positives / max(sum(actual), 1)
+    return precision, recall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--eval-set", default=EVAL_PATH)
+    args = parser.parse_args()
+
+    with open(args.eval_set, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    classify_intent("warm up")  # train outside the timed loop
+    start = time.perf_counter()
+    intents = [classify_intent(record["question"]) for record in records]
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{len(records)} questions, {elapsed_ms / len(records):.3f} ms per classification\n")
+    print(f"{'intent':<15}{'precision':>10}{'recall':>10}{'support':>10}")
+    for label in INTENTS:
+        predicted = [intent.label == label for intent in intents]
+        actual = [record["intent"] == label for record in records]
+        precision, recall = precision_recall(predicted, actual)
+        print(f"{label:<15}{precision:>10.2f}{recall:>10.2f}{sum(actual):>10}")
+    accuracy = sum(intent.label == record["intent"] for intent, record in zip(intents, records)) / len(records)
+    print(f"{'accuracy':<15}{accuracy:>10.2f}\n")
+
+    tables = [[{}] if record["has_table"] else [] for record in records]
+    actual = [
+        record["intent"] == "visualization" or (record["intent"] == "media_plan" and record["has_table"])
+        for record in records
+    ]
+    print(f"{'plot decision':<15}{'precision':>10}{'recall':>10}{'plots run':>10}")
+    for name, predicted in (
+        ("heuristic", [legacy_should_generate_plot(r["question"], t) for r, t in zip(records, tables)]),
+        ("classifier", [wants_plot(intent, t) for intent, t in zip(intents, tables)]),
+    ):
+        precision, recall = precision_recall(predicted, actual)
+        print(f"{name:<15}{precision:>10.2f}{recall:>10.2f}{sum(predicted):>10}")
+    print(f"{'(wanted)':<15}{'':>20}{sum(actual):>10}")
+
+    misses = [(r, i) for r, i in zip(records, intents) if i.label != r["intent"]]
+    if misses:
+        print("\nMisclassified:")
+        for record, intent in misses:
+            print(f"  {record['question']!r}: {intent.label} ({intent.confidence:.2f}), expected {record['intent']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -88,10 +88,28 @@ def create_tables():
                 session_id INTEGER NOT NULL REFERENCES chat_sessions(id) ON DELETE CASCADE,
                 question TEXT NOT NULL,
                 answer TEXT NOT NULL,
+                plot_code TEXT,
                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
         
+        # Columns added after the first release
+        cursor.execute("ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS plot_code TEXT")
+        
+        # Create chat_tables table (answer tables as typed Parquet, for downloads)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chat_tables (
+                id SERIAL PRIMARY KEY,
+                message_id INTEGER NOT NULL REFERENCES chat_messages(id) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                row_count INTEGER NOT NULL,
+                column_count INTEGER NOT NULL,
+                content_hash VARCHAR(64) NOT NULL,
+                data BYTEA NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
         # Create knowledge_bases table
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS knowledge_bases (
@@ -105,8 +123,21 @@ def create_tables():
         
         # Create indexes for better performance
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_id ON chat_sessions(user_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_created ON chat_sessions(user_id, created_at, id)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_session_id ON chat_messages(session_id)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_timestamp ON chat_messages(timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_session_timestamp ON chat_messages(session_id, timestamp, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_tables_message_id ON chat_tables(message_id)")
+        
+        # Full-text search of questions and answers (see chat_search.py)
+        cursor.execute("""
+            ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', coalesce(question, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(answer, '')), 'B')
+            ) STORED
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_search ON chat_messages USING GIN (search_vector)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_knowledge_bases_user_id ON knowledge_bases(user_id)")
         
         conn.commit()
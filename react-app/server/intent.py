@@ -0,0 +1,127 @@
+"""
+Local intent classifier for chat questions.
+
+Decides whether a question asks for a visualization, a table export, a media
+plan or plain text, so the expensive stages (plot generation, later table
+exports and media plan post-processing) only run when the user wants them.
+"what data do you have?" mentions "data" but is a plain text question.
+
+The classifier is a multinomial naive Bayes model over words and bigrams,
+trained at import time on the bundled labelled set (intent_train.jsonl) in a
+few milliseconds, with keyword rules added as strong evidence. It runs
+offline and classifies a question in well under a millisecond.
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+logger = logging.getLogger("TONIC AI")
+
+INTENTS = ("visualization", "table", "media_plan", "text")
+TRAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_train.jsonl")
+
+# Log-probability bonus for each keyword rule that fires
+KEYWORD_WEIGHT = 4.0
+# Below this confidence a question is treated as plain text, keeping expensive stages off
+MIN_CONFIDENCE = 0.5
+KEYWORD_RULES = {
+    "visualization": re.compile(
+        r"\b(plot|chart|graph|visual\w*|pie|histogram|dashboard|diagram|infographic|trend ?line)s?\b"
+    ),
+    "table": re.compile(r"\b(table|tabular|csv|excel|xlsx|spreadsheet|export|download)s?\b"),
+    "media_plan": re.compile(r"\bmedia ?plans?\b|\bbudget (split|allocation)\b|\ballocate\b"),
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    words = _TOKEN_RE.findall(text.lower())
+    return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+
+@dataclass
+class Intent:
+    label: str
+    confidence: float
+    # Which intents' keyword rules fired, e.g. ["visualization"]
+    keywords: list
+
+    def to_dict(self):
+        return {"label": self.label, "confidence": round(self.confidence, 3), "keywords": self.keywords}
+
+
+class IntentClassifier:
+    def __init__(self, examples, alpha=1.0):
+        """Train on (question, intent) pairs with Laplace smoothing `alpha`"""
+        self.alpha = alpha
+        counts = defaultdict(Counter)
+        docs = Counter()
+        for question, label in examples:
+            docs[label] += 1
+            counts[label].update(tokenize(question))
+        self.vocabulary = set().union(*counts.values()) if counts else set()
+        self.priors = {label: math.log(docs[label] / sum(docs.values())) for label in docs}
+        self.totals = {label: sum(counts[label].values()) for label in docs}
+        self.counts = counts
+
+    def _log_likelihood(self, label, tokens):
+        denominator = self.totals[label] + self.alpha * (len(self.vocabulary) + 1)
+        counts = self.counts[label]
+        return sum(math.log((counts[token] + self.alpha) / denominator) for token in tokens)
+
+    def classify(self, question):
+        tokens = [token for token in tokenize(question or "") if token in self.vocabulary]
+        text = (question or "").lower()
+        keywords = [label for label, pattern in KEYWORD_RULES.items() if pattern.search(text)]
+        if not tokens and not keywords:
+            return Intent("text", 1.0, [])
+        scores = {
+            label: prior + self._log_likelihood(label, tokens) + (KEYWORD_WEIGHT if label in keywords else 0.0)
+            for label, prior in self.priors.items()
+        }
+        best = max(scores, key=scores.get)
+        # Softmax over the class scores for a confidence
+        top = scores[best]
+        confidence = 1.0 / sum(math.exp(score - top) for score in scores.values())
+        if confidence < MIN_CONFIDENCE:
+            return Intent("text", confidence, keywords)
+        return Intent(best, confidence, keywords)
+
+
+def load_examples(path):
+    with open(path, encoding="utf-8") as f:
+        return [
+            (record["question"], record["intent"])
+            for record in map(json.loads, filter(str.strip, f))
+        ]
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier():
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            examples = load_examples(TRAIN_PATH)
+            _classifier = IntentClassifier(examples)
+            logger.info(f"🧭 Intent classifier trained on {len(examples)} labelled questions")
+        return _classifier
+
+
+def classify_intent(question):
+    """Return the Intent of a chat question"""
+    return get_classifier().classify(question)
+
+
+def wants_plot(intent, tables):
+    """A chart is worth generating for visualization requests, or for media plans that came back as tables"""
+    return intent.label == "visualization" or (intent.label == "media_plan" and bool(tables))
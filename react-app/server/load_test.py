@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Load test for the TONIC AI chat endpoint.
+
+Compares how many concurrent chat users the sync (Flask) and async (ASGI)
+servers can hold while every LLM call waits on a slow provider. The fake
+provider speaks the Perplexity/OpenAI chat completions and Gemini
+generateContent formats, so no real API keys or quota are needed.
+
+1. Start the fake provider:
+       python load_test.py fake-provider --port 8900 --delay 10
+
+2. Start the server under test against it, e.g.:
+       export PERPLEXITY_API_KEY=fake OPENAI_API_KEY=fake GEMINI_API_KEY=fake
+       export PERPLEXITY_API_URL=http://127.0.0.1:8900/chat/completions
+       export OPENAI_API_URL=http://127.0.0.1:8900/chat/completions
+       export GEMINI_API_URL=http://127.0.0.1:8900/models
+       gunicorn -w 1 --threads 32 -b 0.0.0.0:5000 app:app      # sync
+       uvicorn asgi:application --port 5001                    # async
+
+3. Run the load test against each:
+       python load_test.py run --url http://localhost:5000 --users 16,32,64,128
+       python load_test.py run --url http://localhost:5001 --users 16,32,64,128
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+import httpx
+
+QUESTION = "Hello, who are you?"  # avoids the plot trigger keywords
+
+
+def fake_provider_app(delay):
+    """Build an ASGI app that answers like the real providers after `delay` seconds"""
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    async def chat_completions(request):
+        await asyncio.sleep(delay)
+        return JSONResponse({
+            "choices": [{"message": {"role": "assistant", "content": "This is a fake answer."}}],
+            "search_results": [{"title": "Fake source", "url": "http://example.com"}]
+        })
+
+    async def generate_content(request):
+        await asyncio.sleep(delay)
+        return JSONResponse({
+            "candidates": [{"content": {"parts": [{"text": "Fake extracted content."}]}}]
+        })
+
+    return Starlette(routes=[
+        Route('/chat/completions', chat_completions, methods=['POST']),
+        Route('/models/{model}:generateContent', generate_content, methods=['POST']),
+    ])
+
+
+def run_fake_provider(args):
+    import uvicorn
+    print(f"🧪 Fake provider on port {args.port} with {args.delay}s latency")
+    uvicorn.run(fake_provider_app(args.delay), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+async def login(client, url):
+    response = await client.post(f"{url}/api/login", json={"username": "admin@123", "password": "admin123"})
+    response.raise_for_status()
+    return response.json()["token"]
+
+
+async def one_user(client, url, token, deadline):
+    """Send one chat request and return its latency, or None if it failed"""
+    start = time.perf_counter()
+    try:
+        response = await client.post(
+            f"{url}/api/chat",
+            headers={"Authorization": f"Bearer {token}"},
+            json={"question": QUESTION, "session_name": "Load Test"},
+            timeout=deadline,
+        )
+        if response.status_code == 200 and response.json().get("success"):
+            return time.perf_counter() - start
+    except httpx.HTTPError:
+        pass
+    return None
+
+
+async def run_level(url, token, users, deadline):
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(limits=limits) as client:
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(one_user(client, url, token, deadline) for _ in range(users)))
+        elapsed = time.perf_counter() - start
+
+    ok = sorted(l for l in latencies if l is not None)
+    return {
+        "users": users,
+        "ok": len(ok),
+        "failed": users - len(ok),
+        "p50": statistics.median(ok) if ok else float("nan"),
+        "p95": ok[int(len(ok) * 0.95) - 1] if ok else float("nan"),
+        "throughput": len(ok) / elapsed if elapsed else 0.0,
+    }
+
+
+async def run_load_test(args):
+    async with httpx.AsyncClient() as client:
+        token = await login(client, args.url)
+
+    levels = [int(u) for u in args.users.split(",")]
+    print(f"🚀 Load testing {args.url} (deadline {args.deadline}s per request)")
+    print(f"{'users':>6} {'ok':>5} {'failed':>7} {'p50 (s)':>8} {'p95 (s)':>8} {'req/s':>7}")
+
+    capacity = 0
+    for users in levels:
+        result = await run_level(args.url, token, users, args.deadline)
+        print(f"{result['users']:>6} {result['ok']:>5} {result['failed']:>7} "
+              f"{result['p50']:>8.2f} {result['p95']:>8.2f} {result['throughput']:>7.2f}")
+        # A level "holds" if everyone was served within twice the best-case latency
+        if result["failed"] == 0 and result["p95"] <= 2 * args.provider_delay + 1:
+            capacity = users
+
+    print(f"\n📊 Concurrent-user capacity: {capacity}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    fake = sub.add_parser("fake-provider", help="serve a slow fake LLM provider")
+    fake.add_argument("--port", type=int, default=8900)
+    fake.add_argument("--delay", type=float, default=10.0)
+
+    run = sub.add_parser("run", help="run the load test against a server")
+    run.add_argument("--url", default="http://localhost:5000")
+    run.add_argument("--users", default="16,32,64,128")
+    run.add_argument("--deadline", type=float, default=120.0)
+    run.add_argument("--provider-delay", type=float, default=10.0,
+                     help="latency configured on the fake provider")
+
+    args = parser.parse_args()
+    if args.command == "fake-provider":
+        run_fake_provider(args)
+    else:
+        asyncio.run(run_load_test(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+"""
+Local arithmetic for TONIC media-plan tables.
+
+The LLM writes the plan (platforms, budgets, volumes); the arithmetic is done
+here rather than in its output tokens, where it is often wrong. A table is
+a media plan when it has a budget column, at least one volume column
+(clicks, impressions, views, leads), at least one rate column, and either
+the TONIC subheader row or a first column naming platforms or channels. Its
+rates are recomputed per row:
+
+    CPC = budget / clicks          CPM = budget / impressions * 1000
+    CPV = budget / views           CPL = budget / leads
+    CTR = clicks / impressions     Budget % = budget / total budget
+
+The totals (budgets and volumes summed, rates from the summed budgets and
+volumes) are then written into the summary rows. Two layouts are handled: the
+TONIC "label | value" block ("| | Net Total | AED80,000 |") and a row whose
+first cell is "Total". A plan with no summary rows gets a Net Total row.
+A cell is only rewritten when it is off by more than its displayed precision,
+and keeps its column's formatting (currency prefix, thousands separators,
+decimals, % sign).
+"""
+
+import logging
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+import numpy as np
+
+from metrics import MEDIA_PLAN_CELLS
+from table_parser import ParsedTable, parse_number, parse_tables
+
+logger = logging.getLogger("TONIC AI")
+
+# Checked in order against the header, then the subheader; rates before the volumes they contain
+ROLE_PATTERNS = [
+    ("share", re.compile(r"budget\s*%|%\s*(of\s+)?budget|\bshare\b|\bsplit\b", re.I)),
+    ("cpc", re.compile(r"\bcpc\b|cost\s+per\s+click", re.I)),
+    ("cpm", re.compile(r"\bcpm\b|cost\s+per\s+(mille|thousand)", re.I)),
+    ("cpv", re.compile(r"\bcpv\b|cost\s+per\s+view", re.I)),
+    ("cpl", re.compile(r"\bcpl\b|cost\s+per\s+lead", re.I)),
+    ("ctr", re.compile(r"\bctr\b|click[\s-]*through", re.I)),
+    ("budget", re.compile(r"budget|\bcost\b|\bspend\b|investment", re.I)),
+    ("clicks", re.compile(r"\bcli?cks?\b", re.I)),
+    ("impressions", re.compile(r"\bimpressions?\b|\bimps?\b", re.I)),
+    ("views", re.compile(r"\bviews?\b", re.I)),
+    ("leads", re.compile(r"\bleads?\b", re.I)),
+]
+VOLUMES = ("clicks", "impressions", "views", "leads")
+# rate: (volume it divides the budget by, multiplier)
+RATES = {"cpc": ("clicks", 1), "cpm": ("impressions", 1000), "cpv": ("views", 1), "cpl": ("leads", 1)}
+# Decimals for a column with no numbers to copy the style from
+DEFAULT_DECIMALS = {"cpc": 2, "cpm": 2, "cpv": 2, "cpl": 2, "ctr": 2}
+
+# First column of a media plan: where the budget goes
+_CHANNEL_RE = re.compile(r"platform|channel|medi(um|a)|network|placement|publisher", re.I)
+_SUMMARY_RE = re.compile(r"^\W*(net\s+|grand\s+)?total\b", re.I)
+_CELL_STYLE_RE = re.compile(r"^(?P<prefix>[^\d.]*?)(?P<int>\d[\d,]*)?(?:\.(?P<decimals>\d+))?(?P<suffix>\s*%)?$")
+
+
+@dataclass
+class CellStyle:
+    prefix: str = ""
+    suffix: str = ""
+    thousands: bool = True
+    decimals: int = 0
+
+    @property
+    def scale(self):
+        """Displayed units per parsed unit: parse_number reads "12%" as 0.12"""
+        return 100 if self.suffix.strip() == "%" else 1
+
+    def format(self, value):
+        value *= self.scale
+        number = f"{value:,.{self.decimals}f}" if self.thousands else f"{value:.{self.decimals}f}"
+        return f"{self.prefix}{number}{self.suffix}"
+
+
+def cell_style(cell):
+    """Formatting of one numeric cell, or None"""
+    cell = cell.strip()
+    match = _CELL_STYLE_RE.match(cell)
+    if not match or not (match.group("int") or match.group("decimals")) or parse_number(cell) is None:
+        return None
+    digits = (match.group("int") or "").replace(",", "")
+    return CellStyle(
+        prefix=match.group("prefix"),
+        suffix=match.group("suffix") or "",
+        # None: no evidence either way (fewer than 4 digits)
+        thousands="," in (match.group("int") or "") or (None if len(digits) < 4 else False),
+        decimals=len(match.group("decimals") or ""),
+    )
+
+
+def column_style(cells, role, currency=""):
+    """The most common formatting of a column's numeric cells, with per-role defaults"""
+    styles = [style for style in map(cell_style, cells) if style]
+    if not styles:
+        return CellStyle(prefix=currency if role in RATES else "", decimals=DEFAULT_DECIMALS.get(role, 0))
+    thousands = [style.thousands for style in styles if style.thousands is not None]
+    return CellStyle(
+        prefix=Counter(style.prefix for style in styles).most_common(1)[0][0],
+        suffix=Counter(style.suffix for style in styles).most_common(1)[0][0],
+        thousands=any(thousands) if thousands else True,
+        decimals=max(style.decimals for style in styles),
+    )
+
+
+def column_role(header, subheader=""):
+    for text in (header, subheader or ""):
+        for role, pattern in ROLE_PATTERNS:
+            if pattern.search(text):
+                return role
+    return None
+
+
+def _summary_role(label):
+    """Metric a "Total ..." label names; a bare "Net Total" is the budget"""
+    rest = _SUMMARY_RE.sub("", label).strip(" *:_")
+    return column_role(rest) if rest else "budget"
+
+
+def _differs(cell, value):
+    """True if the cell does not show `value` to its own displayed precision"""
+    current = parse_number(cell)
+    if current is None:
+        return True
+    style = cell_style(cell) or CellStyle(decimals=2)
+    return abs(current - value) * style.scale > 0.5 * 10 ** -style.decimals + 1e-9
+
+
+@dataclass
+class MediaPlanFix:
+    table: ParsedTable
+    corrected: int = 0
+    filled: int = 0
+    added_rows: int = 0
+
+    @property
+    def changed(self):
+        return bool(self.corrected or self.filled or self.added_rows)
+
+
+def _scale(existing, ratios):
+    """100 if a ratio column is written in percent units without a % sign (0.40 for 0.4%), else 1"""
+    mask = np.isfinite(existing) & np.isfinite(ratios) & (ratios > 0)
+    if not mask.any():
+        return 100
+    log_factor = np.median(np.log10(existing[mask] / ratios[mask]))
+    return 100 if log_factor > 1 else 1
+
+
+def fix_media_plan(table):
+    """Recompute a media-plan table's rates and totals; returns a MediaPlanFix, or None for other tables"""
+    width = len(table.headers)
+    subheaders = table.subheaders or [""] * width
+    roles = {}
+    for index, (header, subheader) in enumerate(zip(table.headers, subheaders)):
+        role = column_role(header, subheader)
+        if role and role not in roles and index > 0:
+            roles[role] = index
+    if "budget" not in roles or not any(volume in roles for volume in VOLUMES):
+        return None
+    # Other cost tables ("Item | Cost | Clicks") are left as the model wrote them
+    if not any(role in roles for role in (*RATES, "ctr", "share")):
+        return None
+    if not table.subheaders and not _CHANNEL_RE.search(table.headers[0] if table.headers else ""):
+        return None
+
+    rows = [list(row) for row in table.rows]
+    data, summaries = [], []
+    for index, row in enumerate(rows):
+        label = next((column for column, cell in enumerate(row) if _SUMMARY_RE.match(cell)), None)
+        if label is not None:
+            summaries.append((index, label))
+        elif any(row[1:]) and parse_number(row[roles["budget"]]) is not None:
+            data.append(index)
+    if not data:
+        return None
+
+    def values(role):
+        return np.array([parse_number(rows[i][roles[role]]) if role in roles else None for i in data], dtype=float)
+
+    fix = MediaPlanFix(table)
+    budget = values("budget")
+    volumes = {role: values(role) for role in VOLUMES if role in roles}
+    currency = column_style([rows[i][roles["budget"]] for i in data], "budget").prefix
+    for role in RATES:
+        if role in roles and not currency:
+            currency = column_style([rows[i][roles[role]] for i in data], role).prefix
+    styles = {role: column_style([rows[i][column] for i in data], role, currency) for role, column in roles.items()}
+
+    # Per-row rates, vectorised over the data rows
+    computed, totals = {}, {"budget": np.nansum(budget)}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for role, volume in volumes.items():
+            if np.isfinite(volume).any():
+                totals[role] = np.nansum(volume)
+        for role, (volume_role, multiplier) in RATES.items():
+            if role in roles and volume_role in volumes:
+                volume = volumes[volume_role]
+                computed[role] = np.where(volume > 0, budget / volume * multiplier, np.nan)
+                mask = np.isfinite(budget) & (volume > 0)
+                if mask.any():
+                    totals[role] = budget[mask].sum() / volume[mask].sum() * multiplier
+        if "ctr" in roles and "clicks" in volumes and "impressions" in volumes:
+            clicks, impressions = volumes["clicks"], volumes["impressions"]
+            ratios = np.where(impressions > 0, clicks / impressions, np.nan)
+            scale = _scale(values("ctr"), ratios)
+            computed["ctr"] = ratios * scale
+            mask = np.isfinite(clicks) & (impressions > 0)
+            if mask.any():
+                totals["ctr"] = clicks[mask].sum() / impressions[mask].sum() * scale
+        if "share" in roles and totals["budget"] > 0:
+            scale = _scale(values("share"), budget / totals["budget"])
+            computed["share"] = budget / totals["budget"] * scale
+            totals["share"] = 1.0 * scale
+
+    def write(row, column, value, style):
+        cell = rows[row][column]
+        if not np.isfinite(value) or (cell and not _differs(cell, value)):
+            return
+        if cell and parse_number(cell) is None and cell.strip().lower() not in ("", "-", "--"):
+            return  # "NA", "TBD": the model had a reason
+        rows[row][column] = style.format(value)
+        if cell:
+            fix.corrected += 1
+        else:
+            fix.filled += 1
+
+    for role, column_values in computed.items():
+        for position, row in enumerate(data):
+            write(row, roles[role], column_values[position], styles[role])
+
+    for row, label in summaries:
+        if label == 0:
+            # A "Total" row: each metric column gets its total
+            for role, total in totals.items():
+                if role in roles:
+                    write(row, roles[role], total, styles[role])
+        elif label + 1 < width:
+            role = _summary_role(rows[row][label])
+            if role in totals:
+                own = cell_style(rows[row][label + 1])
+                write(row, label + 1, totals[role], own or CellStyle(styles[role].prefix or currency, styles[role].suffix,
+                                                                   True, styles[role].decimals))
+
+    if not summaries and len(data) > 1:
+        total_row = [""] * width
+        total_row[0] = "**Net Total**"
+        rows.append(total_row)
+        fix.added_rows += 1
+        for role, total in totals.items():
+            if role in roles:
+                write(len(rows) - 1, roles[role], total, styles[role])
+
+    fix.table = ParsedTable(table.headers, rows, table.subheaders, table.span)
+    return fix
+
+
+def fix_media_plans(text):
+    """
+    Fix every media-plan table in an answer. Returns (text, tables, fixes): the
+    answer with corrected tables rewritten in place, all its ParsedTables
+    (corrected where they are media plans), and the MediaPlanFix per plan.
+    """
+    tables = parse_tables(text)
+    fixes = []
+    lines = None
+    for index in reversed(range(len(tables))):
+        fix = fix_media_plan(tables[index])
+        if fix is None:
+            continue
+        fixes.insert(0, fix)
+        tables[index] = fix.table
+        if fix.changed and fix.table.span:
+            if lines is None:
+                lines = text.split("\n")
+            start, end = fix.table.span
+            indent = lines[start][:len(lines[start]) - len(lines[start].lstrip())]
+            lines[start:end] = [indent + line for line in fix.table.to_markdown()]
+    if fixes:
+        corrected = sum(fix.corrected for fix in fixes)
+        filled = sum(fix.filled for fix in fixes)
+        MEDIA_PLAN_CELLS.labels("corrected").inc(corrected)
+        MEDIA_PLAN_CELLS.labels("filled").inc(filled)
+        logger.info(f"🧮 Media plan: {len(fixes)} table(s), {corrected} cell(s) corrected, {filled} filled")
+    return ("\n".join(lines) if lines is not None else text), tables, fixes
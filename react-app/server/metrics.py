@@ -0,0 +1,78 @@
+"""
+Prometheus metrics for the TONIC AI backend.
+
+All collectors are registered on the default registry and served by the
+/api/metrics endpoint.
+"""
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+PROVIDER_CALLS = Counter(
+    "tonic_provider_calls_total",
+    "Outbound LLM provider calls by outcome",
+    ["provider", "call_type", "outcome"],
+)
+
+PROVIDER_RETRIES = Counter(
+    "tonic_provider_retries_total",
+    "Retried LLM provider attempts",
+    ["provider", "call_type"],
+)
+
+PROVIDER_ERROR_RATE = Gauge(
+    "tonic_provider_error_rate",
+    "Error rate over the circuit breaker's rolling window",
+    ["provider"],
+)
+
+CIRCUIT_STATE = Gauge(
+    "tonic_provider_circuit_state",
+    "Circuit breaker state (0 = closed, 1 = half-open, 2 = open)",
+    ["provider"],
+)
+
+QUEUE_WAIT = Histogram(
+    "tonic_provider_queue_wait_seconds",
+    "Time spent waiting for a provider slot and rate budget",
+    ["provider", "call_type"],
+    buckets=(0.005, 0.05, 0.25, 1, 2.5, 5, 10, 30, 60),
+)
+
+IN_FLIGHT = Gauge("tonic_provider_in_flight", "In-flight provider calls", ["provider"])
+
+QUEUED = Gauge("tonic_provider_queued", "Calls waiting for a provider slot", ["provider"])
+
+PLOT_GENERATIONS = Counter(
+    "tonic_plot_generations_total",
+    "Plot generation attempts by method (rules = built from tables, llm = generated code)",
+    ["method", "outcome"],
+)
+
+PLOT_ATTEMPTS = Histogram(
+    "tonic_plot_llm_attempts",
+    "LLM calls (generation plus repairs) per LLM-rendered plot",
+    buckets=(1, 2, 3, 4),
+)
+
+PLOT_LLM_TOKENS = Counter(
+    "tonic_plot_llm_tokens_total",
+    "Estimated tokens spent on plot code by stage (generate, repair) and kind (prompt, completion)",
+    ["stage", "kind"],
+)
+
+PLOT_CACHE_LOOKUPS = Counter(
+    "tonic_plot_cache_lookups_total",
+    "Rendered plot cache lookups by result",
+    ["result"],
+)
+
+MEDIA_PLAN_CELLS = Counter(
+    "tonic_media_plan_cells_total",
+    "Media-plan table cells recomputed locally by action (corrected = LLM value was wrong, filled = was empty)",
+    ["action"],
+)
+
+
+def render_metrics():
+    """Return (body, content_type) for the metrics endpoint"""
+    return generate_latest(), CONTENT_TYPE_LATEST
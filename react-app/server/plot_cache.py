@@ -0,0 +1,196 @@
+"""
+Content-addressed disk store for rendered plots.
+
+A plot is identified by the SHA-256 of its plot code (or chart spec). The
+source is kept as a small record (<id>.py) and each size variant is rendered
+on demand and cached as <id>-<variant>.png, so re-rendering the same chart
+after a refresh, a re-asked question or a history view is a file lookup.
+Clients get the plot id and fetch /api/plots/<id>.png instead of receiving
+megabytes of base64 inside JSON.
+
+Images and sources live in separate caches, each bounded by total bytes with
+least-recently-used eviction, so image churn never evicts the sources needed
+to re-render them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("TONIC AI")
+
+PLOT_CACHE_DIR = os.getenv("PLOT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tonic_plot_cache"))
+PLOT_CACHE_MAX_BYTES = int(os.getenv("PLOT_CACHE_MAX_MB", "512")) * 1024 * 1024
+PLOT_SOURCE_MAX_BYTES = 64 * 1024 * 1024
+
+# Size variants: name -> savefig dpi
+PLOT_VARIANTS = {"thumb": 50, "screen": 100, "print": 300}
+DEFAULT_VARIANT = "screen"
+PLOT_IMAGE_FORMATS = {"png": "image/png", "svg": "image/svg+xml", "pdf": "application/pdf"}
+
+_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+_NAME_RE = re.compile(r"^[0-9a-f]{64}(-[a-z0-9.]+)?\.(png|svg|pdf|py)$")
+
+
+def plot_key(source, **options):
+    """Hash plot code or a chart spec together with its render options"""
+    payload = json.dumps({"source": source, "options": options}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_plot_key(value):
+    return bool(_KEY_RE.match(value or ""))
+
+
+def image_name(key, variant, format="png"):
+    return f"{key}-{variant}.{format}"
+
+
+def custom_variant(dpi, size=None):
+    """Variant name for ad-hoc render options, e.g. 150dpi or 150dpi.8x5in"""
+    name = f"{dpi}dpi"
+    if size:
+        name += ".{:g}x{:g}in".format(*size)
+    return name
+
+
+def source_name(key):
+    return f"{key}.py"
+
+
+class PlotCache:
+    """Files in one directory, bounded by total bytes with LRU eviction; names must match `name_re`"""
+
+    def __init__(self, directory=PLOT_CACHE_DIR, max_bytes=PLOT_CACHE_MAX_BYTES, name_re=_NAME_RE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.name_re = name_re
+        self._entries = OrderedDict()  # name -> size, least recently used first
+        self._total = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        """Rebuild the LRU index from files left by a previous run"""
+        found = []
+        for name in os.listdir(self.directory):
+            if not self.name_re.match(name):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            found.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total += size
+        self._evict()
+        if found:
+            logger.info(f"🗂️ Cache: {len(self._entries)} files, {self._total // 1024} KB in {self.directory}")
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+    def get(self, name):
+        """Return the path of a cached file, or None"""
+        if not self.name_re.match(name or ""):
+            return None
+        path = self._path(name)
+        with self._lock:
+            if not os.path.exists(path):
+                # Evicted, possibly by another worker process sharing the directory
+                size = self._entries.pop(name, None)
+                if size is not None:
+                    self._total -= size
+                return None
+            if name in self._entries:
+                self._entries.move_to_end(name)
+            else:
+                size = os.path.getsize(path)
+                self._entries[name] = size
+                self._total += size
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def put(self, name, data):
+        """Store bytes under `name` and return the file path"""
+        if not self.name_re.match(name):
+            raise ValueError(f"Invalid cache file name: {name}")
+        path = self._path(name)
+        # Write then rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            previous = self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._total += len(data) - previous
+            self._evict()
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._entries), "bytes": self._total, "max_bytes": self.max_bytes}
+
+
+class PlotStore:
+    """Plot sources plus their rendered size variants"""
+
+    def __init__(self, directory=PLOT_CACHE_DIR):
+        self.images = PlotCache(directory, PLOT_CACHE_MAX_BYTES)
+        self.sources = PlotCache(os.path.join(directory, "sources"), PLOT_SOURCE_MAX_BYTES)
+
+    def save_source(self, source):
+        """Record plot code and return its plot id"""
+        key = plot_key(source)
+        if not self.sources.get(source_name(key)):
+            self.sources.put(source_name(key), source.encode("utf-8"))
+        return key
+
+    def source(self, key):
+        """Return the plot code for a plot id, or None"""
+        path = self.sources.get(source_name(key)) if is_plot_key(key) else None
+        if path is None:
+            return None
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    def image(self, key, variant, format="png"):
+        return self.images.get(image_name(key, variant, format))
+
+    def save_image(self, key, variant, data, format="png"):
+        return self.images.put(image_name(key, variant, format), data)
+
+    def stats(self):
+        return {"images": self.images.stats(), "sources": self.sources.stats()}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_plot_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PlotStore()
+        return _store
@@ -0,0 +1,107 @@
+"""
+Background plot render jobs for TONIC AI.
+
+Chat answers are returned as soon as the LLM responds; plot generation
+(plot-code LLM calls plus matplotlib rendering) runs as a job on the shared
+provider loop and the client polls GET /api/plots/<id> for the result.
+Rendering itself runs in the plot_sandbox worker processes; the threads here
+only wait on them, so it never blocks the event loop or request threads.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import providers
+from plot_sandbox import POOL_SIZE
+
+logger = logging.getLogger("TONIC AI")
+
+# One waiting thread per sandbox worker process
+RENDER_WORKERS = POOL_SIZE
+# Finished jobs are kept this long for the client to collect (seconds)
+JOB_TTL = float(os.getenv("PLOT_JOB_TTL", "900"))
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+_render_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="plot-render")
+
+
+async def run_render(func, *args):
+    """Run a CPU-bound render function on the plot render executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_render_executor, func, *args)
+
+
+class PlotJob:
+    def __init__(self, owner):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.status = PENDING
+        self.plot_id = None
+        self.plot_code = None
+        self.error = None
+        self.created_at = time.monotonic()
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "plot_id": self.plot_id,
+            "plot_url": f"/api/plots/{self.plot_id}.png" if self.plot_id else None,
+            "plot_code": self.plot_code,
+            "error": self.error,
+        }
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _expire_jobs(now):
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job.finished_at is not None and now - job.finished_at > JOB_TTL
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+
+async def _run_job(job, coro):
+    job.status = RUNNING
+    try:
+        job.plot_id, job.plot_code = await coro
+        job.status = DONE if job.plot_id else FAILED
+        if not job.plot_id:
+            job.error = "Plot could not be generated"
+    except Exception as e:
+        logger.error(f"❌ Plot job {job.id} failed: {e}")
+        job.status = FAILED
+        job.error = str(e)
+    finally:
+        job.finished_at = time.monotonic()
+    logger.info(f"🎨 Plot job {job.id} {job.status} in {job.finished_at - job.created_at:.1f}s")
+
+
+def start_plot_job(owner, coro):
+    """Schedule `coro` (returning (plot_id, plot_code)) and return the new job id"""
+    job = PlotJob(owner)
+    with _jobs_lock:
+        _expire_jobs(time.monotonic())
+        _jobs[job.id] = job
+    providers.submit(_run_job(job, coro))
+    return job.id
+
+
+def get_plot_job(job_id, owner):
+    """Return the job if it exists and belongs to `owner`, else None"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None or job.owner != owner:
+        return None
+    return job
@@ -0,0 +1,244 @@
+"""
+Thread-safe matplotlib rendering for plot code.
+
+Plot code (from the chart builder or an LLM) is written against pyplot:
+plt.figure(), plt.subplot(), plt.bar(), plt.title(), ... Global pyplot keeps
+one "current figure" per process, so two requests rendering at the same time
+draw into each other's charts. Here each render gets its own
+matplotlib.figure.Figure on the Agg canvas, and the code's `plt` is a small
+adapter that maps the pyplot calls onto that figure and its current axes.
+`import matplotlib.pyplot as plt` inside the code resolves to the same
+adapter, so no code path touches pyplot's global state.
+
+warm_up() builds the font cache and draws the common artists once, so the
+first real plot after boot does not pay for it.
+"""
+
+import builtins
+import io
+import logging
+import threading
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as pyplot
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+logger = logging.getLogger("TONIC AI")
+
+# pyplot calls that only affect the interactive session
+_NO_OPS = {"show", "savefig", "close", "ion", "ioff", "draw", "pause", "interactive"}
+
+
+class FigurePyplot:
+    """The subset of the pyplot interface plot code uses, bound to one Figure"""
+
+    def __init__(self, figure):
+        self._figure = figure
+        self._axes = None
+
+    # Figures and axes
+
+    def figure(self, num=None, figsize=None, dpi=None, **kwargs):
+        # Code that opens several figures only ever had the last one saved
+        if self._figure.axes:
+            self._figure.clear()
+            self._axes = None
+        if figsize is not None:
+            self._figure.set_size_inches(*figsize)
+        if dpi is not None:
+            self._figure.set_dpi(dpi)
+        return self._figure
+
+    def gcf(self):
+        return self._figure
+
+    def gca(self):
+        if self._axes is None:
+            self._axes = self._figure.axes[0] if self._figure.axes else self._figure.add_subplot()
+        return self._axes
+
+    def sca(self, axes):
+        self._axes = axes
+
+    def subplot(self, *args, **kwargs):
+        self._axes = self._figure.add_subplot(*args, **kwargs)
+        return self._axes
+
+    def subplots(self, nrows=1, ncols=1, *, figsize=None, dpi=None, **kwargs):
+        self.figure(figsize=figsize, dpi=dpi)
+        axes = self._figure.subplots(nrows, ncols, **kwargs)
+        self._axes = axes.flat[0] if hasattr(axes, "flat") else axes
+        return self._figure, axes
+
+    def subplot2grid(self, shape, loc, rowspan=1, colspan=1, **kwargs):
+        spec = self._figure.add_gridspec(*shape)
+        row, col = loc
+        self._axes = self._figure.add_subplot(spec[row:row + rowspan, col:col + colspan], **kwargs)
+        return self._axes
+
+    def clf(self):
+        self._figure.clear()
+        self._axes = None
+
+    def cla(self):
+        self.gca().cla()
+
+    # Axes decorations pyplot names differently from Axes
+
+    def title(self, label, *args, **kwargs):
+        return self.gca().set_title(label, *args, **kwargs)
+
+    def xlabel(self, label, *args, **kwargs):
+        return self.gca().set_xlabel(label, *args, **kwargs)
+
+    def ylabel(self, label, *args, **kwargs):
+        return self.gca().set_ylabel(label, *args, **kwargs)
+
+    def xlim(self, *args, **kwargs):
+        return self.gca().set_xlim(*args, **kwargs) if args or kwargs else self.gca().get_xlim()
+
+    def ylim(self, *args, **kwargs):
+        return self.gca().set_ylim(*args, **kwargs) if args or kwargs else self.gca().get_ylim()
+
+    def xscale(self, *args, **kwargs):
+        self.gca().set_xscale(*args, **kwargs)
+
+    def yscale(self, *args, **kwargs):
+        self.gca().set_yscale(*args, **kwargs)
+
+    def _ticks(self, axis, ticks, labels, kwargs):
+        axes = self.gca()
+        if ticks is not None:
+            getattr(axes, f"set_{axis}ticks")(ticks, labels)
+        tick_labels = getattr(axes, f"get_{axis}ticklabels")()
+        if kwargs:
+            pyplot.setp(tick_labels, **kwargs)
+        return getattr(axes, f"get_{axis}ticks")(), tick_labels
+
+    def xticks(self, ticks=None, labels=None, **kwargs):
+        return self._ticks("x", ticks, labels, kwargs)
+
+    def yticks(self, ticks=None, labels=None, **kwargs):
+        return self._ticks("y", ticks, labels, kwargs)
+
+    # Figure-level calls
+
+    def suptitle(self, *args, **kwargs):
+        return self._figure.suptitle(*args, **kwargs)
+
+    def tight_layout(self, *args, **kwargs):
+        self._figure.tight_layout(*args, **kwargs)
+
+    def subplots_adjust(self, *args, **kwargs):
+        self._figure.subplots_adjust(*args, **kwargs)
+
+    def figtext(self, *args, **kwargs):
+        return self._figure.text(*args, **kwargs)
+
+    def colorbar(self, mappable=None, ax=None, **kwargs):
+        axes = ax or self.gca()
+        if mappable is None:
+            mappable = (axes.collections or axes.images)[-1]
+        return self._figure.colorbar(mappable, ax=axes, **kwargs)
+
+    def __getattr__(self, name):
+        if name in _NO_OPS:
+            return lambda *args, **kwargs: None
+        # Plotting calls (bar, pie, legend, grid, text, ...) go to the current axes
+        if hasattr(Axes, name):
+            return getattr(self.gca(), name)
+        # Stateless helpers: cm, rcParams, setp, get_cmap, style, ...
+        return getattr(pyplot, name)
+
+
+class _MatplotlibModule:
+    """`matplotlib` as seen by plot code: the real module, except pyplot is the figure adapter"""
+
+    def __init__(self, plt):
+        self.pyplot = plt
+
+    def __getattr__(self, name):
+        return getattr(matplotlib, name)
+
+
+def _builtins_for(plt):
+    """Builtins whose import resolves matplotlib.pyplot to the figure adapter"""
+    module = _MatplotlibModule(plt)
+
+    def _import(name, globals=None, locals=None, fromlist=(), level=0):
+        if name == "matplotlib.pyplot" and fromlist:
+            return plt
+        result = builtins.__import__(name, globals, locals, fromlist, level)
+        # `import matplotlib.x` binds the top-level package, `from matplotlib import x` reads it
+        if name == "matplotlib" or (name.startswith("matplotlib.") and not fromlist):
+            return module
+        return result
+
+    namespace = dict(vars(builtins))
+    namespace["__import__"] = _import
+    return namespace
+
+
+def execute_plot_code(plot_code, filename="<plot>", extra_globals=None):
+    """Run plot code against a fresh Figure and return the Figure"""
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    plt = FigurePyplot(figure)
+    exec_globals = {"plt": plt, "__name__": "__main__", "__builtins__": _builtins_for(plt)}
+    exec_globals.update(extra_globals or {})
+    exec(compile(plot_code, filename, "exec"), exec_globals)
+    return figure
+
+
+def figure_bytes(figure, dpi=100, format="png", size=None):
+    """Save a Figure to PNG, SVG or PDF bytes, optionally resized to (width, height) inches"""
+    if size:
+        figure.set_size_inches(*size)
+    buf = io.BytesIO()
+    figure.savefig(buf, format=format, dpi=dpi, bbox_inches="tight")
+    return buf.getvalue()
+
+
+def render_plot(plot_code, dpi=100, format="png", size=None, extra_globals=None):
+    """Run plot code and return the image bytes"""
+    return figure_bytes(execute_plot_code(plot_code, extra_globals=extra_globals), dpi, format, size)
+
+
+WARM_UP_CODE = """
+import matplotlib.pyplot as plt
+plt.figure(figsize=(10, 8))
+plt.subplot(2, 2, 1)
+plt.pie([3, 2, 1], labels=["Meta", "TikTok", "Google"], autopct='%1.1f%%', startangle=90)
+plt.title("Budget share")
+plt.subplot(2, 2, 2)
+plt.bar(["A", "B", "C"], [1, 2, 3])
+plt.ylabel("Clicks")
+plt.xticks(rotation=30, ha='right')
+plt.subplot(2, 2, 3)
+plt.barh(["Reach", "Impressions"], [1.5, 2.5])
+plt.gca().invert_yaxis()
+plt.subplot(2, 2, 4)
+plt.plot(["Jan", "Feb", "Mar"], [0.4, 0.6, 0.5], marker='o', label="CTR")
+plt.legend()
+plt.grid(alpha=0.3)
+plt.tight_layout()
+"""
+
+_warmed = False
+_warm_lock = threading.Lock()
+
+
+def warm_up():
+    """Build the font cache and draw pie, bar, line, text and legend artists once"""
+    global _warmed
+    with _warm_lock:
+        if _warmed:
+            return
+        start = time.perf_counter()
+        render_plot(WARM_UP_CODE)
+        _warmed = True
+        logger.info(f"🎨 Plot renderer warmed up in {time.perf_counter() - start:.2f}s")
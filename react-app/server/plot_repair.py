@@ -0,0 +1,73 @@
+"""
+Static validation and error-feedback repair for generated plot code.
+
+Instead of regenerating plot code from the full knowledge base after every
+failure, generated code is checked statically before it runs, and a failure
+(validation error or traceback) is sent back together with only the failing
+code for a small, cheap repair call.
+
+This module has no dependencies beyond the standard library so the
+Streamlit app can share it.
+"""
+
+import ast
+
+MAX_PLOT_ATTEMPTS = 3
+REPAIR_MODEL = "gpt-4o-mini"
+# Keep repair prompts small: only the tail of long tracebacks is useful
+MAX_ERROR_CHARS = 2000
+
+REPAIR_SYSTEM_PROMPT = (
+    "You fix Python matplotlib code. You are given code that failed and the error it produced. "
+    "Return only the corrected, complete code in a single ```python block. Keep the same data and "
+    "chart intent, use matplotlib.pyplot as plt, do not call plt.show(), and do not read or write files."
+)
+
+BLOCKED_MODULES = {
+    "os", "sys", "subprocess", "shutil", "socket", "requests", "urllib", "http", "pathlib",
+    "pickle", "ctypes", "multiprocessing", "threading", "importlib", "builtins",
+}
+BLOCKED_CALLS = {"open", "exec", "eval", "compile", "__import__", "input", "breakpoint"}
+PLOT_CALLS = {
+    "plot", "bar", "barh", "pie", "scatter", "hist", "boxplot", "fill_between", "stackplot",
+    "step", "stem", "errorbar", "imshow", "violinplot", "area", "line",
+}
+
+
+def validate_plot_code(plot_code):
+    """Return None if the code looks renderable, otherwise an error message for the repair call"""
+    if not plot_code or not plot_code.strip():
+        return "No code was produced."
+    try:
+        tree = ast.parse(plot_code)
+    except SyntaxError as e:
+        return f"SyntaxError: {e.msg} (line {e.lineno}): {(e.text or '').strip()}"
+
+    draws = False
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            names = [node.module or ""] if isinstance(node, ast.ImportFrom) else [a.name for a in node.names]
+            for name in names:
+                if name.split(".")[0] in BLOCKED_MODULES:
+                    return f"Import of '{name}' is not allowed (line {node.lineno}); plots may only use matplotlib, pandas and numpy."
+        elif isinstance(node, ast.Call):
+            func = node.func
+            if isinstance(func, ast.Name) and func.id in BLOCKED_CALLS:
+                return f"Call to '{func.id}()' is not allowed (line {node.lineno})."
+            if isinstance(func, ast.Attribute) and func.attr in PLOT_CALLS:
+                draws = True
+            if isinstance(func, ast.Attribute) and func.attr == "savefig":
+                return f"Do not call savefig (line {node.lineno}); the figure is saved by the renderer."
+    if not draws:
+        return "The code does not draw anything: no plt.plot/bar/pie/scatter/... call was found."
+    return None
+
+
+def build_repair_messages(plot_code, error):
+    """Messages for a repair call: the failing code and its error, nothing else"""
+    if len(error) > MAX_ERROR_CHARS:
+        error = "..." + error[-MAX_ERROR_CHARS:]
+    return [
+        {"role": "system", "content": REPAIR_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Code:\n```python\n{plot_code}\n```\n\nError:\n{error}"},
+    ]
@@ -0,0 +1,229 @@
+"""
+Sandboxed plot rendering for TONIC AI.
+
+LLM-generated matplotlib code runs in a pool of pre-warmed worker processes
+instead of the web worker. Each worker imports matplotlib (Agg) and pandas
+and warms the font cache (see plot_render) before it accepts work, runs
+under an address-space rlimit, and returns PNG, SVG or PDF bytes over a
+pipe. A render that overruns its wall-clock timeout, exhausts memory or
+crashes its worker gets the worker killed and replaced, so one bad plot
+cannot stall or corrupt anything else.
+
+The worker side of this module runs as `python plot_sandbox.py <rfd> <wfd>`;
+keep the module-level imports light so workers start quickly.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+
+logger = logging.getLogger("TONIC AI")
+
+POOL_SIZE = int(os.getenv("PLOT_SANDBOX_WORKERS", str(min(4, os.cpu_count() or 1))))
+RENDER_TIMEOUT = float(os.getenv("PLOT_RENDER_TIMEOUT", "30"))
+MEMORY_LIMIT_MB = int(os.getenv("PLOT_RENDER_MEMORY_MB", "1024"))
+# Time allowed for a fresh worker to import matplotlib and pandas
+STARTUP_TIMEOUT = 60.0
+# Recycle workers periodically so leaks in generated code cannot accumulate
+MAX_RENDERS_PER_WORKER = 200
+
+
+class PlotRenderError(Exception):
+    """Raised when generated plot code fails, times out or kills its worker"""
+
+
+class PlotRenderTimeout(PlotRenderError):
+    """Raised when a render overruns its wall-clock timeout"""
+
+
+class _Worker:
+    def __init__(self, memory_limit_mb):
+        request_r, request_w = os.pipe()
+        result_r, result_w = os.pipe()
+        env = dict(
+            os.environ,
+            MPLBACKEND="Agg",
+            OPENBLAS_NUM_THREADS="1",
+            OMP_NUM_THREADS="1",
+            PLOT_RENDER_MEMORY_MB=str(memory_limit_mb),
+        )
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(request_r), str(result_w)],
+            pass_fds=(request_r, result_w),
+            stdin=subprocess.DEVNULL,
+            env=env,
+        )
+        os.close(request_r)
+        os.close(result_w)
+        self.requests = Connection(request_w, readable=False)
+        self.results = Connection(result_r, writable=False)
+        self.ready = False
+        self.renders = 0
+
+    def _receive(self, timeout):
+        if not self.results.poll(timeout):
+            raise PlotRenderTimeout(f"Plot render exceeded {timeout:.0f}s")
+        try:
+            return self.results.recv()
+        except (EOFError, OSError) as e:
+            raise PlotRenderError("Plot worker exited unexpectedly") from e
+
+    def render(self, plot_code, options, timeout):
+        """Return ("ok", image_bytes) or ("error", message); raises if the worker is lost"""
+        if not self.ready:
+            self._receive(STARTUP_TIMEOUT)
+            self.ready = True
+        try:
+            self.requests.send((plot_code, options))
+        except (BrokenPipeError, OSError) as e:
+            raise PlotRenderError("Plot worker is not accepting work") from e
+        self.renders += 1
+        return self._receive(timeout)
+
+    def kill(self):
+        for conn in (self.requests, self.results):
+            conn.close()
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+class RendererPool:
+    def __init__(self, size=POOL_SIZE, timeout=RENDER_TIMEOUT, memory_limit_mb=MEMORY_LIMIT_MB):
+        self.size = size
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self._idle = queue.Queue()
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _spawn(self):
+        worker = _Worker(self.memory_limit_mb)
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _retire(self, worker):
+        with self._lock:
+            self._workers.discard(worker)
+        worker.kill()
+
+    def start(self):
+        """Spawn the workers; they warm up in parallel in the background"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+        logger.info(f"🎨 Started {self.size} sandboxed plot workers")
+
+    def render(self, plot_code, dpi=300, timeout=None, format="png", size=None):
+        """
+        Run plot code in a worker and return the current figure as image bytes.
+        `format` is png, svg or pdf; `size` is an optional (width, height) in inches.
+        """
+        self.start()
+        timeout = timeout or self.timeout
+        options = {"dpi": dpi, "format": format, "size": size}
+        worker = self._idle.get()
+        start = time.monotonic()
+        try:
+            status, payload = worker.render(plot_code, options, timeout)
+        except PlotRenderError as e:
+            logger.error(f"❌ Plot worker {worker.process.pid} lost: {e}")
+            self._retire(worker)
+            self._idle.put(self._spawn())
+            raise
+
+        if status == "fatal" or worker.renders >= MAX_RENDERS_PER_WORKER:
+            self._retire(worker)
+            worker = self._spawn()
+        self._idle.put(worker)
+
+        if status != "ok":
+            raise PlotRenderError(payload)
+        logger.info(f"🎨 Rendered plot in {time.monotonic() - start:.2f}s ({len(payload)} bytes)")
+        return payload
+
+    def shutdown(self):
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.kill()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_renderer_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RendererPool()
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+# ==================== WORKER PROCESS ====================
+
+def _set_memory_limit(limit_mb):
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _worker_main(request_fd, result_fd):
+    import linecache
+    import traceback
+
+    import pandas as pd
+    from plot_render import execute_plot_code, figure_bytes, warm_up
+
+    requests = Connection(request_fd, writable=False)
+    results = Connection(result_fd, readable=False)
+
+    warm_up()
+    # Imports and font cache are done; everything from here on runs under the memory limit
+    _set_memory_limit(int(os.environ["PLOT_RENDER_MEMORY_MB"]))
+    results.send(("ready", None))
+
+    while True:
+        try:
+            plot_code, options = requests.recv()
+        except EOFError:
+            return
+        try:
+            # Register the source so tracebacks show the failing line for the repair prompt
+            linecache.cache["<plot>"] = (len(plot_code), None, plot_code.splitlines(True), "<plot>")
+            figure = execute_plot_code(plot_code, "<plot>", {"pd": pd})
+            result = ("ok", figure_bytes(figure, options["dpi"], options["format"], options["size"]))
+        except MemoryError:
+            # The heap may be in a bad state; ask the pool to replace this worker
+            result = ("fatal", f"Plot exceeded the {os.environ['PLOT_RENDER_MEMORY_MB']} MB memory limit")
+        except BaseException as e:
+            # Keep only the plot code's own frames so the repair prompt stays small
+            frames = [f for f in traceback.extract_tb(e.__traceback__) if f.filename == "<plot>"]
+            result = ("error", "".join(
+                ["Traceback (most recent call last):\n"] + traceback.format_list(frames)
+                + traceback.format_exception_only(type(e), e)
+            ))
+        results.send(result)
+        if result[0] == "fatal":
+            return
+
+
+if __name__ == "__main__":
+    _worker_main(int(sys.argv[1]), int(sys.argv[2]))
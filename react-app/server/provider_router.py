@@ -0,0 +1,222 @@
+"""
+Latency-aware provider routing with hedged requests.
+
+Each (provider, model) pair keeps a rolling window of observed latencies.
+When a call runs past the primary's p95 latency, a hedged duplicate is sent
+to the next candidate and whichever answers first wins; the loser is
+cancelled. Hedging is configured per call type in HEDGING_POLICIES.
+
+Each attempt runs through resilience.call_with_resilience, so an open
+circuit fails fast and the next candidate is tried straight away.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from resilience import call_with_resilience
+
+logger = logging.getLogger("TONIC AI")
+
+
+@dataclass
+class HedgingPolicy:
+    enabled: bool = True
+    # Percentile of the primary's latency after which the hedge is sent
+    percentile: float = 0.95
+    # Hedge delay used until enough samples have been observed (seconds)
+    default_delay: float = 20.0
+    # Never hedge sooner than this, to avoid doubling traffic on fast calls
+    min_delay: float = 2.0
+    # Samples required before the histogram budget is trusted
+    min_samples: int = 20
+    # Reorder candidates so the one with the lowest median latency goes first
+    prefer_fastest: bool = False
+
+
+HEDGING_POLICIES = {
+    # Perplexity stays primary for chat because it returns citations
+    "chat": HedgingPolicy(default_delay=25.0),
+    "plot_code": HedgingPolicy(default_delay=15.0, prefer_fastest=True),
+    "plot_repair": HedgingPolicy(default_delay=10.0, prefer_fastest=True),
+    "extraction": HedgingPolicy(enabled=False),
+}
+
+# Per call type override, e.g. HEDGING_CHAT=off
+for _call_type, _policy in HEDGING_POLICIES.items():
+    _env = os.getenv(f"HEDGING_{_call_type.upper()}")
+    if _env is not None:
+        _policy.enabled = _env.lower() in ("1", "true", "on", "yes")
+
+
+def configure_hedging(call_type, **settings):
+    """Update the hedging policy for a call type"""
+    policy = HEDGING_POLICIES.setdefault(call_type, HedgingPolicy())
+    for key, value in settings.items():
+        setattr(policy, key, value)
+    return policy
+
+
+class LatencyHistogram:
+    """Rolling window of latencies for one provider/model pair"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, p):
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, int(round(p * len(ordered))) - 1))
+        return ordered[index]
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def get_histogram(provider, model):
+    key = (provider, model)
+    with _histograms_lock:
+        if key not in _histograms:
+            _histograms[key] = LatencyHistogram()
+        return _histograms[key]
+
+
+def latency_snapshot():
+    """Return p50/p95 latency per provider and model"""
+    with _histograms_lock:
+        items = list(_histograms.items())
+    return {
+        f"{provider}/{model}": {
+            "samples": len(hist),
+            "p50": hist.percentile(0.5),
+            "p95": hist.percentile(0.95),
+        }
+        for (provider, model), hist in items
+    }
+
+
+@dataclass
+class Route:
+    """One candidate for a call: `call` is a zero-argument coroutine function"""
+    provider: str
+    model: str
+    call: object
+    # Prompt size estimate used for tokens-per-minute shaping
+    prompt_tokens: int = 0
+
+
+class AllProvidersFailed(Exception):
+    def __init__(self, errors):
+        super().__init__("; ".join(f"{route.provider}/{route.model}: {err}" for route, err in errors))
+        self.errors = errors
+
+
+def hedge_delay(route, policy):
+    """Seconds to wait on `route` before sending a hedged duplicate"""
+    hist = get_histogram(route.provider, route.model)
+    if len(hist) < policy.min_samples:
+        return policy.default_delay
+    return max(policy.min_delay, hist.percentile(policy.percentile))
+
+
+def order_routes(routes, policy):
+    if not policy.prefer_fastest:
+        return list(routes)
+
+    def median(route):
+        hist = get_histogram(route.provider, route.model)
+        if len(hist) < policy.min_samples:
+            return float("inf")
+        return hist.percentile(0.5)
+
+    # sorted() is stable, so untrained routes keep their configured order
+    return sorted(routes, key=median)
+
+
+async def _timed(call_type, route):
+    histogram = get_histogram(route.provider, route.model)
+    start = time.perf_counter()
+    try:
+        result = await call_with_resilience(call_type, route.provider, route.call, route.prompt_tokens)
+    except asyncio.CancelledError:
+        # A cancelled hedge loser took at least this long; dropping the slow
+        # calls would bias the p95 low and make hedges fire ever sooner
+        histogram.record(time.perf_counter() - start)
+        raise
+    histogram.record(time.perf_counter() - start)
+    return result
+
+
+async def route_call(call_type, routes):
+    """
+    Run a call across candidate routes and return (route, result).
+
+    The first route is primary. If it fails, the next route is tried at once;
+    if it is merely slow, a hedged duplicate is started after its p95 budget.
+    """
+    policy = HEDGING_POLICIES.get(call_type, HedgingPolicy(enabled=False))
+    pending_routes = order_routes(routes, policy)
+    if not pending_routes:
+        raise AllProvidersFailed([])
+
+    primary = pending_routes[0]
+    running = {}
+    errors = []
+    hedge_at = None
+
+    def launch():
+        nonlocal hedge_at
+        route = pending_routes.pop(0)
+        task = asyncio.ensure_future(_timed(call_type, route))
+        running[task] = route
+        hedge_at = time.monotonic() + hedge_delay(route, policy)
+        return route
+
+    try:
+        current = launch()
+        while running:
+            timeout = None
+            if policy.enabled and pending_routes:
+                timeout = max(0.0, hedge_at - time.monotonic())
+
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                # Current route is past its latency budget: hedge to the next candidate
+                logger.info(f"⏱️ {call_type}: {current.provider}/{current.model} exceeded its "
+                            f"latency budget, hedging to {pending_routes[0].provider}")
+                current = launch()
+                continue
+
+            for task in done:
+                route = running.pop(task)
+                if task.exception() is None:
+                    if route is not primary:
+                        logger.info(f"🏁 {call_type}: answered by {route.provider}/{route.model}")
+                    return route, task.result()
+                errors.append((route, task.exception()))
+                logger.warning(f"⚠️ {call_type}: {route.provider}/{route.model} failed: {task.exception()}")
+
+            if not running and pending_routes:
+                current = launch()
+
+        raise AllProvidersFailed(errors)
+    finally:
+        # Cancel whichever duplicate lost the race
+        for task in running:
+            task.cancel()
@@ -0,0 +1,236 @@
+"""
+Async provider clients for TONIC AI.
+
+All outbound LLM traffic (Perplexity, OpenAI, Gemini) goes through the
+coroutines in this module so that a waiting request costs a coroutine
+instead of an OS thread. Synchronous Flask code reaches them through
+run_sync(), which drives a single process-wide event loop.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import weakref
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("TONIC AI")
+
+# API Keys
+PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+# Endpoints (overridable so load tests can point at a local fake provider)
+PERPLEXITY_API_URL = os.getenv("PERPLEXITY_API_URL", "https://api.perplexity.ai/chat/completions")
+OPENAI_API_URL = os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
+GEMINI_API_URL = os.getenv("GEMINI_API_URL", "https://generativelanguage.googleapis.com/v1beta/models")
+
+HTTP_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+HTTP_LIMITS = httpx.Limits(max_connections=500, max_keepalive_connections=100)
+
+
+class ProviderError(Exception):
+    """Raised when a provider call fails or returns a non-2xx response."""
+
+    def __init__(self, provider, message, status_code=None):
+        super().__init__(message)
+        self.provider = provider
+        self.status_code = status_code
+
+
+def is_configured(provider):
+    """Return True if an API key is available for the given provider."""
+    return bool({
+        "perplexity": PERPLEXITY_API_KEY,
+        "openai": OPENAI_API_KEY,
+        "gemini": GEMINI_API_KEY,
+    }.get(provider))
+
+
+def build_messages(prompt, conversation_history=None):
+    """Build OpenAI-style messages from the last 5 turns plus the current prompt."""
+    messages = []
+    if conversation_history:
+        for turn in conversation_history[-5:]:
+            messages.append({"role": "user", "content": turn["q"]})
+            messages.append({"role": "assistant", "content": turn["a"]})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+# One AsyncClient per event loop; httpx clients must not be shared across loops.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_http_client():
+    """Return the pooled HTTP client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+        _clients[loop] = client
+    return client
+
+
+async def _post_json(provider, url, headers, payload):
+    try:
+        response = await get_http_client().post(url, headers=headers, json=payload)
+    except httpx.HTTPError as e:
+        raise ProviderError(provider, f"{type(e).__name__}: {e}") from e
+    if response.status_code >= 400:
+        raise ProviderError(provider, f"{response.status_code}: {response.text}", response.status_code)
+    return response.json()
+
+
+async def perplexity_chat(prompt, conversation_history=None, model="sonar", temperature=0.7):
+    """Return (content, citations) from the Perplexity chat completions API."""
+    if not PERPLEXITY_API_KEY:
+        raise ProviderError("perplexity", "Perplexity API key not configured")
+
+    headers = {
+        "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "model": model,
+        "messages": build_messages(prompt, conversation_history),
+        "temperature": temperature,
+        "stream": False
+    }
+    data = await _post_json("perplexity", PERPLEXITY_API_URL, headers, payload)
+    return data["choices"][0]["message"]["content"], format_citations(data.get("search_results"))
+
+
+def format_citations(search_results):
+    """Format Perplexity search results as the "title - url" lines the chat API returns"""
+    citations = ""
+    for result in search_results or []:
+        citations = citations + f"{result.get('title')} - {result.get('url')}" + " \n "
+    return citations
+
+
+async def perplexity_chat_stream(prompt, conversation_history=None, model="sonar", temperature=0.7):
+    """
+    Stream a Perplexity answer. Yields ("delta", text) for each content chunk
+    as it arrives, then one ("citations", text) once the stream is complete.
+    """
+    if not PERPLEXITY_API_KEY:
+        raise ProviderError("perplexity", "Perplexity API key not configured")
+
+    headers = {
+        "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream"
+    }
+    payload = {
+        "model": model,
+        "messages": build_messages(prompt, conversation_history),
+        "temperature": temperature,
+        "stream": True
+    }
+    search_results = None
+    try:
+        async with get_http_client().stream("POST", PERPLEXITY_API_URL, headers=headers, json=payload) as response:
+            if response.status_code >= 400:
+                body = (await response.aread()).decode(errors="replace")
+                raise ProviderError("perplexity", f"{response.status_code}: {body}", response.status_code)
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                # Every chunk repeats the search results; keep the latest
+                search_results = chunk.get("search_results") or search_results
+                choices = chunk.get("choices") or [{}]
+                content = (choices[0].get("delta") or {}).get("content")
+                if content:
+                    yield "delta", content
+    except httpx.HTTPError as e:
+        raise ProviderError("perplexity", f"{type(e).__name__}: {e}") from e
+    except json.JSONDecodeError as e:
+        raise ProviderError("perplexity", f"Malformed stream chunk: {e}") from e
+    yield "citations", format_citations(search_results)
+
+
+async def openai_chat(messages, model="gpt-4o", temperature=0.3):
+    """Return the assistant message content from the OpenAI chat completions API."""
+    if not OPENAI_API_KEY:
+        raise ProviderError("openai", "OpenAI API key not configured")
+
+    headers = {
+        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature
+    }
+    data = await _post_json("openai", OPENAI_API_URL, headers, payload)
+    return data["choices"][0]["message"]["content"]
+
+
+async def gemini_generate(prompt, model="gemini-2.0-flash"):
+    """Return the generated text from the Gemini generateContent API."""
+    if not GEMINI_API_KEY:
+        raise ProviderError("gemini", "Gemini API key not configured")
+
+    headers = {
+        "x-goog-api-key": GEMINI_API_KEY,
+        "Content-Type": "application/json"
+    }
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    data = await _post_json("gemini", f"{GEMINI_API_URL}/{model}:generateContent", headers, payload)
+    try:
+        parts = data["candidates"][0]["content"]["parts"]
+    except (KeyError, IndexError) as e:
+        raise ProviderError("gemini", f"Unexpected Gemini response: {data}") from e
+    return "".join(part.get("text", "") for part in parts)
+
+
+# ==================== SYNC BRIDGE ====================
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_background_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="provider-loop", daemon=True)
+            thread.start()
+            logger.info("Started background event loop for provider calls")
+        return _loop
+
+
+def submit(coro):
+    """Schedule a provider coroutine on the shared loop and return a concurrent Future."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_background_loop())
+
+
+def run_sync(coro, timeout=None):
+    """Run a provider coroutine from synchronous code and wait for its result."""
+    return submit(coro).result(timeout)
+
+
+def iterate_sync(agen):
+    """Drive an async generator on the shared loop from synchronous code, one item at a time."""
+    try:
+        while True:
+            try:
+                yield run_sync(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        # Consumer stopped early (e.g. the client disconnected): close the stream on its loop
+        run_sync(agen.aclose())
@@ -0,0 +1,260 @@
+"""
+Process-wide concurrency limiting and rate shaping per LLM provider.
+
+Each provider has a bound on in-flight calls plus two token buckets: one
+for requests per minute and one for tokens per minute (estimated with
+tiktoken). Waiters are served in priority order, so interactive chat jumps
+ahead of background extraction, and low-priority call types may only use a
+share of the in-flight slots.
+
+The limiter state is guarded by a thread lock and waiters are woken with
+call_soon_threadsafe, so the same limiter is shared by the Flask background
+loop and the ASGI server loop.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from metrics import IN_FLIGHT, QUEUE_WAIT, QUEUED
+
+logger = logging.getLogger("TONIC AI")
+
+# Lower number = served first
+CALL_PRIORITIES = {"chat": 0, "plot_code": 1, "plot_repair": 1, "extraction": 2}
+DEFAULT_PRIORITY = 1
+
+# Completion tokens to reserve per call type on top of the prompt estimate
+EXPECTED_OUTPUT_TOKENS = {"chat": 1500, "plot_code": 800, "plot_repair": 800, "extraction": 2000}
+
+
+@dataclass
+class ProviderLimits:
+    max_in_flight: int
+    requests_per_minute: float
+    tokens_per_minute: float
+    # Fraction of in-flight slots available to calls below chat priority
+    background_share: float = 0.75
+
+
+def _limits_from_env(provider, defaults):
+    prefix = provider.upper()
+    return ProviderLimits(
+        max_in_flight=int(os.getenv(f"{prefix}_MAX_IN_FLIGHT", defaults.max_in_flight)),
+        requests_per_minute=float(os.getenv(f"{prefix}_RPM", defaults.requests_per_minute)),
+        tokens_per_minute=float(os.getenv(f"{prefix}_TPM", defaults.tokens_per_minute)),
+        background_share=defaults.background_share,
+    )
+
+
+PROVIDER_LIMITS = {
+    "perplexity": _limits_from_env("perplexity", ProviderLimits(20, 300, 1_000_000)),
+    "openai": _limits_from_env("openai", ProviderLimits(20, 500, 300_000)),
+    "gemini": _limits_from_env("gemini", ProviderLimits(8, 300, 1_000_000, background_share=1.0)),
+}
+DEFAULT_LIMITS = ProviderLimits(10, 60, 100_000)
+
+
+_encoding = None
+_encoding_failed = False
+
+
+def estimate_tokens(text):
+    """Estimate the token count of a prompt, falling back to ~4 chars/token"""
+    global _encoding, _encoding_failed
+    if not text:
+        return 0
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable, using character estimate: {e}")
+            _encoding_failed = True
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def estimate_message_tokens(messages):
+    """Estimate tokens for a list of OpenAI-style messages"""
+    return sum(estimate_tokens(m["content"]) + 4 for m in messages)
+
+
+class TokenBucket:
+    """Continuous-refill token bucket; not thread-safe on its own"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, amount, now):
+        """Seconds until `amount` tokens are available (0 if available now)"""
+        self._refill(now)
+        # A single oversized request may drain the bucket rather than block forever
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "call_type", "loop", "future")
+
+    def __init__(self, priority, seq, tokens, call_type, loop):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.call_type = call_type
+        self.loop = loop
+        self.future = None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class ProviderLimiter:
+    def __init__(self, provider, limits):
+        self.provider = provider
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._requests = TokenBucket(limits.requests_per_minute)
+        self._tokens = TokenBucket(limits.tokens_per_minute)
+
+    def _slot_limit(self, priority):
+        if priority <= CALL_PRIORITIES["chat"]:
+            return self.limits.max_in_flight
+        return max(1, int(self.limits.max_in_flight * self.limits.background_share))
+
+    def _try_admit(self, waiter):
+        """Admit the head waiter if possible; return None on success or seconds to wait"""
+        if self._in_flight >= self._slot_limit(waiter.priority):
+            return float("inf")
+        now = time.monotonic()
+        delay = max(self._requests.delay_for(1, now), self._tokens.delay_for(waiter.tokens, now))
+        if delay > 0:
+            return delay
+        self._requests.consume(1)
+        self._tokens.consume(waiter.tokens)
+        self._in_flight += 1
+        IN_FLIGHT.labels(self.provider).set(self._in_flight)
+        return None
+
+    def _wake_head(self):
+        if self._waiters:
+            head = self._waiters[0]
+            if head.future is not None:
+                head.loop.call_soon_threadsafe(_resolve, head.future)
+
+    async def acquire(self, call_type, tokens):
+        """Wait for a slot and rate budget; returns the seconds spent queued"""
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(CALL_PRIORITIES.get(call_type, DEFAULT_PRIORITY), next(self._seq), tokens, call_type, loop)
+
+        with self._lock:
+            heapq.heappush(self._waiters, waiter)
+            QUEUED.labels(self.provider).set(len(self._waiters))
+
+        try:
+            while True:
+                with self._lock:
+                    wait = float("inf")
+                    if self._waiters[0] is waiter:
+                        wait = self._try_admit(waiter)
+                        if wait is None:
+                            heapq.heappop(self._waiters)
+                            QUEUED.labels(self.provider).set(len(self._waiters))
+                            self._wake_head()
+                            break
+                    waiter.future = loop.create_future()
+
+                timeout = None if wait == float("inf") else wait
+                try:
+                    await asyncio.wait_for(waiter.future, timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    heapq.heapify(self._waiters)
+                    QUEUED.labels(self.provider).set(len(self._waiters))
+                self._wake_head()
+            raise
+
+        waited = time.monotonic() - start
+        QUEUE_WAIT.labels(self.provider, call_type).observe(waited)
+        if waited > 1:
+            logger.info(f"⏳ {call_type} waited {waited:.1f}s for a {self.provider} slot")
+        return waited
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            IN_FLIGHT.labels(self.provider).set(self._in_flight)
+            self._wake_head()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "queued": len(self._waiters),
+                "max_in_flight": self.limits.max_in_flight,
+            }
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider):
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = ProviderLimiter(provider, PROVIDER_LIMITS.get(provider, DEFAULT_LIMITS))
+        return _limiters[provider]
+
+
+def limiter_snapshot():
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.provider: limiter.snapshot() for limiter in limiters}
+
+
+class provider_slot:
+    """Async context manager holding one rate-shaped slot for a provider call"""
+
+    def __init__(self, provider, call_type, prompt_tokens=0):
+        self.limiter = get_limiter(provider)
+        self.call_type = call_type
+        self.tokens = prompt_tokens + EXPECTED_OUTPUT_TOKENS.get(call_type, 1000)
+
+    async def __aenter__(self):
+        await self.limiter.acquire(self.call_type, self.tokens)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.limiter.release()
+        return False
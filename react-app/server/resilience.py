@@ -0,0 +1,299 @@
+"""
+Retry, deadline and circuit-breaker policy for outbound LLM calls.
+
+Every provider call runs under its call type's deadline, is retried with
+jittered exponential backoff on 429/5xx and network errors (bounded by a
+shared retry budget), and is short-circuited while its provider's breaker
+is open. Attempts queue for a provider slot in rate_limiter first.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from metrics import CIRCUIT_STATE, PROVIDER_CALLS, PROVIDER_ERROR_RATE, PROVIDER_RETRIES
+from providers import ProviderError
+from rate_limiter import provider_slot
+
+logger = logging.getLogger("TONIC AI")
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+@dataclass
+class CallPolicy:
+    # Total time allowed for the call, including retries (seconds)
+    deadline: float
+    # Maximum attempts, including the first
+    attempts: int = 3
+    # Backoff: random exponential between 0 and min(max_wait, multiplier * 2^n)
+    multiplier: float = 0.5
+    max_wait: float = 8.0
+
+
+CALL_POLICIES = {
+    "chat": CallPolicy(deadline=60.0, attempts=3),
+    "plot_code": CallPolicy(deadline=45.0, attempts=2),
+    "plot_repair": CallPolicy(deadline=30.0, attempts=2),
+    "extraction": CallPolicy(deadline=90.0, attempts=3),
+}
+DEFAULT_POLICY = CallPolicy(deadline=60.0, attempts=2)
+
+
+class CircuitOpenError(ProviderError):
+    """Raised without calling the provider while its circuit breaker is open"""
+
+
+class DeadlineExceeded(ProviderError):
+    """Raised when a call and its retries overrun the call type's deadline"""
+
+
+class RetryBudget:
+    """
+    Caps retries at a fraction of recent traffic so retries cannot multiply
+    load on a provider that is already struggling.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, window=10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        for events in (self._requests, self._retries):
+            while events and now - events[0] > self.window:
+                events.popleft()
+
+    def record_request(self):
+        with self._lock:
+            self._requests.append(time.monotonic())
+
+    def try_acquire(self):
+        """Spend one retry if the budget allows it"""
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            allowed = self.min_per_second * self.window + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                return False
+            self._retries.append(now)
+            return True
+
+
+class CircuitBreaker:
+    """Closed -> open on high error rate; open -> half-open after a cool-down."""
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+    STATE_NAMES = {CLOSED: "closed", HALF_OPEN: "half-open", OPEN: "open"}
+
+    def __init__(self, provider, window=20, min_calls=5, error_threshold=0.5,
+                 consecutive_failures=5, reset_timeout=30.0):
+        self.provider = provider
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.consecutive_failures = consecutive_failures
+        self.reset_timeout = reset_timeout
+        self._outcomes = deque(maxlen=window)
+        self._failures_in_a_row = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.labels(provider).set(self.CLOSED)
+
+    @property
+    def state(self):
+        return self.STATE_NAMES[self._state]
+
+    def error_rate(self):
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def _set_state(self, state):
+        if state != self._state:
+            logger.warning(f"🔌 Circuit for {self.provider}: {self.STATE_NAMES[self._state]} -> {self.STATE_NAMES[state]}")
+        self._state = state
+        CIRCUIT_STATE.labels(self.provider).set(state)
+
+    def allow(self):
+        """Return True if a call may proceed"""
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._set_state(self.HALF_OPEN)
+                self._trial_in_flight = False
+            if self._state == self.HALF_OPEN:
+                # Let exactly one trial call through
+                if self._trial_in_flight:
+                    return False
+                self._trial_in_flight = True
+            return True
+
+    def release(self):
+        """Forget an allowed call that was cancelled before it finished"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record(self, success):
+        with self._lock:
+            self._outcomes.append(success)
+            PROVIDER_ERROR_RATE.labels(self.provider).set(self.error_rate())
+
+            if success:
+                self._failures_in_a_row = 0
+                if self._state == self.HALF_OPEN:
+                    self._outcomes.clear()
+                    self._set_state(self.CLOSED)
+                return
+
+            self._failures_in_a_row += 1
+            tripped = (
+                self._state == self.HALF_OPEN or
+                self._failures_in_a_row >= self.consecutive_failures or
+                (len(self._outcomes) >= self.min_calls and self.error_rate() >= self.error_threshold)
+            )
+            if tripped:
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+
+_breakers = {}
+_budgets = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(provider):
+    with _registry_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(provider)
+        return _breakers[provider]
+
+
+def get_retry_budget(provider):
+    with _registry_lock:
+        if provider not in _budgets:
+            _budgets[provider] = RetryBudget()
+        return _budgets[provider]
+
+
+def breaker_snapshot():
+    """Return breaker state and rolling error rate per provider"""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {b.provider: {"state": b.state, "error_rate": round(b.error_rate(), 3)} for b in breakers}
+
+
+def is_retryable(exc):
+    if isinstance(exc, (CircuitOpenError, DeadlineExceeded)):
+        return False
+    if isinstance(exc, ProviderError):
+        # No status code means a network error or timeout
+        return exc.status_code is None or exc.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, asyncio.TimeoutError)
+
+
+async def call_with_resilience(call_type, provider, call, prompt_tokens=0):
+    """
+    Run `call` (a zero-argument coroutine function) under the call type's policy.
+
+    Each attempt also holds a rate-shaped provider slot sized by `prompt_tokens`.
+    """
+    policy = CALL_POLICIES.get(call_type, DEFAULT_POLICY)
+    breaker = get_breaker(provider)
+    budget = get_retry_budget(provider)
+
+    def should_retry(exc):
+        if not is_retryable(exc):
+            return False
+        if not budget.try_acquire():
+            logger.warning(f"Retry budget exhausted for {provider}, not retrying {call_type}")
+            return False
+        PROVIDER_RETRIES.labels(provider, call_type).inc()
+        return True
+
+    in_call = False
+
+    async def attempt():
+        nonlocal in_call
+        if not breaker.allow():
+            PROVIDER_CALLS.labels(provider, call_type, "circuit_open").inc()
+            raise CircuitOpenError(provider, f"Circuit open for {provider}")
+        budget.record_request()
+        try:
+            async with provider_slot(provider, call_type, prompt_tokens):
+                # Left set when the call is cancelled, so a deadline hit while
+                # the provider hangs is counted against its breaker
+                in_call = True
+                try:
+                    result = await call()
+                except Exception:
+                    in_call = False
+                    raise
+                in_call = False
+        except asyncio.CancelledError:
+            # Lost a hedged race or hit the deadline; the outcome is recorded by the caller
+            breaker.release()
+            raise
+        except Exception:
+            breaker.record(False)
+            PROVIDER_CALLS.labels(provider, call_type, "error").inc()
+            raise
+        breaker.record(True)
+        PROVIDER_CALLS.labels(provider, call_type, "success").inc()
+        return result
+
+    async def run():
+        async for attempt_state in AsyncRetrying(
+            stop=stop_after_attempt(policy.attempts),
+            wait=wait_random_exponential(multiplier=policy.multiplier, max=policy.max_wait),
+            retry=retry_if_exception(should_retry),
+            reraise=True,
+        ):
+            with attempt_state:
+                return await attempt()
+
+    try:
+        return await asyncio.wait_for(run(), timeout=policy.deadline)
+    except asyncio.TimeoutError as e:
+        # Time spent queued behind our own rate limiter is not the provider's fault
+        if in_call:
+            breaker.record(False)
+        PROVIDER_CALLS.labels(provider, call_type, "timeout").inc()
+        raise DeadlineExceeded(provider, f"{call_type} call to {provider} exceeded {policy.deadline}s deadline") from e
+
+
+async def stream_with_resilience(call_type, provider, stream, prompt_tokens=0):
+    """
+    Relay `stream` (a zero-argument async generator function) under the
+    provider's breaker and rate limiter. A stream cannot be replayed once
+    items have been handed on, so it is not retried; callers fall back instead.
+    """
+    breaker = get_breaker(provider)
+    if not breaker.allow():
+        PROVIDER_CALLS.labels(provider, call_type, "circuit_open").inc()
+        raise CircuitOpenError(provider, f"Circuit open for {provider}")
+    get_retry_budget(provider).record_request()
+    try:
+        async with provider_slot(provider, call_type, prompt_tokens):
+            async for item in stream():
+                yield item
+    except (asyncio.CancelledError, GeneratorExit):
+        # Consumer went away mid-stream; says nothing about the provider
+        breaker.release()
+        raise
+    except Exception:
+        breaker.record(False)
+        PROVIDER_CALLS.labels(provider, call_type, "error").inc()
+        raise
+    breaker.record(True)
+    PROVIDER_CALLS.labels(provider, call_type, "success").inc()
@@ -0,0 +1,125 @@
+"""
+Wire encodings for the tables in chat responses.
+
+`tables` has always been a list of {header: cell} records, which repeats
+every column name on every row. Clients can ask for a leaner encoding with
+the Accept header:
+
+    Accept: application/json                      records (default)
+    Accept: application/vnd.tonic.columnar+json   ParsedTable.columnar()
+    Accept: application/vnd.tonic.arrow+json      columnar, and tables of at
+                                                  least ARROW_MIN_CELLS cells as
+                                                  a base64 Arrow IPC stream
+
+The response body stays JSON either way, so answers, events and tables can
+share one payload. Arrow needs pyarrow; without it the arrow encoding falls
+back to columnar.
+"""
+
+import base64
+import logging
+
+from table_parser import columnar_tables
+
+logger = logging.getLogger("TONIC AI")
+
+TABLE_MEDIA_TYPES = {
+    "application/json": "records",
+    "application/vnd.tonic.columnar+json": "columnar",
+    "application/vnd.tonic.arrow+json": "arrow",
+}
+TABLE_FORMATS = ("records", "columnar", "arrow")
+# Arrow only pays for its schema header on larger tables
+ARROW_MIN_CELLS = 500
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+_pyarrow = None
+_pyarrow_failed = False
+
+
+def get_pyarrow():
+    global _pyarrow, _pyarrow_failed
+    if _pyarrow is None and not _pyarrow_failed:
+        try:
+            import pyarrow
+            import pyarrow.ipc  # noqa: F401
+            _pyarrow = pyarrow
+        except ImportError as e:
+            logger.warning(f"pyarrow unavailable, sending Arrow tables as columnar JSON: {e}")
+            _pyarrow_failed = True
+    return _pyarrow
+
+
+def negotiate_table_format(accept):
+    """Pick the table format for an Accept header; the highest-q known media type wins"""
+    best, best_q = "records", 0.0
+    for part in (accept or "").split(","):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        table_format = TABLE_MEDIA_TYPES.get(media_type.lower())
+        if table_format is None:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        # Ties go to the leaner encoding, so "columnar, application/json" means columnar
+        if q > best_q or (q == best_q and q > 0 and TABLE_FORMATS.index(table_format) > TABLE_FORMATS.index(best)):
+            best, best_q = table_format, q
+    return best
+
+
+def arrow_table(columnar):
+    """A pyarrow Table of a columnar table, with dtype, unit and subheader in each field's metadata"""
+    pa = get_pyarrow()
+    arrays = [
+        pa.array(values, type=pa.string() if kind == "text" else pa.float64())
+        for kind, values in zip(columnar["dtypes"], columnar["values"])
+    ]
+    fields = [
+        pa.field(name, array.type, metadata={"dtype": kind, "unit": unit or "", "subheader": subheader or ""})
+        for name, array, kind, unit, subheader in zip(
+            columnar["columns"], arrays, columnar["dtypes"], columnar["units"],
+            columnar["subheaders"] or [None] * len(arrays)
+        )
+    ]
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def arrow_bytes(columnar):
+    """Serialize a columnar table as an Arrow IPC stream"""
+    pa = get_pyarrow()
+    table = arrow_table(columnar)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _encode_columnar(columnar, table_format):
+    if table_format == "arrow" and columnar["rows"] * len(columnar["columns"]) >= ARROW_MIN_CELLS and get_pyarrow():
+        return {
+            "encoding": "arrow",
+            "media_type": ARROW_MEDIA_TYPE,
+            "columns": columnar["columns"],
+            "rows": columnar["rows"],
+            "data": base64.b64encode(arrow_bytes(columnar)).decode("ascii"),
+        }
+    return columnar
+
+
+def encode_table(table, table_format="records"):
+    """Encode one ParsedTable for the wire"""
+    if table_format == "records":
+        return table.records()
+    return _encode_columnar(table.columnar(), table_format)
+
+
+def encode_tables(tables, table_format="records"):
+    """Encode a list of ParsedTables for the wire, inferring all their dtypes in one pass"""
+    if table_format == "records" or not tables:
+        return [table.records() for table in tables]
+    return [_encode_columnar(columnar, table_format) for columnar in columnar_tables(tables)]
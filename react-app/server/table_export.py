@@ -0,0 +1,130 @@
+"""
+Server-side table downloads.
+
+Each table extracted from an answer is stored with its ChatMessage as
+Parquet: typed columns (see ParsedTable.columnar) with dtype, unit and
+subheader in the field metadata. CSV and XLSX are written from it on the
+first download and kept in an LRU disk cache keyed by the table's content
+hash, so a large table is serialized once per format rather than on every
+render or click. Parquet downloads are the stored bytes.
+"""
+
+import csv
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+
+from plot_cache import PlotCache
+from table_codec import arrow_table, get_pyarrow
+
+TABLE_EXPORT_DIR = os.getenv("TABLE_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "tonic_table_exports"))
+TABLE_EXPORT_MAX_BYTES = int(os.getenv("TABLE_EXPORT_MAX_MB", "256")) * 1024 * 1024
+TABLE_EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+# Widest spreadsheet column, in characters
+XLSX_MAX_WIDTH = 50
+
+_NAME_RE = re.compile(r"^[0-9a-f]{64}\.(csv|xlsx|parquet)$")
+
+
+def table_parquet(columnar):
+    """Serialize a columnar table (ParsedTable.columnar()) as Parquet bytes; None without pyarrow"""
+    if get_pyarrow() is None:
+        return None
+    import pyarrow.parquet as pq
+    sink = io.BytesIO()
+    pq.write_table(arrow_table(columnar), sink, compression="zstd")
+    return sink.getvalue()
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _read(data):
+    """Stored Parquet -> (DataFrame, [(dtype, unit, subheader)] per column)"""
+    import pyarrow.parquet as pq
+    table = pq.read_table(io.BytesIO(data))
+    meta = []
+    for field in table.schema:
+        fields = {key.decode(): value.decode() for key, value in (field.metadata or {}).items()}
+        meta.append((fields.get("dtype", "text"), fields.get("unit") or None, fields.get("subheader") or None))
+    return table.to_pandas(), meta
+
+
+def to_csv(data):
+    frame, meta = _read(data)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(frame.columns)
+    if any(subheader for _, _, subheader in meta):
+        writer.writerow([subheader or "" for _, _, subheader in meta])
+    frame.to_csv(buf, index=False, header=False, float_format="%.15g")
+    return buf.getvalue().encode("utf-8")
+
+
+def to_xlsx(data):
+    import pandas as pd
+    frame, meta = _read(data)
+    has_subheaders = any(subheader for _, _, subheader in meta)
+    buf = io.BytesIO()
+    header_rows = 2 if has_subheaders else 1
+    with pd.ExcelWriter(buf, engine="xlsxwriter") as writer:
+        # Header and subheader rows are written by hand so the subheader sits under the header, as in the answer
+        frame.to_excel(writer, sheet_name="Table", index=False, header=False, startrow=header_rows)
+        workbook, sheet = writer.book, writer.sheets["Table"]
+        bold = workbook.add_format({"bold": True, "bottom": 1})
+        sheet.write_row(0, 0, [str(column) for column in frame.columns], bold)
+        if has_subheaders:
+            sheet.write_row(1, 0, [subheader or "" for _, _, subheader in meta], bold)
+        formats = {"percent": workbook.add_format({"num_format": "0.00%"})}
+        for index, (column, (kind, unit, subheader)) in enumerate(zip(frame.columns, meta)):
+            number_format = None
+            if kind == "percent":
+                number_format = formats["percent"]
+            elif kind == "currency":
+                number_format = formats.setdefault(unit, workbook.add_format({"num_format": f'"{unit}"#,##0.00'}))
+            cells = frame[column].astype(str) if kind == "text" else frame[column].map("{:,.2f}".format)
+            width = max([len(str(column)), len(subheader or "")] + cells.str.len().tolist())
+            sheet.set_column(index, index, min(width + 2, XLSX_MAX_WIDTH), number_format)
+        sheet.freeze_panes(header_rows, 0)
+    return buf.getvalue()
+
+
+EXPORTERS = {"csv": to_csv, "xlsx": to_xlsx, "parquet": lambda data: data}
+
+
+class TableExportCache:
+    """CSV, XLSX and Parquet files of stored tables, by content hash"""
+
+    def __init__(self, directory=TABLE_EXPORT_DIR):
+        self.files = PlotCache(directory, TABLE_EXPORT_MAX_BYTES, _NAME_RE)
+
+    def path(self, table_hash, format, load_data):
+        """Path of the export, writing it from the Parquet bytes returned by load_data() on a miss"""
+        name = f"{table_hash}.{format}"
+        path = self.files.get(name)
+        if path is None:
+            path = self.files.put(name, EXPORTERS[format](load_data()))
+        return path
+
+    def stats(self):
+        return self.files.stats()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_table_export_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TableExportCache()
+        return _cache
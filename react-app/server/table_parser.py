@@ -0,0 +1,308 @@
+"""
+Single-pass markdown table parser with typed columns.
+
+TableStreamParser consumes an answer incrementally (whole text or LLM
+tokens) and hands back each table as soon as the first non-table line after
+it arrives. Unlike splitting the reply on newlines and keeping only rows
+whose cell count matches the header, it keeps empty cells ("| NA | | 81 |"),
+pads or folds ragged rows, keeps summary rows, and recognises the TONIC
+subheader row ("Channel | Exp. Link Clicks | Exp. Tonic CPC | ...") that
+follows the separator.
+
+Column dtypes are inferred for a whole table (or every table in an answer)
+at once with vectorised pandas string ops: numeric ("11,630", "2.5k"), currency ("AED1.29", "$4")
+and percent ("12%", stored as 0.12). ParsedTable.records() keeps the string
+records the API has always returned; ParsedTable.to_dataframe() gives the
+typed DataFrame and ParsedTable.columnar() the compact column-major payload
+(see table_codec).
+"""
+
+import re
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+# ISO codes accepted as a currency prefix ("AED1.29", "usd 4"); any other word
+# ("Jan 2024", "Top 10") makes the cell text
+CURRENCY_CODES = (
+    "AED", "SAR", "QAR", "KWD", "BHD", "OMR", "EGP", "JOD", "USD", "EUR", "GBP", "INR", "PKR", "CNY",
+    "JPY", "AUD", "CAD", "SGD", "CHF", "HKD", "ZAR", "TRY", "MYR", "IDR", "PHP", "NZD",
+)
+# "AED1.29", "$4", "11,630", "0.40", "12%", "2.5k", "-3"
+NUMBER_RE = re.compile(
+    r"^(?P<sign>-)?\s*(?P<currency>(?i:" + "|".join(CURRENCY_CODES) + r")\s?|[$€£₹])?\s*"
+    r"(?P<number>\d[\d,]*(?:\.\d+)?|\.\d+)\s*(?P<suffix>%|[kKmMbB])?$"
+)
+MULTIPLIERS = {"k": 1e3, "m": 1e6, "b": 1e9}
+MISSING_VALUES = {"", "-", "na", "n/a", "nan", "none", "null", "--"}
+# A column is numeric if at least this share of its non-empty cells parse
+NUMERIC_SHARE = 0.6
+
+_SEPARATOR_RE = re.compile(r"^\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?$")
+_CELL_SPLIT_RE = re.compile(r"(?<!\\)\|")
+
+
+def parse_number(value):
+    """Parse a table cell like "AED1.29", "11,630", "0.40" or "12%" (0.12); returns None if not numeric"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    text = value.strip().replace(" ", " ")
+    if text.lower() in MISSING_VALUES:
+        return None
+    match = NUMBER_RE.match(text)
+    if not match:
+        return None
+    number = float(match.group("number").replace(",", ""))
+    suffix = (match.group("suffix") or "").lower()
+    number = number / 100 if suffix == "%" else number * MULTIPLIERS.get(suffix, 1)
+    return -number if match.group("sign") else number
+
+
+def split_row(line):
+    """Split a markdown table row into stripped cells, keeping empty ones"""
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|") and not line.endswith("\\|"):
+        line = line[:-1]
+    return [cell.strip().replace("\\|", "|") for cell in _CELL_SPLIT_RE.split(line)]
+
+
+def infer_column_dtypes(columns):
+    """
+    Infer the dtype of each column (a list of string cells; columns may have
+    different lengths) with one vectorised pass over all their cells, so many
+    small tables cost one pass. Returns [(kind, floats, unit)], where kind is
+    numeric, currency, percent or text (floats is None for text).
+    """
+    bounds = np.cumsum([0] + [len(column) for column in columns])
+    cells = pd.Series([cell for column in columns for cell in column], dtype=object).fillna("").astype(str)
+    cells = cells.str.strip().str.replace(" ", " ", regex=False)
+    present = (~cells.str.lower().isin(MISSING_VALUES)).to_numpy()
+    parts = cells.str.extract(NUMBER_RE)
+    parsed = parts["number"].notna().to_numpy() & present
+
+    suffix = parts["suffix"].str.lower()
+    numbers = pd.to_numeric(parts["number"].str.replace(",", "", regex=False), errors="coerce").to_numpy(dtype=float)
+    numbers = numbers * suffix.map(MULTIPLIERS).fillna(1).to_numpy(dtype=float)
+    numbers = np.where(parts["sign"].notna().to_numpy(), -numbers, numbers)
+    is_percent = (suffix == "%").to_numpy()
+    numbers = np.where(is_percent, numbers / 100, numbers)
+    numbers[~parsed] = np.nan
+    currency = parts["currency"].str.strip().str.upper().to_numpy(dtype=object)
+    has_currency = parts["currency"].notna().to_numpy()
+
+    dtypes = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        span = slice(start, end)
+        column_parsed = parsed[span]
+        if not present[span].any() or column_parsed.sum() / present[span].sum() < NUMERIC_SHARE:
+            dtypes.append(("text", None, None))
+        elif is_percent[span][column_parsed].mean() > 0.5:
+            dtypes.append(("percent", numbers[span], "%"))
+        elif has_currency[span][column_parsed].mean() > 0.5:
+            units = Counter(currency[span][column_parsed & has_currency[span]])
+            dtypes.append(("currency", numbers[span], units.most_common(1)[0][0]))
+        else:
+            dtypes.append(("numeric", numbers[span], None))
+    return dtypes
+
+
+def infer_dtypes(frame):
+    """Infer every column's dtype from its string cells; returns {column: (kind, floats, unit)}"""
+    columns = [frame.iloc[:, index].tolist() for index in range(frame.shape[1])]
+    return dict(zip(frame.columns, infer_column_dtypes(columns)))
+
+
+class ParsedTable:
+    def __init__(self, headers, rows, subheaders=None, span=None):
+        self.headers = headers
+        self.rows = rows
+        # Second header row of TONIC tables ("Channel | Exp. Link Clicks | ..."), if any
+        self.subheaders = subheaders
+        # (first line, line after the last) of the table in the parsed text
+        self.span = span
+
+    def to_markdown(self):
+        """The table as markdown lines: header, separator, subheader row, rows"""
+        rows = [self.headers, ["---"] * len(self.headers)] + ([self.subheaders] if self.subheaders else []) + self.rows
+        return ["| " + " | ".join(cell.replace("|", "\\|") for cell in row) + " |" for row in rows]
+
+    def records(self):
+        """Rows as {header: cell} string dicts, subheader row first, as the chat API returns them"""
+        rows = ([self.subheaders] if self.subheaders else []) + self.rows
+        return [dict(zip(self.headers, row)) for row in rows]
+
+    def to_dataframe(self):
+        """
+        Typed DataFrame of the data rows. Numeric, currency and percent columns
+        are floats; attrs carries "dtypes", "units" and "subheaders" per column.
+        """
+        columns = _unique(self.headers)
+        frame = pd.DataFrame(self.rows, columns=columns, dtype="object")
+        kinds, units = {}, {}
+        for column, (kind, numbers, unit) in infer_dtypes(frame).items():
+            kinds[column] = kind
+            if numbers is not None:
+                frame[column] = numbers
+                units[column] = unit
+            else:
+                frame[column] = frame[column].replace("", None)
+        frame.attrs["dtypes"] = kinds
+        frame.attrs["units"] = units
+        frame.attrs["subheaders"] = dict(zip(columns, self.subheaders)) if self.subheaders else {}
+        return frame
+
+    def columns(self):
+        """Cells column by column"""
+        return [list(column) for column in zip(*self.rows)] if self.rows else [[] for _ in self.headers]
+
+    def columnar(self, dtypes=None):
+        """
+        Column-major encoding: column names once, then one value array per
+        column. Numeric, currency and percent columns are floats (None where
+        empty) with their unit; a column keeps its strings if any non-empty cell
+        does not parse, so nothing shown in the table is lost. `dtypes` takes
+        precomputed infer_column_dtypes() results (see columnar_tables).
+        """
+        columns = self.columns()
+        if dtypes is None:
+            dtypes = infer_column_dtypes(columns)
+        kinds, units, values = [], [], []
+        for cells, (kind, numbers, unit) in zip(columns, dtypes):
+            if numbers is not None:
+                lost = np.isnan(numbers) & np.array([cell.lower() not in MISSING_VALUES for cell in cells], dtype=bool)
+                if not lost.any():
+                    kinds.append(kind)
+                    units.append(unit)
+                    values.append(np.where(np.isnan(numbers), None, numbers).tolist())
+                    continue
+            kinds.append("text")
+            units.append(None)
+            values.append(cells)
+        return {
+            "encoding": "columnar",
+            "columns": _unique(self.headers),
+            "dtypes": kinds,
+            "units": units,
+            "subheaders": self.subheaders,
+            "rows": len(self.rows),
+            "values": values,
+        }
+
+
+def columnar_tables(tables):
+    """ParsedTable.columnar() for several tables, inferring all their dtypes in one pass"""
+    columns = [table.columns() for table in tables]
+    dtypes = infer_column_dtypes([column for table_columns in columns for column in table_columns])
+    encoded, offset = [], 0
+    for table, table_columns in zip(tables, columns):
+        encoded.append(table.columnar(dtypes[offset:offset + len(table_columns)]))
+        offset += len(table_columns)
+    return encoded
+
+
+def _unique(headers):
+    seen = {}
+    result = []
+    for index, header in enumerate(headers):
+        header = header or f"Column {index + 1}"
+        seen[header] = seen.get(header, 0) + 1
+        result.append(header if seen[header] == 1 else f"{header} ({seen[header]})")
+    return result
+
+
+class TableStreamParser:
+    """
+    Incremental markdown table tokenizer. feed() accepts any chunking of the
+    text (whole answers or streamed tokens) and returns the tables completed
+    so far; close() flushes the last one. Each line is examined once.
+    """
+
+    def __init__(self):
+        self._partial = ""
+        self._lines = []  # table lines of the block being read
+        self._line_no = 0  # index of the next complete line
+
+    def feed(self, chunk):
+        completed = []
+        lines = (self._partial + chunk).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            table = self._line(line)
+            if table:
+                completed.append(table)
+        return completed
+
+    def close(self):
+        completed = []
+        if self._partial:
+            table = self._line(self._partial)
+            self._partial = ""
+            if table:
+                completed.append(table)
+        table = self._finish()
+        if table:
+            completed.append(table)
+        return completed
+
+    def _line(self, line):
+        stripped = line.strip()
+        self._line_no += 1
+        if "|" in stripped:
+            self._lines.append(stripped)
+            return None
+        return self._finish(self._line_no - 1)
+
+    def _finish(self, end=None):
+        lines, self._lines = self._lines, []
+        end = self._line_no if end is None else end
+        if len(lines) < 2:
+            return None
+        headers = split_row(lines[0])
+        body = lines[2:] if _SEPARATOR_RE.match(lines[1]) else lines[1:]
+        rows = []
+        for line in body:
+            cells = _fit(split_row(line), len(headers))
+            if any(cells):
+                rows.append(cells)
+        if not rows:
+            return None
+
+        subheaders = None
+        if len(rows) > 1 and _is_subheader(rows[0], rows[1:]):
+            subheaders = rows.pop(0)
+        return ParsedTable(headers, rows, subheaders, span=(end - len(lines), end))
+
+
+def _fit(cells, width):
+    """Pad short rows with empty cells; fold overflow cells into the last column"""
+    if len(cells) < width:
+        return cells + [""] * (width - len(cells))
+    if len(cells) > width:
+        extra = [cell for cell in cells[width - 1:] if cell]
+        return cells[:width - 1] + [" | ".join(extra)]
+    return cells
+
+
+def _is_subheader(row, rest, sample=5):
+    """
+    A row of labels only (Channel | Exp. Link Clicks | Exp. Tonic CPC) sitting
+    above rows that have numbers in those columns
+    """
+    labels = [cell for cell in row if cell]
+    if len(labels) < len(row) / 2 or any(parse_number(cell) is not None for cell in labels):
+        return False
+    return any(
+        row[index] and any(parse_number(other[index]) is not None for other in rest[:sample])
+        for index in range(len(row))
+    )
+
+
+def parse_tables(text):
+    """Parse every markdown table in an answer"""
+    parser = TableStreamParser()
+    return parser.feed(text or "") + parser.close()
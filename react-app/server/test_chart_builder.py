@@ -0,0 +1,34 @@
+"""Tests for rule-based chart selection from answer tables."""
+
+from chart_builder import analyze_table, choose_charts
+
+
+def records(headers, rows):
+    return [dict(zip(headers, row)) for row in rows]
+
+
+def test_month_year_labels_are_a_time_series():
+    table = records(["Month", "Spend", "Clicks"], [
+        ["Jan 2024", "AED1,000", "800"],
+        ["Feb 2024", "AED1,500", "1,100"],
+        ["Mar 2024", "AED1,200", "950"],
+    ])
+    analysis = analyze_table(table)
+    assert analysis["category"] == "Month"
+    assert analysis["labels"] == ["Jan 2024", "Feb 2024", "Mar 2024"]
+    assert analysis["columns"]["Spend"] == [1000.0, 1500.0, 1200.0]
+    assert {kind for kind, _ in choose_charts(analysis)} == {"line"}
+
+
+def test_year_labels_under_a_time_header():
+    table = records(["Year", "Budget"], [["2023", "50,000"], ["2024", "65,000"], ["2025", "80,000"]])
+    analysis = analyze_table(table)
+    assert analysis["category"] == "Year"
+    assert analysis["labels"] == ["2023", "2024", "2025"]
+
+
+def test_year_like_values_stay_a_metric():
+    table = records(["Platform", "Clicks"], [["Meta", "2010"], ["TikTok", "2024"]])
+    analysis = analyze_table(table)
+    assert analysis["category"] == "Platform"
+    assert analysis["columns"]["Clicks"] == [2010.0, 2024.0]
@@ -0,0 +1,104 @@
+"""
+Tests for chat history full-text search: FTS5 and the LIKE fallback on SQLite,
+and the tsvector index when TEST_POSTGRES_URL points at a scratch database.
+"""
+
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import chat_search
+from chat_search import search_messages, setup_search_index
+
+MESSAGES = [
+    (1, "Media plan for KSA", "Here is a TikTok and YouTube budget split with CPC and CPM estimates."),
+    (1, "What is CTR?", "Click-through rate is clicks divided by impressions."),
+    (1, "Budget planning", "Allocate budget by platform efficiency."),
+    (2, "Budget for another user", "Their budget is private."),
+]
+
+
+def create_messages(engine, id_column="INTEGER PRIMARY KEY"):
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE IF EXISTS chat_messages"))
+        connection.execute(text("DROP TABLE IF EXISTS chat_sessions"))
+        connection.execute(text("CREATE TABLE chat_sessions (id INTEGER PRIMARY KEY, user_id INTEGER, session_name TEXT)"))
+        connection.execute(text(
+            f"CREATE TABLE chat_messages (id {id_column}, session_id INTEGER, question TEXT, answer TEXT, "
+            "timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        connection.execute(text("INSERT INTO chat_sessions VALUES (1, 1, 'Plans'), (2, 2, 'Theirs')"))
+        # Stored before the index exists, so setup has to index them
+        for session_id, question, answer in MESSAGES:
+            connection.execute(
+                text("INSERT INTO chat_messages (session_id, question, answer) VALUES (:session_id, :question, :answer)"),
+                {"session_id": session_id, "question": question, "answer": answer},
+            )
+    return engine
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(chat_search, "_backend", "like")
+    return create_messages(create_engine("sqlite://"))
+
+
+def search(engine, query, user_id=1, backend=None, **page):
+    with engine.connect() as connection:
+        return search_messages(connection, user_id, query, backend=backend, **page)
+
+
+def test_fts5_ranks_only_the_users_messages(engine):
+    assert setup_search_index(engine) == "fts5"
+    results = search(engine, "budget")
+    # A question match weighs more than an answer match
+    assert [row["question"] for row in results] == ["Budget planning", "Media plan for KSA"]
+    assert results[0]["score"] > results[1]["score"]
+    assert results[0]["session_name"] == "Plans"
+    assert "<mark>budget</mark>" in results[0]["snippet"]
+
+
+def test_fts5_matches_stems_and_pages(engine):
+    setup_search_index(engine)
+    assert [row["question"] for row in search(engine, "budgets planned")] == ["Budget planning", "Media plan for KSA"]
+    first, second = search(engine, "budget", limit=1), search(engine, "budget", limit=1, offset=1)
+    assert [row["message_id"] for row in first + second] == [row["message_id"] for row in search(engine, "budget")]
+
+
+def test_fts5_takes_query_syntax_literally(engine):
+    setup_search_index(engine)
+    assert search(engine, '"AND OR * NEAR(') == []
+    assert search(engine, "*** ???") == []
+    assert [row["question"] for row in search(engine, "click-through")] == ["What is CTR?"]
+
+
+def test_fts5_index_follows_updates_and_deletes(engine):
+    setup_search_index(engine)
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE chat_messages SET answer = 'Now about tiktok' WHERE question = 'What is CTR?'"))
+        connection.execute(text("DELETE FROM chat_messages WHERE question = 'Budget planning'"))
+        connection.execute(text("INSERT INTO chat_messages (session_id, question, answer) VALUES (1, 'New', 'budget')"))
+    assert [row["question"] for row in search(engine, "tiktok")] == ["What is CTR?", "Media plan for KSA"]
+    assert [row["question"] for row in search(engine, "impressions")] == []
+    assert {row["question"] for row in search(engine, "budget")} == {"Media plan for KSA", "New"}
+
+
+def test_like_fallback_highlights_and_escapes(engine):
+    results = search(engine, "Budget", backend="like")
+    assert {row["question"] for row in results} == {"Media plan for KSA", "Budget planning"}
+    snippets = {row["question"]: row["snippet"] for row in results}
+    assert snippets["Budget planning"] == "Allocate <mark>budget</mark> by platform efficiency."
+    assert search(engine, "%", backend="like") == []
+    assert search(engine, "_", backend="like") == []
+
+
+@pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="TEST_POSTGRES_URL not set")
+def test_postgres_tsvector_ranks_only_the_users_messages(monkeypatch):
+    monkeypatch.setattr(chat_search, "_backend", "like")
+    engine = create_messages(create_engine(os.environ["TEST_POSTGRES_URL"]), id_column="SERIAL PRIMARY KEY")
+    assert setup_search_index(engine) == "postgres"
+    results = search(engine, "budget")
+    assert [row["question"] for row in results] == ["Budget planning", "Media plan for KSA"]
+    assert "<mark>budget</mark>" in results[0]["snippet"]
+    assert search(engine, '"AND OR * NEAR(') == []
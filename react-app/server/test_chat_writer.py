@@ -0,0 +1,144 @@
+"""Tests for write-behind chat persistence and id reservation."""
+
+import itertools
+import threading
+import time
+
+import pytest
+
+from chat_writer import ASYNC, SYNC, ChatTurn, ChatWriter, IdBlocks
+
+
+class FakeStore:
+    """write_batch callback recording batches and numbering turns in write order"""
+
+    def __init__(self, delay=0.0, fail_on=None):
+        self.batches = []
+        self.delay = delay
+        self.fail_on = fail_on
+        self._ids = itertools.count(1)
+
+    def __call__(self, turns):
+        time.sleep(self.delay)
+        if self.fail_on is not None and any(turn.question == self.fail_on for turn in turns):
+            raise RuntimeError("write failed")
+        self.batches.append([turn.question for turn in turns])
+        return [(next(self._ids), []) for _ in turns]
+
+    @property
+    def written(self):
+        return [question for batch in self.batches for question in batch]
+
+
+def turn(question):
+    return ChatTurn("alice", "session", question, "answer")
+
+
+def test_sync_mode_writes_before_returning():
+    store = FakeStore()
+    writer = ChatWriter(store, mode=SYNC)
+    (first,) = writer.submit([turn("q1")])
+    assert store.written == ["q1"]
+    assert first.ids() == (1, [])
+
+
+def test_async_mode_batches_turns_in_submission_order():
+    store = FakeStore()
+    writer = ChatWriter(store, mode=ASYNC, batch_size=4, interval=0.05)
+    turns = [writer.submit([turn(f"q{i}")])[0] for i in range(10)]
+    assert writer.flush(5)
+    assert store.written == [f"q{i}" for i in range(10)]
+    assert all(len(batch) <= 4 for batch in store.batches)
+    assert [t.ids()[0] for t in turns] == list(range(1, 11))
+    writer.close()
+
+
+def test_async_turn_has_no_ids_until_written_unless_reserved():
+    store = FakeStore(delay=0.1)
+    writer = ChatWriter(store, mode=ASYNC, batch_size=1, interval=0)
+    plain, reserved = turn("plain"), turn("reserved")
+    reserved.message_id, reserved.table_ids = 42, [7, 8]
+    writer.submit([plain, reserved])
+    assert plain.ids() == (None, [])
+    assert reserved.ids() == (42, [7, 8])
+    writer.close()
+
+
+def test_close_flushes_queued_turns_and_later_turns_write_inline():
+    store = FakeStore()
+    writer = ChatWriter(store, mode=ASYNC, batch_size=100, interval=60)
+    writer.submit([turn("q1"), turn("q2")])
+    assert store.written == []
+    writer.close()
+    assert store.written == ["q1", "q2"]
+    (late,) = writer.submit([turn("late")])
+    assert store.written == ["q1", "q2", "late"]
+    assert late.ids() == (3, [])
+
+
+def test_failed_batch_resolves_its_turns_without_ids():
+    store = FakeStore(fail_on="bad")
+    writer = ChatWriter(store, mode=ASYNC, batch_size=2, interval=0)
+    bad, good = writer.submit([turn("bad"), turn("good")])
+    later = writer.submit([turn("later")])[0]
+    writer.flush(5)
+    writer.close()
+    assert bad.ids() == good.ids() == (None, [])
+    assert writer.stats()["failed"] == 2
+    assert later.ids() == (1, [])
+
+
+def test_full_queue_blocks_until_the_writer_catches_up():
+    store = FakeStore(delay=0.05)
+    writer = ChatWriter(store, mode=ASYNC, batch_size=2, interval=0, max_pending=2)
+    for i in range(6):
+        writer.submit([turn(f"q{i}")])
+        assert writer.stats()["pending"] <= 2
+    writer.close()
+    assert store.written == [f"q{i}" for i in range(6)]
+
+
+def test_invalid_mode_is_rejected():
+    with pytest.raises(ValueError):
+        ChatWriter(FakeStore(), mode="later")
+
+
+def test_id_blocks_reserve_a_block_per_round_trip():
+    fetched = []
+    sequence = itertools.count(100)
+
+    def fetch(count):
+        fetched.append(count)
+        return [next(sequence) for _ in range(count)]
+
+    blocks = IdBlocks(fetch, block_size=5)
+    assert blocks.take(2) == [100, 101]
+    assert blocks.take(3) == [102, 103, 104]
+    assert fetched == [5]
+    # A request larger than what is left fetches enough for it in one go
+    assert blocks.take(7) == list(range(105, 112))
+    assert fetched == [5, 7]
+    assert blocks.take(0) == []
+
+
+def test_id_blocks_never_hand_out_an_id_twice():
+    sequence = itertools.count(1)
+    lock = threading.Lock()
+
+    def fetch(count):
+        with lock:
+            return [next(sequence) for _ in range(count)]
+
+    blocks = IdBlocks(fetch, block_size=3)
+    taken = []
+
+    def take():
+        for _ in range(50):
+            taken.extend(blocks.take(2))
+
+    threads = [threading.Thread(target=take) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(taken) == len(set(taken)) == 400
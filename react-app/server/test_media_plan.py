@@ -0,0 +1,65 @@
+"""Tests for the local media-plan arithmetic."""
+
+from media_plan import fix_media_plan, fix_media_plans
+from table_parser import parse_tables
+
+PLAN = """| Platform | Budget | Impressions | Clicks | CTR | CPC |
+|---|---|---|---|---|---|
+| Meta | AED1,000 | 100,000 | 1,000 | {meta_ctr} | AED1.00 |
+| TikTok | AED2,000 | 200,000 | 4,000 | {tiktok_ctr} | {tiktok_cpc} |
+"""
+
+
+def plan(meta_ctr="1.00%", tiktok_ctr="2.00%", tiktok_cpc="AED0.50"):
+    return parse_tables(PLAN.format(meta_ctr=meta_ctr, tiktok_ctr=tiktok_ctr, tiktok_cpc=tiktok_cpc))[0]
+
+
+def test_wrong_ctr_is_corrected():
+    fix = fix_media_plan(plan(meta_ctr="5.00%"))
+    assert fix.table.rows[0][4] == "1.00%"
+    assert fix.corrected == 1
+
+
+def test_missing_cells_are_filled_in_the_column_format():
+    fix = fix_media_plan(plan(tiktok_ctr="", tiktok_cpc=""))
+    assert fix.table.rows[1][4:] == ["2.00%", "AED0.50"]
+    assert fix.filled >= 2
+
+
+def test_na_cells_are_kept():
+    fix = fix_media_plan(plan(tiktok_ctr="NA"))
+    assert fix.table.rows[1][4] == "NA"
+
+
+def test_correct_plan_only_gains_a_net_total_row():
+    fix = fix_media_plan(plan())
+    assert fix.corrected == 0
+    assert fix.table.rows[:2] == plan().rows
+    assert fix.table.rows[2] == ["**Net Total**", "AED3,000", "300,000", "5,000", "1.67%", "AED0.60"]
+
+
+def test_ctr_in_percent_units_without_a_sign_keeps_its_scale():
+    fix = fix_media_plan(plan(meta_ctr="3.00", tiktok_ctr="2.00"))
+    assert [row[4] for row in fix.table.rows] == ["1.00", "2.00", "1.67"]
+
+
+def test_ctr_as_a_fraction_keeps_its_scale():
+    fix = fix_media_plan(plan(meta_ctr="0.0100", tiktok_ctr="0.0300"))
+    assert [row[4] for row in fix.table.rows] == ["0.0100", "0.0200", "0.0167"]
+
+
+def test_other_cost_tables_are_left_alone():
+    text = """| Item | Cost | Clicks | CPC |
+|---|---|---|---|
+| Laptop | $1,200 | 300 | $9.00 |
+| Phone | $800 | 200 | $1.00 |
+
+| Platform | Cost | Clicks |
+|---|---|---|
+| Meta | $1,200 | 300 |
+| Google | $800 | 200 |
+"""
+    fixed, tables, fixes = fix_media_plans(text)
+    assert fixed == text
+    assert fixes == []
+    assert [table.rows for table in tables] == [table.rows for table in parse_tables(text)]
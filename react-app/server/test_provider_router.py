@@ -0,0 +1,24 @@
+"""Tests for latency-aware routing and hedged requests."""
+
+import asyncio
+
+from provider_router import HedgingPolicy, Route, configure_hedging, get_histogram, route_call
+
+
+def test_cancelled_hedge_loser_is_recorded_as_a_latency_sample():
+    configure_hedging("test_hedge", **vars(HedgingPolicy(default_delay=0.05, min_delay=0.0)))
+
+    async def slow():
+        await asyncio.sleep(10)
+        return "slow"
+
+    async def fast():
+        return "fast"
+
+    routes = [Route("hedge-slow", "m", slow), Route("hedge-fast", "m", fast)]
+    route, result = asyncio.run(route_call("test_hedge", routes))
+
+    assert (route.provider, result) == ("hedge-fast", "fast")
+    slow_samples = get_histogram("hedge-slow", "m")
+    assert len(slow_samples) == 1
+    assert slow_samples.percentile(0.95) >= 0.05
@@ -0,0 +1,88 @@
+"""Tests for the per-provider concurrency limiter and token buckets."""
+
+import asyncio
+
+import pytest
+
+import rate_limiter
+from rate_limiter import ProviderLimiter, ProviderLimits, TokenBucket, provider_slot
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    def install(provider, **limits):
+        limiter = ProviderLimiter(provider, ProviderLimits(**{
+            "requests_per_minute": 10_000, "tokens_per_minute": 10_000_000, **limits
+        }))
+        monkeypatch.setitem(rate_limiter._limiters, provider, limiter)
+        return limiter
+    return install
+
+
+def test_chat_is_served_before_earlier_background_waiters(limiter):
+    limiter("priority", max_in_flight=1)
+    order = []
+
+    async def call(call_type):
+        async with provider_slot("priority", call_type):
+            order.append(call_type)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        holder = asyncio.ensure_future(call("chat"))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(call(call_type)) for call_type in ("extraction", "plot_code", "chat")]
+        await asyncio.gather(holder, *waiters)
+
+    asyncio.run(main())
+    assert order == ["chat", "chat", "plot_code", "extraction"]
+
+
+def test_background_calls_only_get_their_share_of_slots(limiter):
+    provider = limiter("share", max_in_flight=4, background_share=0.5)
+    peak = {"plot_code": 0, "chat": 0}
+    running = {"plot_code": 0, "chat": 0}
+
+    async def call(call_type):
+        async with provider_slot("share", call_type):
+            running[call_type] += 1
+            peak[call_type] = max(peak[call_type], running[call_type])
+            await asyncio.sleep(0.02)
+            running[call_type] -= 1
+
+    async def main():
+        await asyncio.gather(*(call("plot_code") for _ in range(6)))
+        await asyncio.gather(*(call("chat") for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == {"plot_code": 2, "chat": 4}
+    assert provider.snapshot()["in_flight"] == 0
+
+
+def test_cancelled_waiter_leaves_the_queue(limiter):
+    provider = limiter("cancel", max_in_flight=1)
+
+    async def main():
+        async with provider_slot("cancel", "chat"):
+            waiter = asyncio.ensure_future(provider_slot("cancel", "chat").__aenter__())
+            await asyncio.sleep(0.01)
+            assert provider.snapshot()["queued"] == 1
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+            assert provider.snapshot()["queued"] == 0
+        async with provider_slot("cancel", "chat"):
+            pass
+
+    asyncio.run(main())
+
+
+def test_token_bucket_delays_until_refilled():
+    bucket = TokenBucket(per_minute=60)
+    now = bucket.updated
+    assert bucket.delay_for(60, now) == 0
+    bucket.consume(60)
+    assert bucket.delay_for(1, now) == pytest.approx(1.0)
+    assert bucket.delay_for(1, now + 1.0) == 0
+    # An oversized request waits for a full bucket instead of forever
+    assert bucket.delay_for(1000, now + 1.0) == pytest.approx(59.0)
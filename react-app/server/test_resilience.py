@@ -0,0 +1,152 @@
+"""Tests for the retry, deadline and circuit-breaker policy of LLM calls."""
+
+import asyncio
+import time
+
+import pytest
+
+import resilience
+from providers import ProviderError
+from resilience import (
+    CallPolicy, CircuitBreaker, CircuitOpenError, DeadlineExceeded, RetryBudget, call_with_resilience, get_breaker,
+)
+
+
+@pytest.fixture
+def short_deadline(monkeypatch):
+    monkeypatch.setitem(resilience.CALL_POLICIES, "test", CallPolicy(deadline=0.05, attempts=1))
+
+
+@pytest.fixture
+def quick_retries(monkeypatch):
+    monkeypatch.setitem(resilience.CALL_POLICIES, "test_retry", CallPolicy(deadline=5, attempts=3, max_wait=0.01))
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("trip", consecutive_failures=3, min_calls=100)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_opens_on_error_rate():
+    breaker = CircuitBreaker("rate", window=10, min_calls=4, error_threshold=0.5, consecutive_failures=100)
+    for success in (True, False, True, False):
+        breaker.record(success)
+    assert breaker.state == "open"
+
+
+def test_half_open_breaker_lets_one_trial_through_and_recovers():
+    breaker = CircuitBreaker("recover", consecutive_failures=1, reset_timeout=0.02)
+    breaker.record(False)
+    assert not breaker.allow()
+
+    time.sleep(0.03)
+    assert breaker.allow()
+    assert breaker.state == "half-open"
+    assert not breaker.allow()
+
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.error_rate() == 0.0
+    assert breaker.allow()
+
+
+def test_failed_half_open_trial_reopens_the_breaker():
+    breaker = CircuitBreaker("reopen", consecutive_failures=1, reset_timeout=0.02)
+    breaker.record(False)
+    time.sleep(0.03)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_released_half_open_trial_frees_the_slot():
+    breaker = CircuitBreaker("release", consecutive_failures=1, reset_timeout=0.02)
+    breaker.record(False)
+    time.sleep(0.03)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_open_circuit_fails_fast_without_calling_the_provider():
+    calls = []
+
+    async def call():
+        calls.append(1)
+
+    breaker = get_breaker("open-provider")
+    for _ in range(breaker.consecutive_failures):
+        breaker.record(False)
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(call_with_resilience("chat", "open-provider", call))
+    assert calls == []
+
+
+def test_retry_budget_is_exhausted_and_refills_with_traffic():
+    budget = RetryBudget(ratio=0.5, min_per_second=0, window=10)
+    assert not budget.try_acquire()
+    for _ in range(4):
+        budget.record_request()
+    assert budget.try_acquire()
+    assert budget.try_acquire()
+    assert not budget.try_acquire()
+    budget.record_request()
+    budget.record_request()
+    assert budget.try_acquire()
+
+
+def test_retry_budget_forgets_old_retries():
+    budget = RetryBudget(ratio=0, min_per_second=10, window=0.1)
+    assert budget.try_acquire()
+    assert not budget.try_acquire()
+    time.sleep(0.15)
+    assert budget.try_acquire()
+
+
+def test_retryable_errors_are_retried_until_the_budget_runs_out(quick_retries, monkeypatch):
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        raise ProviderError("budget-provider", "overloaded", status_code=503)
+
+    monkeypatch.setitem(resilience._budgets, "budget-provider", RetryBudget(ratio=0, min_per_second=0.1, window=10))
+    with pytest.raises(ProviderError):
+        asyncio.run(call_with_resilience("test_retry", "budget-provider", flaky))
+    # One retry allowed (0.1/s over 10s), then the budget stops the third attempt
+    assert len(attempts) == 2
+
+    attempts.clear()
+    with pytest.raises(ProviderError):
+        asyncio.run(call_with_resilience("test_retry", "budget-provider", flaky))
+    assert len(attempts) == 1
+
+
+def test_client_errors_are_not_retried(quick_retries):
+    attempts = []
+
+    async def bad_request():
+        attempts.append(1)
+        raise ProviderError("client-error-provider", "bad request", status_code=400)
+
+    with pytest.raises(ProviderError):
+        asyncio.run(call_with_resilience("test_retry", "client-error-provider", bad_request))
+    assert len(attempts) == 1
+
+
+def test_deadline_on_hung_provider_counts_against_breaker(short_deadline):
+    async def hang():
+        await asyncio.sleep(10)
+
+    breaker = get_breaker("hung-provider")
+    for _ in range(breaker.consecutive_failures):
+        with pytest.raises(DeadlineExceeded):
+            asyncio.run(call_with_resilience("test", "hung-provider", hang))
+
+    assert breaker.error_rate() == 1.0
+    assert breaker.state == "open"
@@ -0,0 +1,64 @@
+"""Tests for Accept negotiation and the records, columnar and Arrow table encodings."""
+
+import base64
+
+import pytest
+
+import table_codec
+from table_codec import encode_tables, negotiate_table_format
+from table_parser import parse_tables
+
+SMALL = parse_tables("""| Medium | CPC | Budget % |
+|---|---|---|
+| Meta | AED1.29 | 40% |
+| TikTok | AED0.95 | 60% |
+""")[0]
+LARGE = parse_tables("| Row | Value |\n|---|---|\n" + "".join(f"| r{i} | {i} |\n" for i in range(300)))[0]
+
+
+@pytest.mark.parametrize("accept, table_format", [
+    (None, "records"),
+    ("", "records"),
+    ("*/*", "records"),
+    ("application/json", "records"),
+    ("application/vnd.tonic.columnar+json", "columnar"),
+    ("Application/Vnd.Tonic.Arrow+JSON", "arrow"),
+    # Ties go to the leaner encoding; q values decide otherwise
+    ("application/json, application/vnd.tonic.columnar+json", "columnar"),
+    ("application/vnd.tonic.arrow+json;q=0.5, application/vnd.tonic.columnar+json", "columnar"),
+    ("application/vnd.tonic.columnar+json;q=0, application/json", "records"),
+    ("application/vnd.tonic.columnar+json;q=oops", "records"),
+])
+def test_negotiate_table_format(accept, table_format):
+    assert negotiate_table_format(accept) == table_format
+
+
+def test_records_are_the_default_encoding():
+    assert encode_tables([SMALL]) == [SMALL.records()]
+
+
+def test_columnar_keeps_units_and_subheaders():
+    encoded = encode_tables([SMALL], "columnar")[0]
+    assert encoded["encoding"] == "columnar"
+    assert encoded["dtypes"] == ["text", "currency", "percent"]
+    assert encoded["units"] == [None, "AED", "%"]
+    assert encoded["values"][1:] == [[1.29, 0.95], [0.4, 0.6]]
+
+
+def test_arrow_only_for_large_tables():
+    small, large = encode_tables([SMALL, LARGE], "arrow")
+    assert small["encoding"] == "columnar"
+    assert large["encoding"] == "arrow"
+
+    pa = pytest.importorskip("pyarrow")
+    table = pa.ipc.open_stream(base64.b64decode(large["data"])).read_all()
+    assert table.column_names == ["Row", "Value"]
+    assert table.column("Value").to_pylist() == [float(i) for i in range(300)]
+    assert table.schema.field("Value").metadata[b"dtype"] == b"numeric"
+
+
+def test_arrow_falls_back_to_columnar_without_pyarrow(monkeypatch):
+    monkeypatch.setattr(table_codec, "_pyarrow", None)
+    monkeypatch.setattr(table_codec, "_pyarrow_failed", True)
+    encoded = encode_tables([LARGE], "arrow")[0]
+    assert encoded == encode_tables([LARGE], "columnar")[0]
@@ -0,0 +1,47 @@
+"""Tests for the markdown table parser's number and dtype handling."""
+
+import pytest
+
+from table_parser import parse_number, parse_tables
+
+MONTHS_TABLE = """| Month | Spend | CTR |
+|---|---|---|
+| Jan 2024 | AED1,000 | 1.2% |
+| Feb 2024 | AED2,500 | 0.9% |
+| Top 10 | AED3,000 | 1.0% |
+"""
+
+
+def test_currency_numbers():
+    """Currency codes and symbols are stripped; the amount is kept"""
+    assert parse_number("AED1.29") == 1.29
+    assert parse_number("usd 4") == 4.0
+    assert parse_number("$4") == 4.0
+    assert parse_number("EUR 1,200.50") == 1200.5
+    assert parse_number("11,630") == 11630.0
+    assert parse_number("2.5k") == 2500.0
+
+
+def test_percent_is_a_fraction_everywhere():
+    """parse_number and the column dtypes read "12%" on the same scale"""
+    assert parse_number("12%") == 0.12
+    table = parse_tables(MONTHS_TABLE)[0]
+    assert table.columnar()["values"][2] == [parse_number(cell) for cell in ("1.2%", "0.9%", "1.0%")]
+    assert table.to_dataframe()["CTR"].tolist() == pytest.approx([0.012, 0.009, 0.01])
+
+
+def test_words_are_not_currency():
+    """Month-year and other word + number labels stay text"""
+    for cell in ("Jan 2024", "Feb 2024", "Sep 2025", "Top 10", "Q1 2025", "Day 3"):
+        assert parse_number(cell) is None, cell
+
+
+def test_month_year_column_is_text():
+    table = parse_tables(MONTHS_TABLE)[0]
+    columnar = table.columnar()
+    assert columnar["dtypes"] == ["text", "currency", "percent"]
+    assert columnar["units"] == [None, "AED", "%"]
+    assert columnar["values"][0] == ["Jan 2024", "Feb 2024", "Top 10"]
+    frame = table.to_dataframe()
+    assert frame["Month"].tolist() == ["Jan 2024", "Feb 2024", "Top 10"]
+    assert frame["Spend"].tolist() == [1000.0, 2500.0, 3000.0]
@@ -0,0 +1,120 @@
+"""Tests for the username -> user id cache and the chat-history user upsert."""
+
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+from user_cache import UserIdCache
+
+# The app reads DATABASE_URL on import: point it at a scratch SQLite file
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/test_user_cache.db")
+
+
+def test_cache_serves_ids_until_they_expire():
+    cache = UserIdCache(ttl=0.05)
+    assert cache.get("alice") is None
+    cache.put("alice", 7)
+    assert cache.get("alice") == 7
+    time.sleep(0.06)
+    assert cache.get("alice") is None
+    assert cache.stats() == {"entries": 0, "hits": 1, "misses": 2, "ttl": 0.05}
+
+
+def test_cache_evicts_the_least_recently_used():
+    cache = UserIdCache(max_entries=2)
+    cache.put("alice", 1)
+    cache.put("bob", 2)
+    cache.get("alice")
+    cache.put("carol", 3)
+    assert (cache.get("alice"), cache.get("bob"), cache.get("carol")) == (1, None, 3)
+
+
+def test_invalidate_and_clear():
+    cache = UserIdCache()
+    cache.put("alice", 1)
+    cache.put("bob", 2)
+    cache.invalidate("alice")
+    assert cache.get("alice") is None and cache.get("bob") == 2
+    cache.clear()
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.fixture(scope="module")
+def app_module():
+    import app
+    app.init_database()
+    return app
+
+
+@pytest.fixture
+def statements(app_module):
+    from sqlalchemy import event
+
+    executed = []
+
+    def record(conn, cursor, statement, *args):
+        executed.append(statement)
+
+    with app_module.app.app_context():
+        engine = app_module.db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine, "before_cursor_execute", record)
+
+
+def count_users(app_module, username):
+    with app_module.app.app_context():
+        return app_module.User.query.filter_by(username=username).count()
+
+
+def test_upsert_creates_the_user_once(app_module):
+    with app_module.app.app_context():
+        user_id = app_module.upsert_history_user("upsert-once")
+        assert app_module.upsert_history_user("upsert-once") == user_id
+    assert count_users(app_module, "upsert-once") == 1
+
+
+def test_history_user_id_is_cached_after_the_first_lookup(app_module, statements):
+    with app_module.app.app_context():
+        user_id = app_module.get_history_user_id("cached-user")
+        statements.clear()
+        assert app_module.get_history_user_id("cached-user") == user_id
+        assert statements == []
+
+        app_module.get_user_id_cache().invalidate("cached-user")
+        assert app_module.get_history_user_id("cached-user") == user_id
+        assert len(statements) == 1
+
+
+def test_concurrent_first_requests_share_one_user_row(app_module):
+    barrier = threading.Barrier(8)
+    ids = []
+
+    def resolve():
+        with app_module.app.app_context():
+            barrier.wait()
+            ids.append(app_module.upsert_history_user("racing-user"))
+            app_module.db.session.remove()
+
+    threads = [threading.Thread(target=resolve) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(ids) == 8 and len(set(ids)) == 1
+    assert count_users(app_module, "racing-user") == 1
+
+
+def test_database_errors_are_not_cached(app_module, monkeypatch):
+    def fail(username):
+        raise RuntimeError("database down")
+
+    with app_module.app.app_context():
+        monkeypatch.setattr(app_module, "upsert_history_user", fail)
+        assert app_module.get_history_user_id("unlucky-user") is None
+        monkeypatch.undo()
+        assert app_module.get_history_user_id("unlucky-user") is not None
@@ -0,0 +1,73 @@
+"""
+In-process username -> user id cache for chat history.
+
+Every history endpoint and every saved chat turn needs the database id of
+the JWT identity. Usernames never change id while the row exists, so the id
+is looked up (or the row created) once and then served from memory until
+USER_ID_CACHE_TTL seconds pass or the entry is invalidated (logout, a
+failed history write). The cache is bounded, least recently used first.
+Each worker process keeps its own.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+USER_ID_CACHE_TTL = float(os.getenv("USER_ID_CACHE_TTL", "300"))
+USER_ID_CACHE_MAX_ENTRIES = int(os.getenv("USER_ID_CACHE_MAX_ENTRIES", "10000"))
+
+
+class UserIdCache:
+    def __init__(self, ttl=USER_ID_CACHE_TTL, max_entries=USER_ID_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # username -> (user_id, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username):
+        """The cached id for a username, or None if missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[username]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, username, user_id):
+        with self._lock:
+            self._entries.pop(username, None)
+            self._entries[username] = (user_id, time.monotonic() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username):
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "ttl": self.ttl}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_user_id_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = UserIdCache()
+        return _cache
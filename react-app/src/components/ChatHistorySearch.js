@@ -116,6 +116,28 @@ const Answer = styled.div`
   overflow: hidden;
 `;
 
+const Highlight = styled.mark`
+  background: #fefcbf;
+  color: inherit;
+  padding: 0 1px;
+`;
+
+const MoreButton = styled.button`
+  display: block;
+  width: 100%;
+  padding: 12px;
+  background: none;
+  border: none;
+  color: #FF6B35;
+  font-size: 14px;
+  cursor: pointer;
+  
+  &:disabled {
+    opacity: 0.6;
+    cursor: not-allowed;
+  }
+`;
+
 const NoResults = styled.div`
   padding: 40px 20px;
   text-align: center;
@@ -141,6 +163,9 @@ function ChatHistorySearch({ isOpen, onClose, onResultClick }) {
   const [results, setResults] = useState([]);
   const [loading, setLoading] = useState(false);
   const [searched, setSearched] = useState(false);
+  // Offset of the next page of ranked results, null when there are no more
+  const [nextOffset, setNextOffset] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   const handleSearch = async () => {
     if (!query.trim()) return;
@@ -148,9 +173,11 @@ function ChatHistorySearch({ isOpen, onClose, onResultClick }) {
     try {
       setLoading(true);
       setSearched(true);
+      setNextOffset(null);
       const response = await chatHistoryAPI.searchChatHistory(query.trim());
       if (response.success) {
         setResults(response.search_results || []);
+        setNextOffset(response.next_offset);
       } else {
         toast.error('Search failed');
         setResults([]);
@@ -164,6 +191,24 @@ function ChatHistorySearch({ isOpen, onClose, onResultClick }) {
     }
   };
 
+  const handleMore = async () => {
+    try {
+      setLoadingMore(true);
+      const response = await chatHistoryAPI.searchChatHistory(query.trim(), { offset: nextOffset });
+      if (response.success) {
+        setResults(prev => [...prev, ...(response.search_results || [])]);
+        setNextOffset(response.next_offset);
+      } else {
+        toast.error('Search failed');
+      }
+    } catch (error) {
+      console.error('Search error:', error);
+      toast.error('Search failed');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleKeyPress = (e) => {
     if (e.key === 'Enter') {
       handleSearch();
@@ -182,6 +227,12 @@ function ChatHistorySearch({ isOpen, onClose, onResultClick }) {
     return date.toLocaleDateString() + ' ' + date.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
   };
 
+  // Snippets mark matches with <mark>...</mark>; render those as highlights without injecting HTML
+  const renderSnippet = (snippet) =>
+    snippet.split(/<\/?mark>/).map((part, index) =>
+      index % 2 === 1 ? <Highlight key={index}>{part}</Highlight> : part
+    );
+
   const truncateText = (text, maxLength = 150) => {
     if (text.length <= maxLength) return text;
     return text.substring(0, maxLength) + '...';
@@ -221,16 +272,23 @@ function ChatHistorySearch({ isOpen, onClose, onResultClick }) {
               </div>
             </NoResults>
           ) : results.length > 0 ? (
-            results.map((result, index) => (
-              <ResultItem key={index} onClick={() => handleResultClick(result)}>
-                <ResultHeader>
-                  <SessionName>{result.session_name}</SessionName>
-                  <Timestamp>{formatDate(result.timestamp)}</Timestamp>
-                </ResultHeader>
-                <Question>{truncateText(result.question)}</Question>
-                <Answer>{truncateText(result.answer)}</Answer>
-              </ResultItem>
-            ))
+            <>
+              {results.map((result, index) => (
+                <ResultItem key={index} onClick={() => handleResultClick(result)}>
+                  <ResultHeader>
+                    <SessionName>{result.session_name}</SessionName>
+                    <Timestamp>{formatDate(result.timestamp)}</Timestamp>
+                  </ResultHeader>
+                  <Question>{truncateText(result.question)}</Question>
+                  <Answer>{renderSnippet(result.snippet || '')}</Answer>
+                </ResultItem>
+              ))}
+              {nextOffset !== null && nextOffset !== undefined && (
+                <MoreButton onClick={handleMore} disabled={loadingMore}>
+                  {loadingMore ? 'Loading...' : 'Show more results'}
+                </MoreButton>
+              )}
+            </>
           ) : (
             <NoResults>
               <Search size={48} style={{ marginBottom: '16px', opacity: 0.5 }} />
@@ -452,7 +452,8 @@ const ChatHistorySidebar = React.forwardRef(({ currentSessionId, setCurrentSessi
   const loadChatHistory = async () => {
     try {
       setLoading(true);
-      const response = await chatHistoryAPI.getAllChatHistory();
+      // Only names and message counts are shown here, so skip the message bodies
+      const response = await chatHistoryAPI.getAllChatHistory({ summary: true });
       if (response.success) {
         setChatHistory(response.chat_history || []);
         
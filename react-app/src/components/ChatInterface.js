@@ -4,7 +4,7 @@ import ChatMessage from './ChatMessage';
 import { Send, Paperclip, X } from 'lucide-react';
 import styled from 'styled-components';
 import toast from 'react-hot-toast';
-import { fileAPI, chatAPI, chatHistoryAPI } from '../services/api';
+import { fileAPI, chatAPI, chatHistoryAPI, plotAPI } from '../services/api';
 
 const ChatContainer = styled.div`
   display: flex;
@@ -235,6 +235,23 @@ const LoadingContainer = styled.div`
   }
 `;
 
+const LoadEarlierButton = styled.button`
+  display: block;
+  margin: 0 auto 16px auto;
+  padding: 8px 16px;
+  background: transparent;
+  color: #667eea;
+  border: 1px solid #667eea;
+  border-radius: 8px;
+  font-size: 14px;
+  cursor: pointer;
+  
+  &:disabled {
+    opacity: 0.6;
+    cursor: not-allowed;
+  }
+`;
+
 const KnowledgeBaseStatus = styled.div`
   margin: 20px;
   padding: 16px;
@@ -283,12 +300,17 @@ const StatusText = styled.p`
 function ChatInterface({ currentSessionId, currentSessionData, onSessionChange, onSessionRenamed }) {
   const [userInput, setUserInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  // True once the streamed answer has started to appear, replacing the loading spinner
+  const [streamingAnswer, setStreamingAnswer] = useState(false);
   const [isUploading, setIsUploading] = useState(false);
   const [knowledgeBase, setKnowledgeBase] = useState('');
   const [showFileUpload, setShowFileUpload] = useState(false);
   const [showUploadInterface, setShowUploadInterface] = useState(false);
   const [messages, setMessages] = useState([]);
   const [loadingMessages, setLoadingMessages] = useState(false);
+  // Cursor for the page of messages before the oldest one shown, null when all are loaded
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const [isCreatingNewSession, setIsCreatingNewSession] = useState(false);
   const messagesEndRef = useRef(null);
   const textareaRef = useRef(null);
@@ -340,6 +362,56 @@ function ChatInterface({ currentSessionId, currentSessionData, onSessionChange,
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
   };
 
+  // Convert database messages to the format expected by ChatMessage component
+  // We need to create separate messages for user questions and AI answers
+  const formatHistoryMessages = (dbMessages) => {
+    const formattedMessages = [];
+    
+    dbMessages.forEach(msg => {
+      // Format timestamp for display
+      const timestamp = new Date(msg.timestamp).toLocaleString();
+      
+      // Add user question message
+      formattedMessages.push({
+        q: msg.question,
+        a: '',
+        timestamp: timestamp,
+        type: 'user'
+      });
+      
+      // Add AI answer message
+      formattedMessages.push({
+        q: '',
+        a: msg.answer,
+        timestamp: timestamp,
+        type: 'ai'
+      });
+    });
+    
+    return formattedMessages;
+  };
+
+  // Long sessions load their latest page first; older pages are prepended on request
+  const loadEarlierMessages = async () => {
+    if (!currentSessionId || !olderCursor) return;
+    
+    try {
+      setLoadingOlder(true);
+      const response = await chatHistoryAPI.getSessionHistory(currentSessionId, { before: olderCursor });
+      if (response.success) {
+        setMessages(prev => [...formatHistoryMessages(response.session.messages), ...prev]);
+        setOlderCursor(response.session.before_cursor);
+      } else {
+        toast.error('Failed to load earlier messages');
+      }
+    } catch (error) {
+      console.error('Load earlier messages error:', error);
+      toast.error('Failed to load earlier messages');
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const loadSessionMessages = async () => {
     if (!currentSessionId) return;
     
@@ -350,32 +422,8 @@ function ChatInterface({ currentSessionId, currentSessionData, onSessionChange,
       console.log('Session history response:', response);
       
       if (response.success) {
-        // Convert database messages to the format expected by ChatMessage component
-        // We need to create separate messages for user questions and AI answers
-        const formattedMessages = [];
-        
-        response.session.messages.forEach(msg => {
-          // Format timestamp for display
-          const timestamp = new Date(msg.timestamp).toLocaleString();
-          
-          // Add user question message
-          formattedMessages.push({
-            q: msg.question,
-            a: '',
-            timestamp: timestamp,
-            type: 'user'
-          });
-          
-          // Add AI answer message
-          formattedMessages.push({
-            q: '',
-            a: msg.answer,
-            timestamp: timestamp,
-            type: 'ai'
-          });
-        });
-        
-        setMessages(formattedMessages);
+        setMessages(formatHistoryMessages(response.session.messages));
+        setOlderCursor(response.session.before_cursor);
       } else {
         toast.error('Failed to load session messages');
       }
@@ -404,6 +452,7 @@ function ChatInterface({ currentSessionId, currentSessionData, onSessionChange,
       isCreatingNewSession,
       messagesLength: messages.length
     });
+    setOlderCursor(null);
     
     if (currentSessionId && !isCreatingNewSession) {
       console.log('Loading messages for session:', currentSessionId);
@@ -516,6 +565,25 @@ function ChatInterface({ currentSessionId, currentSessionData, onSessionChange,
     adjustTextareaHeight();
   };
 
+  const pollPlotJob = async (jobId) => {
+    try {
+      const job = await plotAPI.waitForPlot(jobId);
+      setMessages(prev => prev.map(m => (
+        m.plot_job_id === jobId
+          ? { ...m, plot_id: job.plot_id, plot_code: job.plot_code, plotPending: false }
+          : m
+      )));
+      if (job.status === 'failed') {
+        console.warn('🎨 Plot job failed:', job.error);
+      }
+    } catch (error) {
+      console.error('Error polling plot job:', error);
+      setMessages(prev => prev.map(m => (
+        m.plot_job_id === jobId ? { ...m, plotPending: false } : m
+      )));
+    }
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     if (!userInput.trim() || isLoading) return;
@@ -628,15 +696,50 @@ function ChatInterface({ currentSessionId, currentSessionData, onSessionChange,
         currentSessionName: currentSessionData?.session_name
       });
       
-      // Get AI response from backend
-      const response = await chatAPI.sendMessage(
-        question, 
-        knowledgeBase, 
-        messages, 
-        sessionName
-      );
+      // Stream the answer into a placeholder message: text as it arrives, each table once complete
+      const streamKey = `stream-${Date.now()}`;
+      let started = false;
+      const updateStreamed = (update) => setMessages(prev => prev.map(m => (
+        m.streamKey === streamKey ? { ...m, ...update(m) } : m
+      )));
+      const startStream = () => {
+        if (started) return;
+        started = true;
+        setStreamingAnswer(true);
+        setMessages(prev => [...prev, {
+          q: '',
+          a: '',
+          timestamp: new Date().toLocaleString(),
+          type: 'ai',
+          tables: [],
+          streamKey
+        }]);
+      };
+
+      let response;
+      try {
+        response = await chatAPI.streamMessage(question, knowledgeBase, messages, sessionName, {
+          onDelta: (text) => {
+            startStream();
+            updateStreamed(m => ({ a: m.a + text }));
+          },
+          onTable: (table, tableIndex) => {
+            startStream();
+            updateStreamed(m => {
+              const tables = [...m.tables];
+              tables[tableIndex] = table;
+              return { tables };
+            });
+          }
+        });
+      } catch (error) {
+        if (started) throw error;
+        // Nothing shown yet (e.g. a proxy that buffers streams): fetch the whole answer instead
+        console.warn('Streaming failed, requesting the full answer:', error);
+        response = await chatAPI.sendMessage(question, knowledgeBase, messages, sessionName);
+      }
       
-      if (response.success) {
+      if (response?.success) {
         // Add AI response as a separate message
         const aiMessage = {
           q: '',
@@ -644,8 +747,13 @@ function ChatInterface({ currentSessionId, currentSessionData, onSessionChange,
           timestamp: response.timestamp,
           type: 'ai',
           tables: response.tables || [],
+          table_ids: response.table_ids || [],
           plot: response.plot,
           plot_code: response.plot_code,
+          plot_job_id: response.plot_job_id,
+          plot_spec: response.plot_spec,
+          plot_id: response.plot_id,
+          plotPending: !!response.plot_job_id,
           sources: response.sources
         };
 
@@ -687,7 +795,15 @@ function ChatInterface({ currentSessionId, currentSessionData, onSessionChange,
           timestamp: response.timestamp
         });
 
-        setMessages(prev => [...prev, aiMessage]);
+        // The final message replaces the streamed placeholder
+        setMessages(prev => (
+          started ? prev.map(m => (m.streamKey === streamKey ? aiMessage : m)) : [...prev, aiMessage]
+        ));
+
+        // Plot is rendered in the background; fill it in when the job finishes
+        if (response.plot_job_id) {
+          pollPlotJob(response.plot_job_id);
+        }
 
         // Session already has unique name, no need to rename
 
@@ -700,6 +816,7 @@ function ChatInterface({ currentSessionId, currentSessionData, onSessionChange,
       console.error('Error:', error);
     } finally {
       setIsLoading(false);
+      setStreamingAnswer(false);
       setIsCreatingNewSession(false);
     }
   };
@@ -764,12 +881,19 @@ function ChatInterface({ currentSessionId, currentSessionData, onSessionChange,
               </p>
             </EmptyState>
           ) : (
-            messages.map((message, index) => (
-              <ChatMessage key={index} message={message} />
-            ))
+            <>
+              {olderCursor && (
+                <LoadEarlierButton onClick={loadEarlierMessages} disabled={loadingOlder}>
+                  {loadingOlder ? 'Loading...' : 'Load earlier messages'}
+                </LoadEarlierButton>
+              )}
+              {messages.map((message, index) => (
+                <ChatMessage key={index} message={message} />
+              ))}
+            </>
           )}
           
-          {isLoading && (
+          {isLoading && !streamingAnswer && (
             <LoadingContainer>
               <div className="spinner" style={{ width: '32px', height: '32px' }}></div>
               <p>Generating response...</p>
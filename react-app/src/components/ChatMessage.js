@@ -3,7 +3,9 @@ import ReactMarkdown from 'react-markdown';
 import { User, Bot, Clock, Download, BarChart3, Table as TableIcon } from 'lucide-react';
 import styled from 'styled-components';
 import ChartRenderer from './ChartRenderer';
+import SpecChart from './SpecChart';
 import ErrorBoundary from './ErrorBoundary';
+import { plotAPI, tableAPI } from '../services/api';
 
 const MessageContainer = styled.div`
   display: flex;
@@ -253,6 +255,11 @@ const DownloadButton = styled.button`
   }
 `;
 
+const DownloadButtons = styled.div`
+  display: flex;
+  gap: 8px;
+`;
+
 const Table = styled.table`
   border-collapse: collapse;
   width: 100%;
@@ -360,9 +367,9 @@ function ChatMessage({ message }) {
   const isUser = message.type === 'user';
   
   // Debug logging for plot data
-  if (!isUser && (message.plot || message.plot_code)) {
+  if (!isUser && (message.plot || message.plot_id || message.plot_code)) {
     console.log('📊 Plot data in message:', {
-      hasPlot: !!message.plot,
+      hasPlot: !!(message.plot || message.plot_id),
       plotLength: message.plot?.length || 0,
       hasPlotCode: !!message.plot_code,
       plotCodeLength: message.plot_code?.length || 0,
@@ -376,8 +383,8 @@ function ChatMessage({ message }) {
     // Handle both array format and object format
     const rows = table.data.map(row => {
       if (Array.isArray(row)) {
-        // If row is an array, join it directly
-        return row.join(',');
+        // If row is an array, join it directly, quoting cells like "11,630"
+        return row.map(value => (typeof value === 'string' && value.includes(',') ? `"${value}"` : value)).join(',');
       } else {
         // If row is an object, extract values based on headers
         return table.headers.map(header => {
@@ -402,9 +409,40 @@ function ChatMessage({ message }) {
     window.URL.revokeObjectURL(url);
   };
   
-  const downloadPlotAsPNG = (plotImage) => {
+  // Stored tables are exported by the server (typed CSV, XLSX); fall back to building the CSV here
+  const downloadTable = async (table, index, format = 'csv') => {
+    const tableId = message.table_ids?.[index];
+    if (!tableId) {
+      downloadTableAsCSV(table, index);
+      return;
+    }
+    try {
+      const blob = await tableAPI.download(tableId, format);
+      const url = window.URL.createObjectURL(blob);
+      const a = document.createElement('a');
+      a.href = url;
+      a.download = `table_${index + 1}_${Date.now()}.${format}`;
+      a.click();
+      window.URL.revokeObjectURL(url);
+    } catch (error) {
+      console.error('Table download error:', error);
+      if (format === 'csv') downloadTableAsCSV(table, index);
+    }
+  };
+  
+  // Plots are a chart spec drawn in the browser, a plot store reference or legacy inline base64
+  const plotSrc = message.plot_spec ? null
+    : message.plot_id ? plotAPI.imageUrl(message.plot_id)
+    : message.plot ? `data:image/png;base64,${message.plot}` : null;
+
+  const downloadPlotAsPNG = () => {
     const link = document.createElement('a');
-    link.href = `data:image/png;base64,${plotImage}`;
+    if (message.plot_id) {
+      // Download the print-resolution variant; the server sends it as an attachment
+      link.href = `${plotAPI.imageUrl(message.plot_id, 'print')}&download=1`;
+    } else {
+      link.href = plotSrc;
+    }
     link.download = `plot_${Date.now()}.png`;
     link.click();
   };
@@ -435,7 +473,7 @@ function ChatMessage({ message }) {
                 <ReactMarkdown>{message.a}</ReactMarkdown>
                 
                 {/* Show visualizations if available */}
-                {(message.tables && message.tables.length > 0) || message.plot ? (
+                {(message.tables && message.tables.length > 0) || plotSrc || message.plot_spec || message.plotPending ? (
                   <VisualizationSection>
                     {/* Tables Section */}
                     {message.tables && message.tables.length > 0 && (
@@ -456,10 +494,18 @@ function ChatMessage({ message }) {
                                   <TableIcon size={16} />
                                   Table {index + 1}
                                 </TableTitle>
-                                <DownloadButton onClick={() => downloadTableAsCSV({ headers, data }, index)}>
-                                  <Download size={14} />
-                                  Download CSV
-                                </DownloadButton>
+                                <DownloadButtons>
+                                  <DownloadButton onClick={() => downloadTable({ headers, data }, index)}>
+                                    <Download size={14} />
+                                    Download CSV
+                                  </DownloadButton>
+                                  {message.table_ids?.[index] && (
+                                    <DownloadButton onClick={() => downloadTable({ headers, data }, index, 'xlsx')}>
+                                      <Download size={14} />
+                                      Excel
+                                    </DownloadButton>
+                                  )}
+                                </DownloadButtons>
                               </TableHeader>
                               <Table>
                                 <thead>
@@ -490,8 +536,35 @@ function ChatMessage({ message }) {
                       </>
                     )}
                     
+                    {/* Plot still rendering in the background */}
+                    {message.plotPending && (
+                      <SectionTitle>
+                        <BarChart3 size={18} />
+                        Generating visualization...
+                      </SectionTitle>
+                    )}
+                    
+                    {/* Chart spec rendered client-side; the server only rasterizes on download */}
+                    {message.plot_spec && (
+                      <>
+                        <SectionTitle>
+                          <BarChart3 size={18} />
+                          Generated Visualization
+                        </SectionTitle>
+                        <ErrorBoundary>
+                          <SpecChart spec={message.plot_spec} />
+                        </ErrorBoundary>
+                        {message.plot_id && (
+                          <PlotDownloadButton onClick={downloadPlotAsPNG}>
+                            <Download size={16} />
+                            Download Plot as PNG
+                          </PlotDownloadButton>
+                        )}
+                      </>
+                    )}
+                    
                     {/* Plot Section */}
-                    {(message.plot || message.plot_code) && (
+                    {(plotSrc || message.plot_code) && (
                       <>
                         <SectionTitle>
                           <BarChart3 size={18} />
@@ -507,7 +580,7 @@ function ChatMessage({ message }) {
                             borderRadius: '4px', 
                             fontSize: '12px' 
                           }}>
-                            Debug: Plot={!!message.plot}, PlotCode={!!message.plot_code}
+                            Debug: Plot={!!plotSrc}, PlotCode={!!message.plot_code}
                           </div>
                         )}
                         
@@ -522,19 +595,19 @@ function ChatMessage({ message }) {
                         )}
                         
                         {/* Fallback to base64 image if available */}
-                        {message.plot && (
+                        {plotSrc && (
                           <PlotContainer>
                             <PlotTitle>
                               <BarChart3 size={16} />
                               Data Visualization
                             </PlotTitle>
                             <PlotImage 
-                              src={`data:image/png;base64,${message.plot}`} 
+                              src={plotSrc} 
                               alt="Generated Plot"
                               onLoad={() => console.log('✅ Plot image loaded successfully')}
                               onError={(e) => console.error('❌ Plot image failed to load:', e)}
                             />
-                            <PlotDownloadButton onClick={() => downloadPlotAsPNG(message.plot)}>
+                            <PlotDownloadButton onClick={downloadPlotAsPNG}>
                               <Download size={16} />
                               Download Plot as PNG
                             </PlotDownloadButton>
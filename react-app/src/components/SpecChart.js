@@ -0,0 +1,134 @@
+import React, { useMemo } from 'react';
+import {
+  Chart as ChartJS,
+  CategoryScale,
+  LinearScale,
+  PointElement,
+  LineElement,
+  BarElement,
+  Title,
+  Tooltip,
+  Legend,
+  ArcElement,
+} from 'chart.js';
+import { Bar, Line, Pie } from 'react-chartjs-2';
+import styled from 'styled-components';
+
+ChartJS.register(
+  CategoryScale,
+  LinearScale,
+  PointElement,
+  LineElement,
+  BarElement,
+  Title,
+  Tooltip,
+  Legend,
+  ArcElement
+);
+
+const Grid = styled.div`
+  display: grid;
+  grid-template-columns: repeat(auto-fit, minmax(280px, 1fr));
+  gap: 16px;
+  margin: 16px 0;
+`;
+
+const Panel = styled.div`
+  background: white;
+  border-radius: 12px;
+  padding: 16px;
+  box-shadow: 0 4px 12px rgba(0, 0, 0, 0.1);
+  border: 1px solid #e2e8f0;
+`;
+
+const PanelTitle = styled.h4`
+  color: #2d3748;
+  margin: 0 0 12px 0;
+  font-weight: 600;
+  font-size: 14px;
+  text-align: center;
+`;
+
+const DEFAULT_COLORS = ['#FF6B35', '#004E89', '#1A936F', '#F7B801', '#6A4C93', '#C5283D', '#3BCEAC', '#8D99AE'];
+
+// Renders the Vega-Lite specs produced by the server's chart builder with Chart.js.
+// Supports single views and concat of arc, bar and line marks over inline data.
+const toPanel = (view, datasets) => {
+  const mark = typeof view.mark === 'string' ? { type: view.mark } : view.mark || {};
+  const encoding = view.encoding || {};
+  const values = view.data?.values || datasets?.[view.data?.name] || [];
+  const title = typeof view.title === 'string' ? view.title : view.title?.text;
+
+  if (mark.type === 'arc') {
+    const labelField = encoding.color?.field;
+    const valueField = encoding.theta?.field;
+    const colors = encoding.color?.scale?.range || DEFAULT_COLORS;
+    return {
+      type: 'pie',
+      title,
+      data: {
+        labels: values.map(row => row[labelField]),
+        datasets: [{ data: values.map(row => row[valueField]), backgroundColor: colors }],
+      },
+      options: { responsive: true, plugins: { legend: { position: 'bottom' } } },
+    };
+  }
+
+  // The nominal channel carries the labels; a nominal y axis means horizontal bars
+  const horizontal = encoding.y?.type === 'nominal';
+  const labelChannel = horizontal ? encoding.y : encoding.x;
+  const valueChannel = horizontal ? encoding.x : encoding.y;
+  const color = mark.color || DEFAULT_COLORS[1];
+  return {
+    type: mark.type === 'line' ? 'line' : 'bar',
+    title,
+    data: {
+      labels: values.map(row => row[labelChannel?.field]),
+      datasets: [{
+        label: valueChannel?.title || valueChannel?.field,
+        data: values.map(row => row[valueChannel?.field]),
+        backgroundColor: mark.type === 'line' ? 'transparent' : color,
+        borderColor: color,
+        borderWidth: 2,
+        pointRadius: mark.point ? 4 : 0,
+      }],
+    },
+    options: {
+      responsive: true,
+      indexAxis: horizontal ? 'y' : 'x',
+      plugins: { legend: { display: false } },
+      scales: {
+        x: { title: { display: true, text: (horizontal ? valueChannel : labelChannel)?.title || '' } },
+        y: { title: { display: true, text: (horizontal ? labelChannel : valueChannel)?.title || '' } },
+      },
+    },
+  };
+};
+
+const CHARTS = { bar: Bar, line: Line, pie: Pie };
+
+function SpecChart({ spec }) {
+  const panels = useMemo(() => {
+    if (!spec) return [];
+    const views = spec.concat || spec.hconcat || spec.vconcat || [spec];
+    return views.map(view => toPanel(view, spec.datasets));
+  }, [spec]);
+
+  if (panels.length === 0) return null;
+
+  return (
+    <Grid>
+      {panels.map((panel, index) => {
+        const Chart = CHARTS[panel.type];
+        return (
+          <Panel key={index}>
+            {panel.title && <PanelTitle>{panel.title}</PanelTitle>}
+            <Chart data={panel.data} options={panel.options} />
+          </Panel>
+        );
+      })}
+    </Grid>
+  );
+}
+
+export default SpecChart;
@@ -107,14 +107,116 @@ export const fileAPI = {
   },
 };
 
+// Tables are requested column-major (names once, one value array per column) instead of
+// one { header: cell } object per row
+const COLUMNAR_TABLES = 'application/vnd.tonic.columnar+json';
+
+const formatCell = (value, dtype, unit) => {
+  if (value === null || value === undefined) return '';
+  if (dtype === 'percent') return `${+(value * 100).toFixed(2)}%`;
+  const number = value.toLocaleString('en-US', { maximumFractionDigits: 2 });
+  return dtype === 'currency' ? `${unit}${number}` : number;
+};
+
+// Columnar table -> the { headers, data } rows ChatMessage renders (subheader row first)
+export const decodeTable = (table) => {
+  if (!table || table.encoding !== 'columnar') return table;
+  const columns = table.values.map((values, j) => (
+    table.dtypes[j] === 'text' ? values : values.map(value => formatCell(value, table.dtypes[j], table.units[j]))
+  ));
+  const data = Array.from({ length: table.rows }, (_, i) => columns.map(column => column[i]));
+  return { headers: table.columns, data: table.subheaders ? [table.subheaders, ...data] : data };
+};
+
 export const chatAPI = {
   sendMessage: async (question, knowledgeBase, conversationHistory, sessionName = 'Default') => {
     const response = await api.post('/chat', {
       question,
       knowledge_base: knowledgeBase,
       conversation_history: conversationHistory,
-      session_name: sessionName
+      session_name: sessionName,
+      // Charts from tables come back as a Vega-Lite spec rendered in the browser
+      plot_format: 'spec'
+    }, { headers: { Accept: COLUMNAR_TABLES } });
+    return { ...response.data, tables: (response.data.tables || []).map(decodeTable) };
+  },
+
+  // Stream one answer: onDelta gets text chunks, onTable each table as soon as it is complete.
+  // Resolves with the final response (the same body sendMessage returns).
+  streamMessage: async (question, knowledgeBase, conversationHistory, sessionName = 'Default', { onDelta, onTable } = {}) => {
+    const token = localStorage.getItem('authToken');
+    const response = await fetch(`${API_BASE_URL}/chat/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        Accept: COLUMNAR_TABLES,
+        ...(token ? { Authorization: `Bearer ${token}` } : {}),
+      },
+      body: JSON.stringify({
+        question,
+        knowledge_base: knowledgeBase,
+        conversation_history: conversationHistory,
+        session_name: sessionName,
+        plot_format: 'spec'
+      }),
     });
+
+    if (!response.ok) {
+      const error = new Error(`Stream request failed with status ${response.status}`);
+      error.response = { status: response.status, data: await response.json().catch(() => null) };
+      throw error;
+    }
+
+    // Response is NDJSON: "delta" and "table" lines while the answer streams, then a "done" line
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let result = null;
+    let buffer = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+      const lines = buffer.split('\n');
+      buffer = lines.pop();
+      for (const line of lines) {
+        if (!line.trim()) continue;
+        const event = JSON.parse(line);
+        if (event.type === 'delta' && onDelta) onDelta(event.text);
+        else if (event.type === 'table' && onTable) onTable(decodeTable(event.table), event.index);
+        else if (event.type === 'done') result = { ...event, tables: event.tables.map(decodeTable) };
+      }
+      if (done) break;
+    }
+    return result;
+  },
+};
+
+export const plotAPI = {
+  // Poll a background plot job; status is pending, running, done or failed
+  getPlot: async (jobId) => {
+    const response = await api.get(`/plots/${jobId}`);
+    return response.data;
+  },
+
+  // Rendered plots are served from the content-addressed plot store; size is thumb, screen or print
+  imageUrl: (plotId, size = 'screen') => `${API_BASE_URL}/plots/${plotId}.png?size=${size}`,
+
+  waitForPlot: async (jobId, { interval = 1500, timeout = 180000 } = {}) => {
+    const deadline = Date.now() + timeout;
+    while (Date.now() < deadline) {
+      const job = await plotAPI.getPlot(jobId);
+      if (job.status === 'done' || job.status === 'failed') {
+        return job;
+      }
+      await new Promise(resolve => setTimeout(resolve, interval));
+    }
+    return { job_id: jobId, status: 'failed', error: 'Timed out waiting for plot' };
+  },
+};
+
+export const tableAPI = {
+  // Download a stored answer table as csv, xlsx or parquet (built once on the server, then cached)
+  download: async (tableId, format = 'csv') => {
+    const response = await api.get(`/tables/${tableId}.${format}`, { responseType: 'blob' });
     return response.data;
   },
 };
@@ -144,15 +246,24 @@ export const sessionAPI = {
 };
 
 export const chatHistoryAPI = {
-  // Get all chat history for the user
-  getAllChatHistory: async () => {
-    const response = await api.get('/chat-history');
-    return response.data;
+  // Get all chat history for the user, following the server's pages. With summary,
+  // sessions carry message counts but no messages.
+  getAllChatHistory: async ({ summary = false } = {}) => {
+    const sessions = [];
+    let cursor = null;
+    do {
+      const params = { limit: 200, ...(summary && { summary: 1 }), ...(cursor && { cursor }) };
+      const response = await api.get('/chat-history', { params });
+      if (!response.data.success) return response.data;
+      sessions.push(...response.data.chat_history);
+      cursor = response.data.next_cursor;
+    } while (cursor);
+    return { success: true, chat_history: sessions, total_sessions: sessions.length };
   },
   
-  // Get specific session history
-  getSessionHistory: async (sessionId) => {
-    const response = await api.get(`/chat-history/${sessionId}`);
+  // Get a page of a session's messages: the latest by default, or { before } / { after } a cursor
+  getSessionHistory: async (sessionId, { limit, before, after } = {}) => {
+    const response = await api.get(`/chat-history/${sessionId}`, { params: { limit, before, after } });
     return response.data;
   },
   
@@ -196,9 +307,9 @@ export const chatHistoryAPI = {
     return response.data;
   },
   
-  // Search chat history
-  searchChatHistory: async (query) => {
-    const response = await api.get(`/chat-history/search?q=${encodeURIComponent(query)}`);
+  // Search chat history: ranked results, a page at a time
+  searchChatHistory: async (query, { limit, offset } = {}) => {
+    const response = await api.get('/chat-history/search', { params: { q: query, limit, offset } });
     return response.data;
   },
   